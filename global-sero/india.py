@@ -1,7 +1,8 @@
 import pandas as pd
 from epimargin.etl.commons import download_data
-from epimargin.etl.covid19india import data_path, get_time_series, load_all_data
+from epimargin.etl.covid19india import data_path, get_time_series
 from epimargin.utils import setup
+from studies.shared.case_data import load_case_data
 
 data, _ = setup()
 
@@ -14,7 +15,7 @@ paths = {
 for target in paths['v3'] + paths['v4']:
     download_data(data, target)
 
-df = load_all_data(
+df = load_case_data(
     v3_paths = [data/filepath for filepath in paths['v3']], 
     v4_paths = [data/filepath for filepath in paths['v4']]
 )
@@ -1,8 +1,8 @@
 import epimargin.plots as plt
-import geopandas as gpd
 import numpy as np
 import pandas as pd
 from epimargin.utils import cwd
+from studies.shared.geometry import load_layer
 
 from pathlib import Path
 
@@ -38,7 +38,7 @@ plt.gcf().set_size_inches(3840/300, 1986/300)
 plt.savefig("./MH_Rt_timeseries.png")
 plt.clf()
 
-gdf = gpd.read_file("data/maharashtra.json", dpi = 600)
+gdf = load_layer("data/maharashtra.json", dpi = 600)
 
 gdf["Rt"] = gdf.district.map(latest_Rt)
 fig, ax = plt.subplots()
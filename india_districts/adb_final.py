@@ -4,11 +4,12 @@ import numpy as np
 import pandas as pd
 from epimargin.estimators import analytical_MPVS, linear_projection
 from epimargin.etl.commons import download_data
-from epimargin.etl.covid19india import data_path, get_time_series, load_all_data
+from epimargin.etl.covid19india import data_path, get_time_series
 from epimargin.models import SIR, NetworkedSIR
 from epimargin.policy import simulate_adaptive_control, simulate_lockdown
 from epimargin.smoothing import notched_smoothing
 from epimargin.utils import cwd, days, weeks
+from studies.shared.case_data import load_case_data
 from tqdm import tqdm
 
 # model details
@@ -35,7 +36,7 @@ for target in paths['v3'] + paths['v4']:
     except:
         pass 
 
-df = load_all_data(
+df = load_case_data(
     v3_paths = [data/filepath for filepath in paths['v3']], 
     v4_paths = [data/filepath for filepath in paths['v4']]
 )
@@ -1,11 +1,11 @@
 import pandas as pd
 
 from epimargin.estimators import analytical_MPVS
-from epimargin.etl.commons import download_data
-from epimargin.etl.covid19india import data_path, get_time_series, load_all_data
+from epimargin.etl.covid19india import get_time_series
 import epimargin.plots as plt
 from epimargin.smoothing import notched_smoothing
 from epimargin.utils import cwd
+from studies.shared.case_data import ingest, load_case_data
 
 # model details
 CI        = 0.95
@@ -18,22 +18,8 @@ figs = root/"figs"
 data.mkdir(exist_ok=True)
 figs.mkdir(exist_ok=True)
 
-# define data versions for api files
-paths = {
-    "v3": [data_path(i) for i in (1, 2)],
-    "v4": [data_path(i) for i in range(3, 27)]
-}
-
-for target in paths['v3'] + paths['v4']:
-    try: 
-        download_data(data, target)
-    except:
-        pass 
-
-df = load_all_data(
-    v3_paths = [data/filepath for filepath in paths['v3']], 
-    v4_paths = [data/filepath for filepath in paths['v4']]
-)
+# download new api files (and refresh the latest ones) since the last run
+df = load_case_data(*ingest(data))
 data_recency = str(df["date_announced"].max()).split()[0]
 run_date     = str(pd.Timestamp.now()).split()[0]
 
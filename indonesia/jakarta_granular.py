@@ -2,7 +2,6 @@ from logging import getLogger
 from pathlib import Path
 
 import epimargin.plots as plt
-import geopandas as gpd
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
@@ -14,6 +13,7 @@ from epimargin.models import SIR, NetworkedSIR
 from epimargin.policy import simulate_PID_controller
 from epimargin.smoothing import notched_smoothing
 from epimargin.utils import days, setup
+from studies.shared.geometry import load_layer
 from tqdm import tqdm
 
 logger = getLogger("DKIJ")
@@ -83,6 +83,13 @@ dkij_drop_cols = [
 
 shp_drop_cols = ['GID_0', 'NAME_0', 'GID_1', 'NAME_1', 'NL_NAME_1', 'GID_2', 'VARNAME_3', 'NAME_2', 'NL_NAME_2', 'TYPE_3', 'ENGTYPE_3', 'CC_3', 'HASC_3', 'NL_NAME_3', "GID_3"]
 
+jakarta_bbox = dict(minx = 106.65, maxx = 107.00, miny = -6.40, maxy = -6.05)
+
+def jakarta_subdistricts(gdf, drop, bbox):
+    gdf = gdf.query("NAME_1.str.startswith('Jakarta')").drop(columns = drop)
+    gdf.NAME_3 = gdf.NAME_3.str.upper()
+    return gdf[gdf.intersects(shapely.geometry.box(**bbox))]
+
 if __name__ == "__main__":
     (data, figs) = setup(level = "INFO")
     dkij = pd.read_stata(data/"coviddkijakarta_290920.dta")\
@@ -95,12 +102,8 @@ if __name__ == "__main__":
             subdistrict = dkij.subdistrict.apply(lambda name: next((k for (k, v) in replacements.items() if name in v), name)), 
         )
 
-    gdf = gpd.read_file("data/gadm36_IDN_shp/gadm36_IDN_3.shp")\
-            .query("NAME_1.str.startswith('Jakarta')")\
-            .drop(columns=shp_drop_cols)
-    gdf.NAME_3 = gdf.NAME_3.str.upper()
-    bbox = shapely.geometry.box(minx = 106.65, maxx = 107.00, miny = -6.40, maxy=-6.05)
-    gdf = gdf[gdf.intersects(bbox)]
+    # Jakarta subdistricts within the bounding box, prepared once and cached (see geometry.py)
+    gdf = load_layer("data/gadm36_IDN_shp/gadm36_IDN_3.shp", jakarta_subdistricts, rules = {"drop": shp_drop_cols, "bbox": jakarta_bbox})
 
     jakarta_districts = dkij.district.unique()
     jakarta_cases = dkij.groupby("date_positiveresult")["id"].count().rename("cases")
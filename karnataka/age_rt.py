@@ -2,10 +2,11 @@ import pandas as pd
 
 from epimargin.estimators import analytical_MPVS
 from epimargin.etl.commons import download_data
-from epimargin.etl.covid19india import data_path, get_time_series, load_all_data, load_data_v3, load_data_v4, drop_cols_v3, drop_cols_v4
+from epimargin.etl.covid19india import data_path, get_time_series
 import epimargin.plots as plt
 from epimargin.smoothing import notched_smoothing
 from epimargin.utils import cwd
+from studies.shared.case_data import load_case_data
 
 # model details
 CI        = 0.95
@@ -27,17 +28,9 @@ paths = {
 for target in paths['v3'] + paths['v4']:
     download_data(data, target)
 
-df = load_all_data(
+ka_cases = load_case_data(
     v3_paths = [data/filepath for filepath in paths['v3']], 
-    v4_paths = [data/filepath for filepath in paths['v4']]
-)
-
-drop_cols_v3.remove("Age Bracket")
-drop_cols_v4.remove("Age Bracket")
-
-cases_v3 = [load_data_v3(data/filepath, drop = drop_cols_v3) for filepath in paths["v3"]]
-cases_v4 = [load_data_v4(data/filepath, drop = drop_cols_v4) for filepath in paths["v4"]]
-all_cases = pd.concat(cases_v3 + cases_v4)
-
-ka_cases = all_cases.query("detected_state == 'Karnataka'")\
-    .dropna(subset = ["age_bracket"])
+    v4_paths = [data/filepath for filepath in paths['v4']],
+    columns  = None,
+    states   = ["Karnataka"]
+).dropna(subset = ["age_bracket"])
@@ -0,0 +1,222 @@
+import hashlib
+import inspect
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import requests
+from epimargin.etl.covid19india import (data_path, drop_cols_v3, drop_cols_v4,
+                                       load_data_v3, load_data_v4)
+
+""" parse-once cache of covid19india.org raw_data files
+
+load_all_data re-parses every v3/v4 raw_data*.csv (dates included) on each call. here each file is parsed once,
+cleaned the way load_all_data cleans it (status change date filled from announcement date, state and district names
+stripped and title-cased, rows without a state dropped), and written in a columnar format (Parquet when pyarrow is
+installed, else pickle) keyed by a content hash of the file and the source of its loader and cleaning steps, so
+re-downloading an unchanged file keeps its cache and a new API file is the only one parsed. the age bracket column
+is kept for scripts that need it; reads select columns and filter on detected_state (pushed down to Parquet row
+groups, which are written sorted by state) and restore each file's row order
+
+for daily refreshes, ingest downloads only API files newer than those in the cache manifest (re-fetching the last
+few, which covid19india.org kept appending to) and records their checksums, and district_timeseries keeps daily
+counts by district in the cache, recomputing only districts with rows in new, changed or removed files
+"""
+
+try:
+    import pyarrow
+    case_format = "parquet"
+except ImportError:
+    case_format = "pickle"
+
+# columns returned by load_all_data; age_bracket is also cached (v3 files only; load_data_v4 drops it) and can be projected
+case_columns = ["patient_number", "date_announced", "detected_district", "detected_state", "current_status", "status_change_date", "num_cases"]
+row_group_size = 1 << 16
+refresh_files  = 2 # latest ingested API files re-fetched by ingest, as new rows were appended to the newest ones
+v3_files       = 2 # raw_data1.csv and raw_data2.csv use the v3 schema, later files v4
+base_url       = "https://api.covid19india.org/csv/latest/"
+status_columns = {"Deceased": "dD", "Hospitalized": "dT", "Recovered": "dR"}
+
+@lru_cache(maxsize = None)
+def file_hash(path: Path, mtime: float, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def clean(cases: pd.DataFrame) -> pd.DataFrame:
+    """ the row-wise cleaning load_all_data applies after concatenating files """
+    cases["status_change_date"] = cases["status_change_date"].fillna(cases["date_announced"])
+    cases["detected_state"]     = cases["detected_state"].str.strip().str.title()
+    cases["detected_district"]  = cases["detected_district"].str.strip().str.title()
+    return cases.dropna(subset = ["detected_state"])
+
+def parse(path: Path, version: str) -> pd.DataFrame:
+    if version == "v3":
+        return clean(load_data_v3(path, drop = drop_cols_v3 - {"Age Bracket"}))
+    return clean(load_data_v4(path, drop = drop_cols_v4 - {"Age Bracket"}))
+
+def cache_key(path: Path, loader: Callable) -> str:
+    path   = Path(path)
+    digest = hashlib.sha256(file_hash(path, path.stat().st_mtime, path.stat().st_size).encode())
+    for function in (loader, clean, parse):
+        digest.update(inspect.getsource(function).encode())
+    return digest.hexdigest()
+
+def storable(cases: pd.DataFrame) -> pd.DataFrame:
+    """ cases with the object columns Parquet cannot store (read_csv can infer mixed int/str columns, e.g. patient
+    numbers) as nullable strings; nulls stay null and columns of a single type are left as they are """
+    mixed = [column for column in cases.columns[cases.dtypes == object] if pd.api.types.infer_dtype(cases[column], skipna = True).startswith("mixed")]
+    return cases.astype({column: "string" for column in mixed})
+
+def restored(cases: pd.DataFrame) -> pd.DataFrame:
+    """ inverse of storable up to the values' types: nullable string columns back to object columns with NaN for nulls """
+    for column in cases.columns[[isinstance(dtype, pd.StringDtype) and dtype.na_value is pd.NA for dtype in cases.dtypes]]:
+        cases[column] = cases[column].astype(object).where(cases[column].notna(), float("nan"))
+    return cases
+
+def write_cases(cases: pd.DataFrame, path: Path):
+    staging = path.with_name(path.name + ".tmp")
+    cases = cases.sort_values("detected_state", kind = "stable")
+    if case_format == "parquet":
+        storable(cases).to_parquet(staging, row_group_size = row_group_size)
+    else:
+        pd.to_pickle(cases, staging)
+    os.replace(staging, path)
+
+def read_cases(path: Path, columns: Optional[Sequence[str]] = None, states: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    if case_format == "parquet":
+        cases = restored(pd.read_parquet(path, columns = columns, filters = [("detected_state", "in", list(states))] if states is not None else None))
+    else:
+        cases = pd.read_pickle(path)
+        if states is not None:
+            cases = cases[cases["detected_state"].isin(states)]
+        if columns is not None:
+            cases = cases[columns]
+    return cases.sort_index(kind = "stable")
+
+def cache_path(path: Path, version: str, cache_dir: Optional[Path] = None) -> Path:
+    path      = Path(path)
+    cache_dir = Path(cache_dir) if cache_dir is not None else path.parent/"case_cache"
+    return cache_dir/f"{path.stem}_{cache_key(path, load_data_v3 if version == 'v3' else load_data_v4)[:16]}.{case_format}"
+
+def cached_cases(path: Path, version: str, cache_dir: Optional[Path] = None) -> Path:
+    """ path to the cleaned cache of a raw_data file, parsing it if it has not been cached """
+    cache = cache_path(path, version, cache_dir)
+    if not cache.exists():
+        cache.parent.mkdir(parents = True, exist_ok = True)
+        write_cases(parse(path, version), cache)
+    return cache
+
+def load_case_data(v3_paths: Sequence[Path], v4_paths: Sequence[Path], columns: Optional[Sequence[str]] = case_columns,
+    states: Optional[Sequence[str]] = None, cache_dir: Optional[Path] = None, workers: Optional[int] = None) -> pd.DataFrame:
+    """ load_all_data(v3_paths, v4_paths) from the cache under cache_dir (default: a case_cache folder next to each file);
+    columns selects columns (None for all, including age_bracket) and states keeps rows with those detected_state values """
+    files = [(path, "v3") for path in v3_paths] + [(path, "v4") for path in v4_paths]
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        caches = list(pool.map(lambda file: cached_cases(*file, cache_dir = cache_dir), files))
+        frames = list(pool.map(lambda cache: read_cases(cache, columns, states), caches))
+    return pd.concat(frames)
+
+def read_manifest(cache_dir: Path) -> dict:
+    path = cache_dir/"manifest.json"
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def write_manifest(cache_dir: Path, **entries):
+    """ update top level entries of the manifest """
+    manifest = {**read_manifest(cache_dir), **entries}
+    cache_dir.mkdir(parents = True, exist_ok = True)
+    staging = cache_dir/"manifest.json.tmp"
+    staging.write_text(json.dumps(manifest, indent = 2, sort_keys = True))
+    os.replace(staging, cache_dir/"manifest.json")
+
+def fetch(data: Path, filename: str, base_url: str = base_url) -> bool:
+    """ epimargin's download_data, but only writing (atomically) successful responses; returns whether the file was
+    fetched, so network errors leave files already on disk in use """
+    try:
+        response = requests.get(base_url + filename, timeout = 60)
+        response.raise_for_status()
+    except requests.RequestException:
+        return False
+    staging = data/(filename + ".tmp")
+    staging.write_bytes(response.content)
+    os.replace(staging, data/filename)
+    return True
+
+def split_versions(paths: Sequence[Path]) -> Tuple[List[Path], List[Path]]:
+    """ (v3_paths, v4_paths) for raw_data files """
+    index = lambda path: int(re.search(r"(\d+)", Path(path).stem).group(1))
+    paths = sorted(paths, key = index)
+    return ([_ for _ in paths if index(_) <= v3_files], [_ for _ in paths if index(_) > v3_files])
+
+def ingest(data: Path, download: bool = True, refresh: int = refresh_files, base_url: str = base_url, cache_dir: Optional[Path] = None) -> Tuple[List[Path], List[Path]]:
+    """ (v3_paths, v4_paths) of every API file ingested so far; with download, the last refresh files in the manifest are
+    re-fetched and new files are fetched until the API has none, so a daily run downloads (and later parses) a file or
+    two instead of the whole history. the manifest records each file's sha256, so changed files can be told apart """
+    data      = Path(data)
+    cache_dir = Path(cache_dir) if cache_dir is not None else data/"case_cache"
+    ingested  = sorted(int(re.search(r"(\d+)", name).group(1)) for name in read_manifest(cache_dir).get("files", {}))
+    if download:
+        refreshed = ingested[max(len(ingested) - refresh, 0):] # not ingested[-refresh:], which is every file for refresh = 0
+        for i in sorted({i for i in ingested if not (data/data_path(i)).exists()} | set(refreshed)):
+            fetch(data, data_path(i), base_url)
+        i = max(ingested, default = 0) + 1
+        while fetch(data, data_path(i), base_url):
+            i += 1
+    paths = []
+    while (data/data_path(len(paths) + 1)).exists():
+        paths.append(data/data_path(len(paths) + 1))
+    (v3_paths, v4_paths) = split_versions(paths)
+    write_manifest(cache_dir, files = {path.name: {"sha256": file_hash(path, path.stat().st_mtime, path.stat().st_size), "version": version}
+        for (version, version_paths) in (("v3", v3_paths), ("v4", v4_paths)) for path in version_paths})
+    return (v3_paths, v4_paths)
+
+def daily_counts(cases: pd.DataFrame) -> pd.DataFrame:
+    """ daily cases by status (dD, dT, dR) indexed by (detected_state, detected_district, status_change_date), as
+    get_time_series sums them; rows without a district are kept (under a missing district) for state level sums """
+    cases = cases[cases["num_cases"] >= 0].dropna(subset = ["status_change_date", "current_status"])
+    return cases.groupby(["detected_state", "detected_district", "status_change_date", "current_status"], dropna = False)["num_cases"].sum()\
+        .unstack(fill_value = 0)\
+        .reindex(columns = list(status_columns), fill_value = 0)\
+        .astype(float)\
+        .rename(columns = status_columns)
+
+def in_districts(frame: pd.DataFrame, districts: pd.DataFrame):
+    """ mask of rows of frame (with detected_state and detected_district columns or index levels) in a frame of districts; missing districts match """
+    keys = frame.reset_index()[["detected_state", "detected_district"]] if "detected_state" in frame.index.names else frame[["detected_state", "detected_district"]]
+    return keys.merge(districts.drop_duplicates().assign(_hit = True), how = "left", on = ["detected_state", "detected_district"])["_hit"].notna().values
+
+def district_timeseries(v3_paths: Sequence[Path], v4_paths: Sequence[Path], cache_dir: Optional[Path] = None, workers: Optional[int] = None) -> pd.DataFrame:
+    """ daily_counts over all files, cached under cache_dir (default: case_cache next to the first file); on later calls,
+    only districts with rows in new, changed or removed files are recomputed (reading only their states' rows) """
+    files     = [(path, "v3") for path in v3_paths] + [(path, "v4") for path in v4_paths]
+    cache_dir = Path(cache_dir) if cache_dir is not None else Path(files[0][0]).parent/"case_cache"
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        caches = dict(zip((Path(path).name for (path, _) in files), pool.map(lambda file: cached_cases(*file, cache_dir = cache_dir), files)))
+    built = read_manifest(cache_dir).get("timeseries", {})
+    store = cache_dir/f"district_timeseries.{case_format}"
+    ts    = read_cases(store) if store.exists() and built else None
+    if ts is not None:
+        current = {name: cache.name for (name, cache) in caches.items()}
+        changed = [cache_dir/cache for (name, cache) in current.items() if built["files"].get(name) != cache] \
+                + [cache_dir/cache for (name, cache) in built["files"].items() if current.get(name) != cache]
+        if not changed:
+            return ts
+        if all(_.exists() for _ in changed):
+            districts = pd.concat([read_cases(_, ["detected_state", "detected_district"]) for _ in changed])
+            states    = list(districts["detected_state"].unique())
+            cases     = load_case_data(v3_paths, v4_paths, states = states, cache_dir = cache_dir, workers = workers)
+            ts = pd.concat([ts[~in_districts(ts, districts)], daily_counts(cases[in_districts(cases, districts)])]).sort_index()
+        else:
+            ts = None
+    if ts is None:
+        ts = daily_counts(load_case_data(v3_paths, v4_paths, cache_dir = cache_dir, workers = workers))
+    write_cases(ts, store)
+    write_manifest(cache_dir, timeseries = {"files": {name: cache.name for (name, cache) in caches.items()}})
+    return ts
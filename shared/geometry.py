@@ -0,0 +1,97 @@
+import hashlib
+import inspect
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+""" cache of prepared geometry layers for choropleths
+
+reading a boundary file and renaming, dissolving coalesced units or clipping to a bounding box gives the same
+layer every run, so prepared layers are written once in a binary format (GeoParquet when pyarrow is installed,
+else pickle) and read back on later runs. a layer is keyed by a content hash of its source file(s), the rules
+passed to its preparation function (e.g. which states are coalesced) and that function's source code, so
+editing any of them rebuilds it. each layer is stored at the simplification levels below for plotting
+"""
+
+try:
+    import pyarrow
+    layer_format = "parquet"
+except ImportError:
+    layer_format = "pickle"
+
+# simplification tolerances in the layer's CRS units (degrees for the GeoJSON and GADM sources used here); None keeps full resolution
+simplification_levels = {"full": None, "fine": 0.001, "coarse": 0.01}
+
+@lru_cache(maxsize = None)
+def file_hash(path: Path, mtime: float, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_hash(source: Path) -> str:
+    """ sha256 over a geometry source and, for shapefiles, its sidecar files (.shx, .dbf, .prj, ...) """
+    source = Path(source)
+    paths  = sorted(source.parent.glob(source.stem + ".*")) if source.suffix == ".shp" else [source]
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.name.encode())
+        digest.update(file_hash(path, path.stat().st_mtime, path.stat().st_size).encode())
+    return digest.hexdigest()
+
+def layer_key(source: Path, prepare: Optional[Callable] = None, rules: Optional[dict] = None, read_kwargs: Optional[dict] = None) -> str:
+    try:
+        code = inspect.getsource(prepare) if prepare is not None else None
+    except (OSError, TypeError):
+        code = getattr(prepare, "__qualname__", repr(prepare))
+    return hashlib.sha256(json.dumps(
+        {"source": source_hash(source), "prepare": code, "rules": rules or {}, "read": read_kwargs or {}},
+        sort_keys = True, default = str).encode()).hexdigest()
+
+def simplify(layer: gpd.GeoDataFrame, tolerance: Optional[float]) -> gpd.GeoDataFrame:
+    """ topology-preserving simplification; with shapely >= 2.1, edges shared by neighbouring units are simplified once, so no gaps or slivers open up """
+    if tolerance is None:
+        return layer
+    coverage_simplify = getattr(shapely, "coverage_simplify", None)
+    if coverage_simplify is not None:
+        geometry = gpd.GeoSeries(coverage_simplify(layer.geometry.values, tolerance), index = layer.index, crs = layer.crs)
+    else:
+        geometry = layer.geometry.simplify(tolerance, preserve_topology = True)
+    simplified = layer.copy()
+    simplified[layer.geometry.name] = geometry
+    return simplified
+
+def write_layer(layer: gpd.GeoDataFrame, path: Path):
+    staging = path.with_name(path.name + ".tmp")
+    if layer_format == "parquet":
+        layer.to_parquet(staging)
+    else:
+        pd.to_pickle(layer, staging)
+    os.replace(staging, path)
+
+def read_layer(path: Path) -> gpd.GeoDataFrame:
+    return gpd.read_parquet(path) if layer_format == "parquet" else pd.read_pickle(path)
+
+def load_layer(source: Path, prepare: Optional[Callable] = None, rules: Optional[dict] = None, level: str = "full",
+    cache_dir: Optional[Path] = None, **read_kwargs) -> gpd.GeoDataFrame:
+    """ gpd.read_file(source, **read_kwargs), passed through prepare(layer, **rules) and simplified to level, from the cache
+    under cache_dir (default: a geometry_cache folder next to source) if it has been prepared before """
+    source    = Path(source)
+    cache_dir = Path(cache_dir) if cache_dir is not None else source.parent/"geometry_cache"
+    key       = layer_key(source, prepare, rules, read_kwargs)[:16]
+    paths     = {name: cache_dir/f"{source.stem}_{key}_{name}.{layer_format}" for name in simplification_levels}
+    if not paths[level].exists():
+        layer = gpd.read_file(source, **read_kwargs)
+        if prepare is not None:
+            layer = prepare(layer, **(rules or {}))
+        cache_dir.mkdir(parents = True, exist_ok = True)
+        for (name, tolerance) in simplification_levels.items():
+            write_layer(simplify(layer, tolerance), paths[name])
+    return read_layer(paths[level])
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("epimargin")
+requests = pytest.importorskip("requests")
+
+from epimargin.etl.covid19india import columns_v3, columns_v4, load_all_data
+from studies.shared import case_data
+from studies.shared.case_data import (daily_counts, district_timeseries, ingest, load_case_data, read_cases, restored, storable,
+                                      write_cases)
+
+""" case data cache against load_all_data, and incremental ingestion against rebuilding from scratch """
+
+states = [" tamil nadu", "Karnataka", "Delhi ", "NULL", None, "Bihar", "Kerala"]
+
+def raw_data(rng, columns, n, states = states):
+    """ a raw_data*.csv-like frame: untidy names, missing states and districts, missing status change dates, negative counts """
+    frame = pd.DataFrame({column: ["x"] * n for column in columns})
+    announced = pd.to_datetime("2020-04-01") + pd.to_timedelta(rng.integers(0, 120, n), "D")
+    frame["Date Announced"]     = announced.strftime("%d/%m/%Y")
+    frame["Status Change Date"] = np.where(rng.random(n) < 0.1, None, frame["Date Announced"])
+    frame["Detected State"]     = rng.choice(np.array(states, dtype = object), n)
+    frame["Detected District"]  = rng.choice(np.array(["chennai ", "Pune", None, "Patna"], dtype = object), n)
+    frame["Current Status"]     = rng.choice(["Hospitalized", "Recovered", "Deceased"], n)
+    frame["Num Cases"]          = rng.integers(-1, 5, n)
+    frame["Patient Number"]     = rng.integers(0, 10**6, n)
+    if "Age Bracket" in frame:
+        frame["Age Bracket"] = np.where(rng.random(n) < 0.5, None, rng.integers(1, 90, n).astype(str))
+    return frame
+
+def write_raw_files(folder, rng):
+    """ (v3_paths, v4_paths) of two v3 and three v4 raw_data files written to folder """
+    for i in (1, 2):
+        raw_data(rng, columns_v3, 3000).to_csv(folder/f"raw_data{i}.csv", index = False)
+    for i in (3, 4, 5):
+        raw_data(rng, columns_v4, 3000).to_csv(folder/f"raw_data{i}.csv", index = False)
+    return ([folder/f"raw_data{i}.csv" for i in (1, 2)], [folder/f"raw_data{i}.csv" for i in (3, 4, 5)])
+
+@pytest.fixture
+def raw_files(tmp_path):
+    return write_raw_files(tmp_path, np.random.default_rng(0))
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """ API files served from a folder, with requests.get patched to fetch from it (or fail, when offline) """
+    root = tmp_path/"server"
+    root.mkdir()
+    rng = np.random.default_rng(0)
+    write_raw_files(root, rng)
+
+    class Response():
+        def __init__(self, path):
+            self.path = path
+            self.content = path.read_bytes() if path.exists() else b""
+        def raise_for_status(self):
+            if not self.path.exists():
+                raise requests.HTTPError("404")
+
+    server = SimpleNamespace(root = root, requests = [], offline = False, rng = rng)
+    def get(url, timeout = None):
+        server.requests.append(url.rsplit("/", 1)[1])
+        if server.offline:
+            raise requests.ConnectionError("offline")
+        return Response(root/url.rsplit("/", 1)[1])
+
+    monkeypatch.setattr(case_data.requests, "get", get)
+    return server
+
+@pytest.fixture
+def data(tmp_path):
+    (tmp_path/"data").mkdir()
+    return tmp_path/"data"
+
+def test_load_case_data(raw_files):
+    (v3_paths, v4_paths) = raw_files
+    expected = load_all_data(v3_paths, v4_paths)
+    for _ in ("cold", "warm"):
+        pd.testing.assert_frame_equal(load_case_data(v3_paths, v4_paths), expected)
+    pd.testing.assert_frame_equal(load_case_data(v3_paths, v4_paths, states = ["Karnataka", "Delhi"]), expected.query("detected_state in ['Karnataka', 'Delhi']"))
+    assert "age_bracket" in load_case_data(v3_paths, v4_paths, columns = None).columns
+
+def test_storable_round_trip(tmp_path):
+    cases = pd.DataFrame({
+        "patient_number": pd.Series([1, "P2", None, 4], dtype = object),
+        "detected_state": pd.Series(["Goa", None, "Goa", "Delhi"], dtype = object),
+        "num_cases":      [1.0, np.nan, 2.0, 3.0],
+    })
+    stored = storable(cases)
+    assert isinstance(stored.dtypes["patient_number"], pd.StringDtype) and stored.dtypes["detected_state"] == object
+    back = restored(stored.copy())
+    assert back.dtypes["patient_number"] == object
+    pd.testing.assert_frame_equal(back.isna(), cases.isna())
+    assert list(back["patient_number"].dropna()) == ["1", "P2", "4"]
+
+    write_cases(cases.drop(columns = "patient_number"), tmp_path/f"cases.{case_data.case_format}")
+    pd.testing.assert_frame_equal(read_cases(tmp_path/f"cases.{case_data.case_format}"), cases.drop(columns = "patient_number"))
+
+def test_incremental_timeseries(server, data):
+    district_timeseries(*ingest(data))
+
+    # the newest file grows and a new one appears, touching only some states
+    latest = pd.read_csv(server.root/"raw_data5.csv")
+    pd.concat([latest, raw_data(server.rng, columns_v4, 200, ["Kerala"])]).to_csv(server.root/"raw_data5.csv", index = False)
+    raw_data(server.rng, columns_v4, 300, ["Bihar"]).to_csv(server.root/"raw_data6.csv", index = False)
+    server.requests.clear()
+    (v3_paths, v4_paths) = ingest(data)
+    assert server.requests == ["raw_data4.csv", "raw_data5.csv", "raw_data6.csv", "raw_data7.csv"]
+    pd.testing.assert_frame_equal(district_timeseries(v3_paths, v4_paths), daily_counts(load_case_data(v3_paths, v4_paths)))
+
+def test_ingest_refresh_and_offline(server, data):
+    files = ingest(data)
+    server.requests.clear()
+    assert ingest(data, refresh = 0) == files
+    assert server.requests == ["raw_data6.csv"]
+    server.offline = True
+    assert ingest(data) == files
+    assert ingest(data, download = False) == files
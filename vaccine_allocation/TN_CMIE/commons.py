@@ -5,8 +5,9 @@ import numpy as np
 import pandas as pd
 from epimargin.estimators import analytical_MPVS
 from epimargin.etl.commons import download_data
-from epimargin.etl.covid19india import data_path, get_time_series, load_all_data
+from epimargin.etl.covid19india import data_path, get_time_series
 from epimargin.smoothing import notched_smoothing
+from studies.shared.case_data import load_case_data
 
 """ Common data loading/cleaning functions and constants """
 
@@ -248,7 +249,7 @@ def get_state_timeseries(states = ["Tamil Nadu"], download: bool = False) -> pd.
     if download:
         for target in paths['v3'] + paths['v4']: 
             download_data(data, target)
-    return load_all_data(v3_paths = [data/filepath for filepath in paths['v3']],  v4_paths = [data/filepath for filepath in paths['v4']])\
+    return load_case_data(v3_paths = [data/filepath for filepath in paths['v3']],  v4_paths = [data/filepath for filepath in paths['v4']], states = None if states == "*" else states)\
         .query("detected_state in @states" if states != "*" else "detected_state != 'NULL'", engine = "python")\
         .pipe(lambda _: get_time_series(_, ["detected_state", "detected_district"]))\
         .drop(columns = ["date", "time", "delta", "logdelta"])\
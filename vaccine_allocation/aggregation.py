@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+""" parallel reduction of per-district outputs into national (or state) totals
+
+reads are I/O and decompression bound, both of which release the GIL, so a thread pool overlaps them
+without pickling arrays between processes; per-district contributions are combined by pairwise
+summation, which is deterministic for a given input order and keeps rounding error at O(log n)
+"""
+
+def pairwise_sum(arrays: Sequence[np.array]) -> np.array:
+    """ sum arrays as a balanced binary tree """
+    if len(arrays) == 0:
+        return np.array(0)
+    while len(arrays) > 1:
+        arrays = [arrays[i] + arrays[i + 1] if i + 1 < len(arrays) else arrays[i] for i in range(0, len(arrays), 2)]
+    return arrays[0]
+
+def parallel_reduce(outputs: Sequence[tuple], load: Callable, workers: Optional[int] = None, progress: Callable = iter) -> np.array:
+    """ pairwise sum of load(*output) over outputs, loaded on a thread pool (workers = None uses the executor default) """
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        return pairwise_sum(list(progress(pool.map(lambda output: load(*output), outputs))))
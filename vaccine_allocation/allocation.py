@@ -0,0 +1,79 @@
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import numpy as np
+from epimargin.utils import fillna
+
+""" vectorized vaccine dose allocation across age bins """
+
+class Allocator():
+    """ allocate a daily dose budget across age bins for a stack of policy arms at once
+
+    each policy arm is either a priority ordering of age bins (e.g. MORTALITY, CONTACT, CONSUMPTION,
+    or any custom permutation), allocated greedily down the ordering, or None for allocation
+    proportional to the eligible population in each bin; gather indices for the orderings and
+    their inverses are computed once, and all intermediate arrays are reused between calls
+    """
+    def __init__(self, priorities: Sequence[Optional[Sequence[int]]], num_sims: int, num_age_bins: int = 7):
+        self.shape = (num_policies, _, _) = (len(priorities), num_sims, num_age_bins)
+        self.pro_rata = np.array([p is None for p in priorities])
+        orders   = np.array([np.arange(num_age_bins) if p is None else p for p in priorities])
+        inverses = np.argsort(orders, axis = 1)
+
+        # work in a (policy, priority rank, sim) layout so that running sums over age bins are contiguous;
+        # gathers and scatters go one policy at a time to keep each pass within cache
+        sims = np.arange(num_sims)
+        self.gather  = sims[None, None, :] * num_age_bins + orders[:, :, None]
+        self.scatter = sims[None, :, None] + inverses[:, None, :] * num_sims
+        self.cell    = np.arange(num_policies)[:, None] * num_age_bins * num_sims + sims[None, :]
+
+        ranked = (num_policies, num_age_bins, num_sims)
+        self.Sp      = np.empty(ranked)
+        self.cum     = np.empty(ranked)
+        self.dV      = np.empty(ranked)
+        self.covered = np.empty(ranked, dtype = bool)
+        self.first   = np.empty(self.shape[:-1], dtype = int)
+        self.rest    = np.empty(self.shape[:-1])
+
+    @np.errstate(divide = "ignore", invalid = "ignore")
+    def __call__(self, num_doses, S: np.array, out: Optional[np.array] = None) -> np.array:
+        """ allocate num_doses (scalar, or one budget per policy arm) given eligible population S of shape (policy, sim, age)
+
+        matches prioritize() for non-negative S: bins are filled in priority order while the cumulative
+        population fits within the budget, and the remainder goes to the first bin that does not fit
+        """
+        num_doses = np.broadcast_to(np.asarray(num_doses, dtype = float).reshape(-1, 1), self.shape[:-1])
+        if out is None:
+            out = np.empty(self.shape)
+        S = np.ascontiguousarray(S, dtype = float)
+
+        for p in range(self.shape[0]):
+            np.take(S[p].ravel(), self.gather[p], out = self.Sp[p])
+        self.cum[:, 0] = self.Sp[:, 0]
+        for k in range(1, self.shape[-1]): # faster than np.cumsum along a short axis
+            np.add(self.cum[:, k - 1], self.Sp[:, k], out = self.cum[:, k])
+        np.less_equal(self.cum, num_doses[:, None, :], out = self.covered)
+        np.multiply(self.Sp, self.covered, out = self.dV)
+
+        # covered bins form a prefix of the ordering; the partially covered bin follows it
+        # (if every bin is covered, prioritize() assigns the remainder to the first bin)
+        np.sum(self.covered, axis = 1, out = self.first)
+        np.remainder(self.first, self.shape[-1], out = self.first)
+        np.subtract(num_doses, self.dV.sum(axis = 1), out = self.rest)
+        np.put(self.dV, self.cell + self.first * self.shape[1], self.rest)
+
+        for p in range(self.shape[0]):
+            np.take(self.dV[p].ravel(), self.scatter[p], out = out[p])
+        np.clip(out, 0, S, out = out)
+
+        if self.pro_rata.any():
+            out[self.pro_rata] = (num_doses[self.pro_rata][..., None] * fillna(S[self.pro_rata]/S[self.pro_rata].sum(axis = -1, keepdims = True))).clip(0)
+        return out
+
+@lru_cache(maxsize = None)
+def cached_allocator(prioritization: tuple, num_sims: int, num_age_bins: int) -> Allocator:
+    return Allocator([prioritization], num_sims, num_age_bins)
+
+def prioritize(num_doses, S, prioritization):
+    """ one-off allocation of num_doses to the (num_sims, num_age_bins) population S in prioritization order """
+    return cached_allocator(tuple(prioritization), *S.shape)(num_doses, S[None])[0]
@@ -0,0 +1,73 @@
+import sys
+from timeit import repeat
+
+import numpy as np
+from studies.vaccine_allocation.allocation import Allocator, prioritize
+from studies.vaccine_allocation.kernels import (discounted_reverse_cumsum,
+                                                discounted_sum)
+
+""" micro-benchmarks for the simulation and evaluation kernels; run as `python benchmarks.py [allocation npv ...]` """
+
+MORTALITY   = [6, 5, 4, 3, 2, 1, 0]
+CONTACT     = [1, 2, 3, 4, 0, 5, 6]
+CONSUMPTION = [4, 5, 6, 3, 2, 1, 0]
+
+def prioritize_reference(num_doses, S, prioritization):
+    """ allocation as originally implemented in epi_simulations, kept for comparison """
+    Sp = S[:, prioritization]
+    dV = np.where(Sp.cumsum(axis = 1) <= num_doses, Sp, 0)
+    dV[np.arange(len(dV)), (Sp.cumsum(axis = 1) > dV.cumsum(axis = 1)).argmax(axis = 1)] = num_doses - dV.sum(axis = 1)
+    return dV[:, sorted(range(len(prioritization)), key = prioritization.__getitem__)].clip(0, S)
+
+def timed(f, number, repeats = 5):
+    """ best per-call latency in microseconds """
+    return 1e6 * min(repeat(f, number = number, repeat = repeats))/number
+
+def benchmark_allocation(sims = (1000, 10000), num_doses = 5e4, number = 200):
+    rng = np.random.default_rng(0)
+    print(f"{'num_sims':>10} {'reference':>12} {'prioritize':>12} {'Allocator':>12} {'Allocator x3':>14}  (us/call)")
+    for num_sims in sims:
+        S  = rng.uniform(0, 2e4, size = (3, num_sims, 7))
+        dV = np.empty_like(S)
+        single  = Allocator([MORTALITY], num_sims)
+        batched = Allocator([MORTALITY, CONTACT, CONSUMPTION], num_sims)
+        assert np.array_equal(prioritize_reference(num_doses, S[0], MORTALITY), single(num_doses, S[:1])[0])
+        print(f"{num_sims:>10} "
+            f"{timed(lambda: prioritize_reference(num_doses, S[0], MORTALITY), number):>12.1f} "
+            f"{timed(lambda: prioritize(num_doses, S[0], MORTALITY), number):>12.1f} "
+            f"{timed(lambda: single(num_doses, S[:1], out = dV[:1]), number):>12.1f} "
+            f"{timed(lambda: batched(num_doses, S, out = dV), number):>14.1f}"
+        )
+
+def npv_reference(daily, n = 366, beta = 1/((1.0425)**(1/365))):
+    """ NPV as originally implemented in policy_evaluation, kept for comparison """
+    s = np.arange(n)
+    return [ 
+        np.sum(np.power(beta, s[t:] - t)[:, None, None] * daily[t:, :], axis = 0)
+        for t in range(n)
+    ]
+
+def benchmark_npv(sims = (100, 1000), horizon = 366, number = 3):
+    beta = 1/((1.0425)**(1/365))
+    rng  = np.random.default_rng(0)
+    print(f"{'num_sims':>10} {'reference':>12} {'reverse cumsum':>15} {'t = 0 only':>12}  (ms/call)")
+    for num_sims in sims:
+        daily = rng.uniform(0, 1e4, size = (horizon, num_sims, 7))
+        out   = np.empty_like(daily)
+        assert np.allclose(npv_reference(daily, horizon, beta), discounted_reverse_cumsum(daily, beta))
+        assert np.allclose(npv_reference(daily, horizon, beta)[0], discounted_sum(daily, beta))
+        print(f"{num_sims:>10} "
+            f"{timed(lambda: npv_reference(daily, horizon, beta), number)/1e3:>12.1f} "
+            f"{timed(lambda: discounted_reverse_cumsum(daily, beta, out = out), number)/1e3:>15.1f} "
+            f"{timed(lambda: discounted_sum(daily, beta), number)/1e3:>12.1f}"
+        )
+
+benchmarks = {
+    "allocation": benchmark_allocation,
+    "npv":        benchmark_npv,
+}
+
+if __name__ == "__main__":
+    for name in (sys.argv[1:] or benchmarks.keys()):
+        print(name)
+        benchmarks[name]()
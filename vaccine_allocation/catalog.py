@@ -0,0 +1,150 @@
+import json
+import re
+import sqlite3
+import zipfile
+from contextlib import closing
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from studies.vaccine_allocation.store import MetricStores
+
+""" persistent catalog of policy evaluation outputs
+
+one SQLite table maps (metric, state_code, district, phi, policy) to where the output lives (a per-metric
+.npz file, a member of a fused district file, or a key in a per-metric array store) along with its shape
+and dtype; writers register outputs as they save them, and figure scripts query the catalog instead of
+listing the output directory. names are the per-metric file names, so glob patterns still apply (SQLite
+GLOB has fnmatch semantics). WAL mode and a busy timeout let parallel workers register concurrently
+"""
+
+metrics = ["deaths", "YLL", "per_capita_TEV", "per_capita_VSLY", "total_TEV", "total_VSLY", "VSL", "dTEV_health", "dTEV_cons", "dTEV_priv", "dTEV_extn"]
+name_pattern = re.compile(rf"^({'|'.join(sorted(metrics, key = len, reverse = True))})_([^_]+)_(.+)_phi(\d+)_([a-z]+?)(?:\.npz)?$")
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS outputs (
+        name       TEXT PRIMARY KEY,
+        metric     TEXT,
+        state_code TEXT,
+        district   TEXT,
+        phi        INTEGER,
+        policy     TEXT,
+        kind       TEXT, -- file, fused or store
+        location   TEXT,
+        key        TEXT,
+        shape      TEXT,
+        dtype      TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS outputs_by_key ON outputs (metric, phi, policy, state_code, district)"
+]
+
+def parse_name(name: str) -> Optional[tuple]:
+    """ (metric, state_code, district, phi, policy) from a per-metric output name, or None if it is not one """
+    match = name_pattern.match(name)
+    if match is None:
+        return None
+    (metric, state_code, district, phi, policy) = match.groups()
+    return (metric, state_code, district, int(phi), policy)
+
+def npz_header(path: Path, member: str) -> tuple:
+    """ shape and dtype of an .npz member, read from its header without loading the array """
+    with zipfile.ZipFile(path) as archive, archive.open(member + ".npy") as f:
+        version = np.lib.format.read_magic(f)
+        (shape, _, dtype) = np.lib.format.read_array_header_1_0(f) if version == (1, 0) else np.lib.format.read_array_header_2_0(f)
+    return (shape, dtype.str)
+
+def describe(path, key) -> tuple:
+    """ shape and stored dtype of an output located as glob_metrics yields it (derived total_* outputs describe their per_capita_* source) """
+    if isinstance(path, MetricStores):
+        (metric, state_code, district, phi, policy) = key
+        if metric.startswith("total_"):
+            metric = "per_capita_" + metric[len("total_"):]
+        meta = path[metric].index(state_code, district)[path[metric].entry(phi, policy, metric)]
+        return (tuple(meta["shape"]), meta["dtype"])
+    with zipfile.ZipFile(path) as archive:
+        members = archive.namelist()
+    if key is not None and key.startswith("total_") and key + ".npy" not in members:
+        key = "per_capita_" + key[len("total_"):]
+    return npz_header(path, "arr_0" if key is None else key)
+
+class Catalog():
+    """ SQLite catalog of policy evaluation outputs at path """
+    def __init__(self, path: Path, timeout: float = 60):
+        self.path    = Path(path)
+        self.timeout = timeout
+        self.stores  = {}
+        self.ready   = False
+
+    def connect(self) -> sqlite3.Connection:
+        """ a new connection (callers close it); the schema is created on this catalog's first connection only """
+        connection = sqlite3.connect(self.path, timeout = self.timeout)
+        if not self.ready:
+            connection.execute("PRAGMA journal_mode = WAL")
+            for statement in schema:
+                connection.execute(statement)
+            connection.commit()
+            self.ready = True
+        return connection
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    # writing
+    def add(self, outputs: Iterable[tuple]):
+        """ register outputs given as (name, path, key) triples, as glob_metrics yields them; shape and dtype may be appended """
+        rows = []
+        for (name, path, key, *description) in outputs:
+            parsed = parse_name(name)
+            if parsed is None:
+                continue
+            (shape, dtype) = description or describe(path, key)
+            if isinstance(path, MetricStores):
+                (kind, location, key) = ("store", str(path.root), json.dumps(list(key)))
+            else:
+                (kind, location) = ("file" if key is None else "fused", str(path))
+            rows.append((name if name.endswith(".npz") else name + ".npz", *parsed, kind, location, key, json.dumps(list(shape)), dtype))
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def clear(self):
+        with closing(self.connect()) as connection, connection:
+            connection.execute("DELETE FROM outputs")
+
+    # reading
+    def resolve(self, kind: str, location: str, key: Optional[str]) -> tuple:
+        """ (path, key) as load_metric takes them """
+        if kind == "store":
+            if location not in self.stores:
+                self.stores[location] = MetricStores(location)
+            return (self.stores[location], tuple(json.loads(key)))
+        return (Path(location), key)
+
+    def glob(self, pattern: str) -> Iterator[tuple]:
+        """ outputs whose per-metric file name matches pattern, as (name, path, key) """
+        with closing(self.connect()) as connection, connection:
+            rows = connection.execute("SELECT name, kind, location, key FROM outputs WHERE name GLOB ? ORDER BY name", (pattern,)).fetchall()
+        for (name, kind, location, key) in rows:
+            yield (name, *self.resolve(kind, location, key))
+
+    def query(self, metric: str, state_code: Optional[str] = None, district: Optional[str] = None, phi: Optional[int] = None, policy: Optional[str] = None,
+        exclude_states: Iterable[str] = ()) -> Iterator[tuple]:
+        """ outputs for a metric, optionally filtered on any key component, as (name, path, key) """
+        clauses, values = ["metric = ?"], [metric]
+        for (column, value) in (("state_code", state_code), ("district", district), ("phi", phi), ("policy", policy)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        exclude_states = list(exclude_states)
+        if exclude_states:
+            clauses.append(f"state_code NOT IN ({', '.join('?' * len(exclude_states))})")
+            values += exclude_states
+        with closing(self.connect()) as connection, connection:
+            rows = connection.execute(f"SELECT name, kind, location, key FROM outputs WHERE {' AND '.join(clauses)} ORDER BY name", values).fetchall()
+        for (name, kind, location, key) in rows:
+            yield (name, *self.resolve(kind, location, key))
+
+    def shapes(self, pattern: str = "*") -> dict:
+        """ name -> (shape, dtype) for outputs matching pattern """
+        with closing(self.connect()) as connection, connection:
+            rows = connection.execute("SELECT name, shape, dtype FROM outputs WHERE name GLOB ?", (pattern,)).fetchall()
+        return {name: (tuple(json.loads(shape)), dtype) for (name, shape, dtype) in rows}
@@ -1,13 +1,21 @@
+from fnmatch import fnmatch
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 from epimargin.estimators import analytical_MPVS
 from epimargin.etl.commons import download_data
 from epimargin.etl.covid19india import (data_path, get_time_series,
-                                       load_all_data, state_name_lookup)
+                                       state_name_lookup)
 from epimargin.smoothing import notched_smoothing
 from epimargin.utils import mkdir
+from studies.shared.case_data import (district_timeseries, ingest,
+                                      load_case_data)
+from studies.vaccine_allocation.catalog import Catalog
+from studies.vaccine_allocation.precision import load_npz
+from studies.vaccine_allocation.store import ArrayStore, MetricStores
 from tqdm import tqdm
 
 """ Common data loading/cleaning functions and constants """
@@ -40,6 +48,12 @@ experiment_tag = "unitvaxhazard_TN_IFR"
 # epi_dst = tev_src = mkdir(Path("/Volumes/dedomeno/covid/vax-nature/OD_IFR_Rtdownscale_fullstate_epi_1000_Apr15"))
 epi_dst = tev_src = mkdir(Path("/Volumes/dedomeno/covid/vax-nature/all_india_coalesced_epi_1000_Apr15"))
 tev_dst = fig_src = mkdir(ext/f"{experiment_tag}_tev_{num_sims}_{simulation_start.strftime('%b%d')}")
+epi_store = ArrayStore(epi_dst/"store")
+output_precision = "compact" # see precision.policies; "full" stores float64 throughout
+catalog_name = "catalog.sqlite" # catalog of policy evaluation outputs (see catalog.py), under tev_dst; glob_metrics queries it when present
+metric_stores_dir = "store" # policy_evaluation.evaluate_district(store = ...) writes one array store per metric here, under tev_dst
+fused_metrics_dir = "by_district" # policy_evaluation.evaluate_district writes one .npz per metric and district here (<metric>/<state_code>_<district>.npz), under tev_dst
+rollup_dir = "rollup" # district, state and national sums of policy evaluation outputs (see rollup.py), under tev_dst; figure scripts read from it
 
 # misc
 survey_date = "October 23, 2020"
@@ -125,25 +139,114 @@ fR = (TN_recovery_structure  / TN_recovery_structure .sum())[:, None]
 fI = (TN_infection_structure / TN_infection_structure.sum())[:, None]
 
 
+def load_epi_outputs(state_code, district, phi, vax_policy, fields = ("dT", "dD", "pi", "q0", "q1", "Dj"), t = slice(None), src = epi_dst, store = epi_store):
+    """ read simulated trajectories for one district and policy arm, from the chunked store if present, else from the per-tag .npz """
+    if store is not None and store.exists((state_code, district, phi, vax_policy, fields[0])):
+        return dict(zip(fields, store.read_entries(state_code, district, [(phi, vax_policy, field) for field in fields], t = t)))
+    with load_npz(src/f"{state_code}_{district}_phi{phi}_{vax_policy}.npz") as npz:
+        return {field: npz[field][t] for field in fields}
+
+def load_epi_summary(state_code, district, phi, vax_policy, fields = ("percentiles", "deaths", "dD_pct"), src = epi_dst, store = epi_store):
+    """ read per-day percentile summaries written in summary mode, from the chunked store if present, else from the _summary.npz """
+    if store is not None and store.exists((state_code, district, phi, vax_policy, fields[0])):
+        return dict(zip(fields, store.read_entries(state_code, district, [(phi, vax_policy, field) for field in fields])))
+    with load_npz(src/f"{state_code}_{district}_phi{phi}_{vax_policy}_summary.npz") as npz:
+        return {field: npz[field] for field in fields}
+
+@lru_cache(maxsize = None)
+def fused_keys(path, mtime):
+    """ output names in a fused district file; total_* metrics are not stored but derived from per_capita_* and N_jk """
+    with load_npz(path) as npz:
+        keys = [_ for _ in npz.files if _ != "N_jk"]
+    return keys + ["total_" + _[len("per_capita_"):] for _ in keys if _.startswith("per_capita_")]
+
+def stored_keys(stores, **filters):
+    """ per-metric store outputs by their per-metric file names, with total_* derived from per_capita_* and N_jk; filters as for MetricStores.keys """
+    for key in stores.keys(**filters):
+        (metric, state_code, district, phi, policy) = key
+        yield (f"{metric}_{state_code}_{district}_phi{phi}_{policy}.npz", stores, key)
+        if metric.startswith("per_capita_"):
+            yield (f"total_{metric[len('per_capita_'):]}_{state_code}_{district}_phi{phi}_{policy}.npz", stores, ("total_" + metric[len("per_capita_"):],) + key[1:])
+
+def output_catalog(src = tev_dst):
+    return Catalog(src/catalog_name)
+
+def glob_metrics(src, pattern, use_catalog = True):
+    """ policy evaluation outputs matching a file name pattern, as (name, path, key) with key None for one-file-per-metric outputs;
+    outputs in per-metric stores, then outputs fused per district (see policy_evaluation.evaluate_district) match on their 
+    per-metric file names and take precedence, in that order; path is a MetricStores for store outputs 
+
+    if src has an output catalog, its entries come first, and only outputs it does not list (e.g. written before it, or by
+    code that does not register them) are looked up on disk; fused files it lists are not re-read """
+    catalogued, locations = {}, set()
+    if use_catalog and output_catalog(src).exists():
+        catalogued = {name: (name, path, key) for (name, path, key) in output_catalog(src).glob(pattern)}
+        locations  = {str(path) for (_, path, key) in catalogued.values() if key is not None and not isinstance(path, MetricStores)}
+        yield from catalogued.values()
+    fused = {name: (name, stores, key) for (name, stores, key) in stored_keys(MetricStores(src/metric_stores_dir)) if fnmatch(name, pattern) and name not in catalogued}
+    for path in sorted((src/fused_metrics_dir).glob("*/*.npz")):
+        if str(path) in locations:
+            continue
+        for key in fused_keys(path, path.stat().st_mtime):
+            if fnmatch(key + ".npz", pattern) and key + ".npz" not in fused and key + ".npz" not in catalogued:
+                fused[key + ".npz"] = (key + ".npz", path, key)
+    yield from fused.values()
+    for path in sorted(src.glob(pattern)):
+        if path.name not in fused and path.name not in catalogued:
+            yield (path.name, path, None)
+
+def catalog_outputs(src = tev_dst):
+    """ (re)build the output catalog for src from the outputs on disk, e.g. for outputs written before cataloguing """
+    catalog = output_catalog(src)
+    catalog.clear()
+    catalog.add(tqdm(glob_metrics(src, "*.npz", use_catalog = False)))
+    return catalog
+
+def load_metric(path, key = None, t = slice(None)):
+    """ an output located as glob_metrics yields it, indexed by t along its first (time) axis; store entries and 
+    uncompressed .npz members only read the selected time steps """
+    if isinstance(path, MetricStores):
+        (metric, state_code, district, phi, policy) = key
+        if metric.startswith("total_"):
+            per_capita = "per_capita_" + metric[len("total_"):]
+            return path[per_capita].read((state_code, district, "*", "*", "N_jk")) * path.read((per_capita,) + key[1:], t = t)
+        return path.read(key, t = t)
+    with load_npz(path) as npz:
+        if key is not None and key.startswith("total_") and key not in npz.files:
+            return npz["N_jk"] * npz.read("per_capita_" + key[len("total_"):], t)
+        return npz.read("arr_0" if key is None else key, t)
+
+def read_metric(metric, state_code, district, phi, vax_policy, src = tev_dst):
+    """ read one policy evaluation output, e.g. read_metric("per_capita_TEV", "TN", "Chennai", 50, "random") """
+    name  = f"{metric}_{state_code}_{district}_phi{phi}_{vax_policy}"
+    stores = MetricStores(src/metric_stores_dir)
+    stored = "per_capita_" + metric[len("total_"):] if metric.startswith("total_") else metric
+    if stores.exists((stored, state_code, district, phi, vax_policy)):
+        return load_metric(stores, (metric, state_code, district, phi, vax_policy))
+    for fused in (src/fused_metrics_dir).glob(f"*/{state_code}_{district}.npz"):
+        if name in fused_keys(fused, fused.stat().st_mtime):
+            return load_metric(fused, name)
+    return load_metric(src/f"{name}.npz")
+
 def get_state_timeseries(
     states = "*", 
     download: bool = False, 
     aggregation_cols = ["detected_state", "detected_district"], 
-    last_API_file: int = 27) -> pd.DataFrame:
-    """ load state- and district-level data, downloading source files if specified """
-    paths = {"v3": [data_path(i) for i in (1, 2)], "v4": [data_path(i) for i in range(3, last_API_file)]}
-    if download:
-        for target in paths['v3'] + paths['v4']: 
-            download_data(data, target)
-    return load_all_data(v3_paths = [data/filepath for filepath in paths['v3']],  v4_paths = [data/filepath for filepath in paths['v4']])\
-        .query("detected_state in @states" if states != "*" else "detected_state != 'NULL'")\
-        .pipe(lambda _: get_time_series(_, aggregation_cols))\
-        .drop(columns = ["date", "time", "delta", "logdelta"])\
-        .rename(columns = {
-            "Deceased":     "dD",
-            "Hospitalized": "dT",
-            "Recovered":    "dR"
-        })
+    last_API_file: Optional[int] = 27) -> pd.DataFrame:
+    """ load state- and district-level data, downloading source files if specified; last_API_file = None opts in to every
+    API file ingested so far (fetching new ones on download), and cached district series are only recomputed where rows changed """
+    if last_API_file is None:
+        (v3_paths, v4_paths) = ingest(data, download)
+    else:
+        paths = {"v3": [data_path(i) for i in (1, 2)], "v4": [data_path(i) for i in range(3, last_API_file)]}
+        if download:
+            for target in paths['v3'] + paths['v4']: 
+                download_data(data, target)
+        (v3_paths, v4_paths) = ([data/filepath for filepath in paths['v3']], [data/filepath for filepath in paths['v4']])
+    ts = district_timeseries(v3_paths, v4_paths)
+    detected_states = ts.index.get_level_values("detected_state")
+    return ts[detected_states.isin(states) if states != "*" else detected_states != "NULL"]\
+        .groupby(level = aggregation_cols + ["status_change_date"]).sum()
 
 def case_death_timeseries(states = "*", download = False, aggregation_cols = ["detected_state", "detected_district"], last_API_file: int = 26):
     """ assemble a list of daily deaths and cases for consumption prediction """
@@ -18,8 +18,11 @@ simulation_initial_conditions = pd.read_csv(data/f"all_india_coalesced_initial_c
 
 def load_projections(state, district, t = May15):
     state_code = state_name_lookup[state]
-    f = np.load(epi_dst / f'{state_code}_{district}_phi25_novax.npz')
-    return [np.median(f["dD"], axis = 1).astype(int)[t], np.median(f["dD"], axis = 1).astype(int)[t]]
+    try:
+        median_dD = load_epi_summary(state_code, district, 25, "novax", fields = ("dD_pct",))["dD_pct"][t, 0]
+    except (KeyError, FileNotFoundError): # no summary for this district; fall back to raw trajectories
+        median_dD = np.median(load_epi_outputs(state_code, district, 25, "novax", fields = ("dD",), t = t)["dD"])
+    return [median_dD.astype(int), median_dD.astype(int)]
 
 projections = [load_projections(*idx) for idx in tqdm(simulation_initial_conditions.index)]
 
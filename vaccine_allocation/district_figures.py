@@ -5,10 +5,12 @@ from epimargin.etl.covid19india import state_code_lookup
 from studies.vaccine_allocation.commons import *
 from studies.vaccine_allocation.epi_simulations import *
 
-from studies.vaccine_allocation.natl_figures import aggregate_static_percentiles, outcomes_per_policy, aggregate_dynamic_percentiles
+from studies.vaccine_allocation.natl_figures import outcomes_per_policy
+from studies.vaccine_allocation.rollup import rollup_cube
 
 if __name__ == "__main__":
     src = fig_src
+    cube = rollup_cube(src)
     dst0 = (data/f"../figs/_apr15/state_debug/{experiment_tag}").resolve()
     phis = [int(_ * 365 * 100) for _ in phi_points]
     params = list(chain([(phis[0], "novax",)], product(phis, ["contact", "random", "mortality"])))
@@ -28,7 +30,7 @@ if __name__ == "__main__":
             print(f"  {district}")
             # deaths
             death_percentiles = {
-                p: aggregate_static_percentiles(src, f"deaths_{state_code}_{district}*phi{'_'.join(map(str, p))}.npz")
+                p: cube.percentiles("deaths", *p, state_code, district)
                 for p in params 
             }
             outcomes_per_policy(death_percentiles, "deaths", "o", 
@@ -45,7 +47,7 @@ if __name__ == "__main__":
 
             # vsly 
             VSLY_percentiles = {
-                p: aggregate_dynamic_percentiles(src, f"total_VSLY_{state_code}_{district}_*phi{'_'.join(map(str, p))}.npz")
+                p: cube.percentiles("total_VSLY", *p, state_code, district, t = 0)
                 for p in tqdm(params)
             }
 
@@ -65,7 +67,7 @@ if __name__ == "__main__":
 
             # tev 
             TEV_percentiles = {
-                p: aggregate_dynamic_percentiles(src, f"total_TEV_{state_code}_{district}_*phi{'_'.join(map(str, p))}.npz", drop = ["_SK_", "_NL_"])
+                p: cube.percentiles("total_TEV", *p, state_code, district, t = 0)
                 for p in tqdm(params)
             }
 
@@ -87,7 +89,7 @@ if __name__ == "__main__":
         dst.mkdir(exist_ok = True)
         # for district in simulation_initial_conditions.query(f"state == '{state}'").index.get_level_values(1).unique():
         for district in simulation_initial_conditions.loc[state].index[:16]:
-            cf_consumption = np.load(src / f"c_p0v0{code}_{district}_phi25_novax.npz")['arr_0']
+            cf_consumption = load_npz(src / f"c_p0v0{code}_{district}_phi25_novax.npz")['arr_0']
             cons_mean = np.mean(cf_consumption, axis = 1)
             plt.plot(cons_mean)
             plt.PlotDevice().l_title(f"{code} {district}: mean consumption")
@@ -95,14 +97,14 @@ if __name__ == "__main__":
             plt.close("all")
 
             for (phi, pol) in product(phis, ["contact", "random", "mortality"]):
-                p_consumption = np.load(src / f"c_p1v1_{code}_{district}_phi{phi}_{pol}.npz")['arr_0']
+                p_consumption = load_npz(src / f"c_p1v1_{code}_{district}_phi{phi}_{pol}.npz")['arr_0']
                 cons_mean = np.mean(p_consumption, axis = 1)
                 plt.plot(cons_mean)
                 plt.PlotDevice().l_title(f"{code} {district}: mean consumption")
                 plt.savefig(dst / f"c_p1v1{district}_phi{phi}_{pol}.png")
                 plt.close("all")
 
-                qbar = np.load(src / f"q_bar_{code}_{district}_phi{phi}_{pol}.npz")['arr_0']
+                qbar = load_npz(src / f"q_bar_{code}_{district}_phi{phi}_{pol}.npz")['arr_0']
                 qbar_mean = np.mean(qbar, axis = 1)
                 plt.plot(qbar_mean)
                 plt.PlotDevice().l_title(f"{code} {district}: mean weighted q")
@@ -110,9 +112,9 @@ if __name__ == "__main__":
                 plt.close("all")
 
         for district in simulation_initial_conditions.query(f"state == '{state}'").index.get_level_values(1).unique():
-            dT_cf = np.load(epi_dst / f"{code}_{district}_phi25_novax.npz")['dT']
-            dT_random_200 = np.load(epi_dst / f"{code}_{district}_phi200_random.npz")['dT']
-            dT_mortality_200 = np.load(epi_dst / f"{code}_{district}_phi200_mortality.npz")['dT']
+            dT_cf = load_epi_outputs(code, district, 25, "novax", fields = ("dT",))['dT']
+            dT_random_200 = load_epi_outputs(code, district, 200, "random", fields = ("dT",))['dT']
+            dT_mortality_200 = load_epi_outputs(code, district, 200, "mortality", fields = ("dT",))['dT']
             plt.plot(np.mean(dT_cf, axis = 1), label = "novax")
             plt.plot(np.mean(dT_cf, axis = 1), label = "random 200")
             plt.plot(np.mean(dT_cf, axis = 1), label = "mortality 200")
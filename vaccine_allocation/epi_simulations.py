@@ -1,15 +1,31 @@
+from functools import partial
+from types import SimpleNamespace
+
 import dask
 import numpy as np
 import pandas as pd
 from epimargin.models import Age_SIRVD
 from epimargin.utils import annually, normalize, percent, years
+from studies.vaccine_allocation.allocation import Allocator, prioritize
 from studies.vaccine_allocation.commons import *
+from studies.vaccine_allocation.models import BatchedAge_SIRVD
+from studies.vaccine_allocation.precision import encoding_for, savez
+from studies.vaccine_allocation.scheduler import is_valid_npz, run_local
+from studies.vaccine_allocation.summaries import (TrajectorySummary, difference_ci,
+                                                  mean_ci, relative_halfwidth,
+                                                  stack_sims)
 from tqdm import tqdm
 
 import warnings
 warnings.filterwarnings("error")
 
 num_sims         = 1000
+variance_reduction = False # antithetic draws + common random numbers across policy arms (batched only; num_sims must be even)
+adaptive_sims    = False # run sims in blocks until the CIs of cumulative deaths converge, up to num_sims (batched only)
+sims_block       = 100
+sims_rtol        = 0.05  # target relative CI half-width for adaptive_sims
+sims_atol        = 1.0   # CI half-width (in deaths) accepted whatever the mean, for estimates near zero
+save_snapshots   = True  # keep the full model state at the end of each run, so the horizon can be extended later
 simulation_range = 1 * years
 phi_points       = [_ * percent * annually for _ in (25, 50, 100, 200)]
 simulation_initial_conditions = pd.read_csv(data/f"all_india_coalesced_scaling_Apr15.csv")\
@@ -24,23 +40,111 @@ MORTALITY   = [6, 5, 4, 3, 2, 1, 0]
 CONTACT     = [1, 2, 3, 4, 0, 5, 6]
 CONSUMPTION = [4, 5, 6, 3, 2, 1, 0]
 
-def save_metrics(tag, policy, dst = tev_src):
-    np.savez_compressed(dst/f"{tag}.npz", 
-        dT = policy.dT_total,
-        dD = policy.dD_total,
-        pi = policy.pi,
-        q0 = policy.q0,
-        q1 = policy.q1, 
-        Dj = policy.D
-    )
-
-def prioritize(num_doses, S, prioritization):
-    Sp = S[:, prioritization]
-    dV = np.where(Sp.cumsum(axis = 1) <= num_doses, Sp, 0)
-    dV[np.arange(len(dV)), (Sp.cumsum(axis = 1) > dV.cumsum(axis = 1)).argmax(axis = 1)] = num_doses - dV.sum(axis = 1)
-    return dV[:, sorted(range(len(prioritization)), key = prioritization.__getitem__)].clip(0, S)
-
-def process(district_data):
+# policy arms, in the order they are stacked along the leading axis of a batched model
+vax_policies = ["random", "mortality", "contact", "novax"]
+priorities   = {"random": None, "mortality": MORTALITY, "contact": CONTACT, "novax": None}
+
+# persisted fields and the model attributes they are read from
+# (Oj, Oj_vn are per-age outflows from I, I_vn, kept so deaths can be reweighted to other IFRs; see reweighting.py)
+metric_fields = {"dT": "dT_total", "dD": "dD_total", "pi": "pi", "q0": "q0", "q1": "q1", "Dj": "D", "Oj": "O", "Oj_vn": "O_vn"}
+
+def save_metrics(tag, policy, dst = tev_src, precision = output_precision):
+    savez(dst/f"{tag}.npz", precision, **{field: getattr(policy, attr) for (field, attr) in metric_fields.items() if hasattr(policy, attr)})
+
+def store_metrics(state_code, district, phi, vax_policy, policy, store = epi_store, precision = output_precision):
+    fields = [(field, attr) for (field, attr) in metric_fields.items() if hasattr(policy, attr)]
+    store.write_many(state_code, district, 
+        {(phi, vax_policy, field): np.asarray(getattr(policy, attr)) for (field, attr) in fields},
+        {(phi, vax_policy, field): encoding_for(field, precision) for (field, _) in fields})
+
+# persisted fields in summary mode (see TrajectorySummary)
+summary_fields = ["percentiles", "deaths"] + [f"{field}_{stat}" for field in TrajectorySummary.fields for stat in ("pct", "mean")]
+
+def save_summary(tag, summary, dst = tev_src):
+    np.savez_compressed(dst/f"{tag}_summary.npz", **summary)
+
+def store_summary(state_code, district, phi, vax_policy, summary, store = epi_store):
+    store.write_many(state_code, district, {(phi, vax_policy, field): value for (field, value) in summary.items()})
+
+# CIs of policy-vs-novax differences, written per district
+ci_columns = ["phi", "vax_policy", "metric", "num_sims", "variance_reduction", "mean", "ci_halfwidth"]
+
+def save_ci(tag, rows, dst = tev_src):
+    pd.DataFrame(rows, columns = ci_columns).to_csv(dst/f"{tag}_ci.csv", index = False)
+
+# model snapshots for horizon extension, one per district and phi (all policy arms)
+def save_snapshot(tag, model, t, dst = tev_src):
+    np.savez_compressed(dst/f"{tag}_snapshot.npz", **model.snapshot(t))
+
+def load_snapshot(tag, src = tev_src):
+    with np.load(src/f"{tag}_snapshot.npz") as npz:
+        return {key: npz[key] for key in npz.files}
+
+def expected_snapshots(district_data, dst = tev_src):
+    (state, district), state_code, *_ = district_data
+    return [dst/f"{state_code}_{district}_phi{int(phi * 365 * 100)}_snapshot.npz" for phi in phi_points]
+
+def snapshot_complete(path):
+    """ whether a snapshot exists and has been run out to the current simulation_range """
+    if not is_valid_npz(path):
+        return False
+    with np.load(path) as npz:
+        return int(npz["t"]) >= simulation_range
+
+def extend_outputs(state_code, district, phi, vax_policy, policy, t0, src = tev_src, store = None):
+    """ prepend saved trajectories up to day t0 to those of a run continued from the day-t0 snapshot (whose first entry repeats day t0) """
+    old = load_epi_outputs(state_code, district, phi, vax_policy, fields = tuple(metric_fields), t = slice(0, t0 + 1), src = src, store = store)
+    return SimpleNamespace(**{attr: np.concatenate([old[field], np.asarray(getattr(policy, attr))[1:]]) for (field, attr) in metric_fields.items()})
+
+def death_estimates(deaths):
+    """ (mean, CI half-width) of cumulative deaths per arm and of novax-minus-policy deaths, over (policy, sims) arrays """
+    novax = vax_policies.index("novax")
+    return [mean_ci(d[i], variance_reduction) for d in deaths for i in range(len(d))] +\
+        [difference_ci(d[novax], d[i], variance_reduction) for d in deaths for i in range(len(d)) if i != novax]
+
+# simulations used per district
+manifest_columns = ["state", "district", "num_sims", "converged", "max_rel_ci_halfwidth"]
+
+def save_manifest(tag, row, dst = tev_src):
+    pd.DataFrame([row], columns = manifest_columns).to_csv(dst/f"{tag}_sims.csv", index = False)
+
+def collect_manifest(dst = tev_src):
+    """ concatenate per-district manifests into sims_manifest.csv; empty if no district has written one (e.g. all were skipped) """
+    rows = [pd.read_csv(_) for _ in dst.glob("*_sims.csv")]
+    manifest = pd.concat(rows, ignore_index = True) if rows else pd.DataFrame(columns = manifest_columns)
+    manifest.to_csv(dst/"sims_manifest.csv", index = False)
+    return manifest
+
+def expected_outputs(district_data, dst = tev_src, store = None, summarize = False):
+    """ files (or store keys, if writing to a store) written by process for a district """
+    (state, district), state_code, *_ = district_data
+    arms = [(int(phi * 365 * 100), vax_policy) for phi in phi_points for vax_policy in vax_policies if vax_policy != "novax" or phi == phi_points[0]]
+    if store is not None:
+        return [(state_code, district, phi, vax_policy, field) for (phi, vax_policy) in arms for field in (summary_fields if summarize else metric_fields)]
+    return [dst/f"{state_code}_{district}_phi{phi}_{vax_policy}{'_summary' if summarize else ''}.npz" for (phi, vax_policy) in arms]
+
+def initial_susceptibles(district_data):
+    """ initial susceptibles by age bin, net of historical doses """
+    (
+        (state, district), state_code, 
+        sero_0, N_0, sero_1, N_1, sero_2, N_2, sero_3, N_3, sero_4, N_4, sero_5, N_5, sero_6, N_6, N_tot, 
+        Rt, Rt_upper, Rt_lower, S0, I0, R0, D0, dT0, dD0, V0, T_ratio, R_ratio
+    ) = district_data
+    Sj0 = np.array([(1 - sj) * Nj for (sj, Nj) in zip([sero_0, sero_1, sero_2, sero_3, sero_4, sero_5, sero_6], [N_0, N_1, N_2, N_3, N_4, N_5, N_6])])
+    # distribute historical doses assuming mortality prioritization
+    return prioritize(V0, Sj0.copy()[None, :], MORTALITY)[0]
+
+def initial_population(district_data):
+    """ initial living population (S + I + R) by age bin, the N0 against which pi, q0 and q1 are computed """
+    (_, _, *_, S0, I0, R0, D0, dT0, dD0, V0, T_ratio, R_ratio) = district_data
+    return initial_susceptibles(district_data) + (fI * I0).ravel() + (fR * R0).ravel()
+
+def process(district_data, batched = False, store = None, summarize = False, extend = False):
+    """ simulate all vaccination policy arms for a district
+
+    summarize = True (batched only) persists per-day percentiles instead of raw trajectories;
+    extend = True continues each phi from its snapshot out to simulation_range and appends to the saved trajectories
+    """
     (
         (state, district), state_code, 
         sero_0, N_0, sero_1, N_1, sero_2, N_2, sero_3, N_3, sero_4, N_4, sero_5, N_5, sero_6, N_6, N_tot, 
@@ -51,9 +155,7 @@ def process(district_data):
     except ValueError as e:
         print (state, district, e)
         return 
-    Sj0 = np.array([(1 - sj) * Nj for (sj, Nj) in zip([sero_0, sero_1, sero_2, sero_3, sero_4, sero_5, sero_6], [N_0, N_1, N_2, N_3, N_4, N_5, N_6])])
-    # distribute historical doses assuming mortality prioritization
-    Sj0 = prioritize(V0, Sj0.copy()[None, :], MORTALITY)[0]
+    Sj0 = initial_susceptibles(district_data)
     def get_model(seed = 0):
         model = Age_SIRVD(
             name        = state_code + "_" + district, 
@@ -72,9 +174,113 @@ def process(district_data):
         model.dT_total[0] = np.ones(num_sims) * dT0
         return model
 
+    def get_batched_model(seed = 0, retain_history = True, num_sims = num_sims):
+        model = BatchedAge_SIRVD(
+            name        = state_code + "_" + district, 
+            population  = N_tot - D0, 
+            dT0         = (np.ones(num_sims) * dT0).astype(int), 
+            Rt0         = 0 if S0 == 0 else Rt * N_tot / S0,
+            S0          = np.tile( Sj0,        num_sims).reshape((num_sims, -1)),
+            I0          = np.tile((fI * I0).T, num_sims).reshape((num_sims, -1)),
+            R0          = np.tile((fR * R0).T, num_sims).reshape((num_sims, -1)),
+            D0          = np.tile((fD * D0).T, num_sims).reshape((num_sims, -1)),
+            num_policies = len(vax_policies),
+            mortality   = np.array(list(OD_IFRs.values())),
+            infectious_period = infectious_period,
+            random_seed = seed,
+            retain_history = retain_history,
+            variance_reduction = variance_reduction,
+        )
+        model.dD_total[0] = np.ones((len(vax_policies), num_sims)) * dD0
+        model.dT_total[0] = np.ones((len(vax_policies), num_sims)) * dT0
+        return model
+
+    def save(phi, vax_policy, outputs, t0 = 0):
+        if t0:
+            outputs = extend_outputs(state_code, district, int(phi * 365 * 100), vax_policy, outputs, t0, store = store)
+        if store is None:
+            (save_summary if summarize else save_metrics)(f"{state_code}_{district}_phi{int(phi * 365 * 100)}_{vax_policy}", outputs)
+        else:
+            (store_summary if summarize else store_metrics)(state_code, district, int(phi * 365 * 100), vax_policy, outputs, store)
+
+    def simulate(phi, num_sims = num_sims, block = 0, summary = None, snapshot = None):
+        """ run all policy arms at vaccination rate phi, from scratch or from a snapshot; blocks beyond the first get their own random streams """
+        num_doses = phi * (S0 + I0 + R0)
+        if snapshot is None:
+            model, t0 = get_batched_model(seed if block == 0 else (seed, block), retain_history = summary is None, num_sims = num_sims), 0
+        else:
+            model, t0 = BatchedAge_SIRVD.restore(snapshot, retain_history = summary is None), int(snapshot["t"])
+        num_sims = model.shape[1]
+        if summary is not None:
+            summary.update(model)
+        allocate = Allocator([priorities[_] for _ in vax_policies], num_sims, num_age_bins)
+        daily_doses = np.array([0 if _ == "novax" else num_doses for _ in vax_policies])
+        dV = np.zeros(model.shape)
+        for t in range(t0, simulation_range):
+            if t <= 1/phi:
+                allocate(daily_doses, model.N, out = dV)
+            else:
+                dV[:] = 0
+            model.parallel_forward_epi_step(dV)
+            if summary is not None:
+                summary.update(model)
+        return model
+
+    def cumulative_deaths(model):
+        return (model.D[-1] - model.D0).sum(axis = -1)
+
+    if extend and (adaptive_sims or summarize or not batched):
+        raise ValueError("horizon extension continues batched single-block runs with raw trajectories; run with batched = True, adaptive_sims = summarize = False")
+    if batched or summarize:
+        if adaptive_sims and summarize:
+            raise ValueError("adaptive_sims needs raw trajectories to merge simulation blocks; run with summarize = False")
+        novax = vax_policies.index("novax")
+        deaths, cis = {}, []
+        if adaptive_sims:
+            # all phis advance block by block so every arm of the district (including the shared novax arm) ends with the same sims
+            runs, sims_used = {phi: [] for phi in phi_points}, 0
+            while sims_used < num_sims:
+                block = min(sims_block, num_sims - sims_used)
+                for phi in phi_points:
+                    runs[phi].append(simulate(phi, block, len(runs[phi])))
+                sims_used += block
+                deaths = {phi: stack_sims([cumulative_deaths(_) for _ in runs[phi]], variance_reduction) for phi in phi_points}
+                if relative_halfwidth(death_estimates(deaths.values()), sims_atol) <= sims_rtol:
+                    break
+            for phi in phi_points:
+                for (i, vax_policy) in enumerate(vax_policies):
+                    if vax_policy != "novax" or phi == phi_points[0]:
+                        save(phi, vax_policy, SimpleNamespace(**{
+                            attr: stack_sims([np.stack([_[i] for _ in getattr(model, attr)]) for model in runs[phi]], variance_reduction)
+                            for attr in BatchedAge_SIRVD.history
+                        }))
+                del runs[phi]
+        else:
+            for phi in phi_points:
+                tag = f"{state_code}_{district}_phi{int(phi * 365 * 100)}"
+                summary  = TrajectorySummary() if summarize else None
+                snapshot = load_snapshot(tag) if extend else None
+                model = simulate(phi, summary = summary, snapshot = snapshot)
+                deaths[phi] = cumulative_deaths(model)
+                for (i, vax_policy) in enumerate(vax_policies):
+                    if vax_policy != "novax" or phi == phi_points[0]:
+                        save(phi, vax_policy, summary[i] if summarize else model[i], t0 = 0 if snapshot is None else int(snapshot["t"]))
+                # written after the outputs, so a district interrupted mid-extension is re-extended from the old snapshot
+                if save_snapshots:
+                    save_snapshot(tag, model, simulation_range)
+
+        for (phi, d) in deaths.items():
+            for (i, vax_policy) in enumerate(vax_policies):
+                if vax_policy != "novax":
+                    cis.append((int(phi * 365 * 100), vax_policy, "deaths_averted", d.shape[1], variance_reduction, 
+                        *difference_ci(d[novax], d[i], antithetic = variance_reduction)))
+        save_ci(f"{state_code}_{district}", cis)
+        rel_halfwidth = relative_halfwidth(death_estimates(deaths.values()), sims_atol)
+        save_manifest(f"{state_code}_{district}", (state, district, next(iter(deaths.values())).shape[1], rel_halfwidth <= sims_rtol, rel_halfwidth))
+        return 
+
     for phi in phi_points:
         num_doses = phi * (S0 + I0 + R0)
-        sim_tag = f"{state_code}_{district}_phi{int(phi * 365 * 100)}_"
         random_model, mortality_model, contact_model, no_vax_model = [get_model(seed) for _ in range(4)]
         for t in range(simulation_range):
             if t <= 1/phi:
@@ -90,14 +296,32 @@ def process(district_data):
             no_vax_model   .parallel_forward_epi_step(dV = np.zeros((7, num_sims))[:, 0], num_sims = num_sims)
 
         if phi == phi_points[0]:
-            save_metrics(sim_tag + "novax", no_vax_model   )
-        save_metrics(sim_tag + "random",    random_model   )
-        save_metrics(sim_tag + "mortality", mortality_model)
-        save_metrics(sim_tag + "contact",   contact_model  )
+            save(phi, "novax", no_vax_model   )
+        save(phi, "random",    random_model   )
+        save(phi, "mortality", mortality_model)
+        save(phi, "contact",   contact_model  )
 
 if __name__ == "__main__":
     distribute = False
-    if distribute:
+    run_locally = True
+    if run_locally:
+        store = epi_store # write to the chunked array store; None writes one .npz per district and policy
+        summarize = False # persist per-day percentiles only, not raw trajectories
+        extend    = False # continue from saved snapshots out to simulation_range, appending to existing outputs
+        if extend:
+            run_local(process, districts_to_run, expected_snapshots, 
+                ledger = tev_src/"failures_epi_extend.csv", 
+                valid  = snapshot_complete,
+                batched = True, store = store, extend = True)
+        else:
+            run_local(process, districts_to_run, partial(expected_outputs, store = store, summarize = summarize), 
+                ledger = tev_src/"failures_epi.csv", 
+                valid  = is_valid_npz if store is None else store.exists,
+                batched = True, store = store, summarize = summarize)
+        if store is not None:
+            store.compact(min_dead_fraction = 0.1) # reclaim chunks left behind by rewritten or extended arrays
+        collect_manifest()
+    elif distribute:
         with dask.config.set({"scheduler.allowed-failures": 1}):
             client = dask.distributed.Client(n_workers = 1, threads_per_worker = 1)
             print(client.dashboard_link)
@@ -107,9 +331,10 @@ if __name__ == "__main__":
                     futures.append(client.submit(process, district, key = ":".join(district[0])))
             dask.distributed.progress(futures)
     else:
+        batched  = True # advance all policy arms of a district in a single state tensor
         failures = []
         for t in tqdm(districts_to_run.itertuples(), total = len(districts_to_run)):
-            process(t)
+            process(t, batched = batched)
             # try: 
             #     process(t)
             # except Exception as e:
@@ -42,7 +42,7 @@ for s, label in [
 
 q_bar_sum = {}
 for (phi, policy) in params[1:]:
-    qbs = np.sum(np.load(src / f"q_bar_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    qbs = np.sum(load_npz(src / f"q_bar_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     q_bar_sum[phi, policy] = np.percentile(qbs, [50, 5, 95], axis = 0) @ N_jk
 
 outcomes_per_policy(q_bar_sum, reference = (25, "contact"), metric_label = "sum qbar", fmt = "D")
@@ -51,7 +51,7 @@ outcomes_per_policy(q_bar_sum, reference = (25, "contact"), metric_label = "sum
 
 q_bar_sum_LE = {}
 for (phi, policy) in params[1:]:
-    qbs = np.sum(np.load(src / f"q_bar_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    qbs = np.sum(load_npz(src / f"q_bar_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     q_bar_sum_LE[phi, policy] = np.percentile(qbs, [50, 5, 95], axis = 0) @ (N_jk * years_life_remaining.loc["Bihar"])
 outcomes_per_policy(q_bar_sum_LE, reference = (25, "contact"), metric_label = "sum qbar * LE", fmt = "D")
 
@@ -59,7 +59,7 @@ outcomes_per_policy(q_bar_sum_LE, reference = (25, "contact"), metric_label = "s
 v0_sum = {}
 v0_raw = {}
 for (phi, policy) in params[1:]:
-    v0 = np.sum(np.load(src / f"v0_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    v0 = np.sum(load_npz(src / f"v0_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     v0_raw[phi, policy] = np.sum(np.percentile(v0, [50, 5, 95], axis = 0), axis = -1)
     v0_sum[phi, policy] = np.percentile(v0, [50, 5, 95], axis = 0) @ N_jk
 outcomes_per_policy(v0_raw, reference = (25, "contact"), metric_label = "v0 (no population weights)", fmt = "D")
@@ -68,7 +68,7 @@ outcomes_per_policy(v0_sum, reference = (25, "contact"), metric_label = "v0", fm
 v1_sum = {}
 v1_raw = {}
 for (phi, policy) in params[1:]:
-    v1 = np.sum(np.load(src / f"v1_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    v1 = np.sum(load_npz(src / f"v1_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     v1_raw[phi, policy] = np.sum(np.percentile(v1, [50, 5, 95], axis = 0), axis = -1)
     v1_sum[phi, policy] = np.percentile(v1, [50, 5, 95], axis = 0) @ N_jk
 outcomes_per_policy(v1_raw, reference = (25, "contact"), metric_label = "v1 (no population weights)", fmt = "D")
@@ -77,7 +77,7 @@ outcomes_per_policy(v1_sum, reference = (25, "contact"), metric_label = "v1", fm
 v0_sum = {}
 v0_raw = {}
 for (phi, policy) in params[1:]:
-    v0 = np.sum(np.load(src / f"v0_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    v0 = np.sum(load_npz(src / f"v0_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     v0_raw[phi, policy] = np.sum(np.percentile(v0, [50, 5, 95], axis = 0), axis = -1)
     v0_sum[phi, policy] = np.percentile(v0, [50, 5, 95], axis = 0) @ N_jk
 outcomes_per_policy(v0_raw, reference = (25, "contact"), metric_label = "v0 (no population weights)", fmt = "D")
@@ -86,7 +86,7 @@ outcomes_per_policy(v0_sum, reference = (25, "contact"), metric_label = "v0", fm
 v1_sum = {}
 v1_raw = {}
 for (phi, policy) in params[1:]:
-    v1 = np.sum(np.load(src / f"v1_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
+    v1 = np.sum(load_npz(src / f"v1_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0)
     v1_raw[phi, policy] = np.sum(np.percentile(v1, [50, 5, 95], axis = 0), axis = -1)
     v1_sum[phi, policy] = np.percentile(v1, [50, 5, 95], axis = 0) @ N_jk
 outcomes_per_policy(v1_raw, reference = (25, "contact"), metric_label = "v1 (no population weights)", fmt = "D")
@@ -95,18 +95,19 @@ outcomes_per_policy(v1_sum, reference = (25, "contact"), metric_label = "v1", fm
 proxy_sum = {}
 proxy_raw = {}
 for (phi, policy) in params[1:]:
-    pr = np.sum(np.load(src / f"proxyLLweight_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = (0, 2))
-    ps = np.sum(np.load(src / f"proxyLLweight_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0) @ (N_jk * years_life_remaining.loc["Bihar"])
+    pr = np.sum(load_npz(src / f"proxyLLweight_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = (0, 2))
+    ps = np.sum(load_npz(src / f"proxyLLweight_BR_Gopalganj_phi{phi}_{policy}.npz")['arr_0'], axis = 0) @ (N_jk * years_life_remaining.loc["Bihar"])
     proxy_raw[phi, policy] = np.percentile(pr, [50, 5, 95], axis = 0)
     proxy_sum[phi, policy] = np.percentile(ps, [50, 5, 95], axis = 0)
 outcomes_per_policy(proxy_raw, reference = (25, "contact"), metric_label = "sum 1-qbar * LE (no population weights)", fmt = "D")
 # outcomes_per_policy(proxy_sum, reference = (25, "contact"), metric_label = "sum 1-qbar * LE", fmt = "D")
 
+# trajectories from the chunked store (or per-tag .npz, for older runs), one read per arm
+outputs = {(phi, policy): load_epi_outputs("BR", "Gopalganj", phi, policy, fields = ("dT", "dD", "pi", "q0", "q1")) for (phi, policy) in params}
+
 for phi, policy in params:
     plt.plot(
-        np.median(
-            np.load(tev_src / f"BR_Gopalganj_phi{phi}_{policy}.npz")['dT'], 
-            axis = 1),
+        np.median(outputs[phi, policy]['dT'], axis = 1),
         label = (phi, policy)
     )
 plt.legend()
@@ -115,9 +116,7 @@ plt.show()
 
 for phi, policy in params:
     plt.plot(
-        np.median(
-            np.load(tev_src / f"BR_Gopalganj_phi{phi}_{policy}.npz")['dD'], 
-            axis = 1),
+        np.median(outputs[phi, policy]['dD'], axis = 1),
         label = (phi, policy)
     )
 plt.legend()
@@ -126,9 +125,9 @@ plt.show()
 policy = "random"
 for phi in phis:
     print(phi)
-    pi = np.load(tev_src / f"BR_Gopalganj_phi{phi}_{policy}.npz")["pi"]
-    q0 = np.load(tev_src / f"BR_Gopalganj_phi{phi}_{policy}.npz")["q0"]
-    q1 = np.load(tev_src / f"BR_Gopalganj_phi{phi}_{policy}.npz")["q1"]
+    pi = outputs[phi, policy]["pi"]
+    q0 = outputs[phi, policy]["q0"]
+    q1 = outputs[phi, policy]["q1"]
 
     plt.plot(np.median(pi, axis = 1)) 
     plt.show()
@@ -2,6 +2,7 @@ import epimargin.plots as plt
 import pandas as pd
 from epimargin.estimators import analytical_MPVS
 from studies.vaccine_allocation.commons import *
+from studies.vaccine_allocation.rollup import rollup_cube
 
 ts = case_death_timeseries(download = False)
 district_age_pop = pd.read_csv(data/"all_india_sero_pop.csv").set_index(["state", "district"])
@@ -88,13 +89,10 @@ plt.PlotDevice().ylabel("per-capita vaccination rate\n").xlabel("\ndate")
 plt.show()
 
 # fig 1C: probability of death 
-dD_TN = np.array(0.0)
-for _ in epi_dst.glob("TN*novax.npz"):
-    dD_TN = dD_TN + np.diff(np.load(_)['Dj'].sum(axis = -1), axis = 0)
-
-dD_TT = dD_TN.copy()
-for _ in filter(lambda _: "TN" not in str(_), epi_dst.glob("novax.npz")):
-    dD_TT = dD_TT + np.diff(np.load(_)['Dj'].sum(axis = -1), axis = 0)
+# daily no-vaccination deaths by age, summed over districts in the rollup cube (see rollup.py)
+cube  = rollup_cube()
+dD_TN = cube.read("dDj", "*", "novax", "TN").sum(axis = -1)
+dD_TT = cube.read("dDj", "*", "novax").sum(axis = -1)
 
 percap_death_TN = 100 * np.percentile(dD_TN, [50, 2.5, 97.5], axis = 1)/N_TN
 percap_death_TT = 100 * np.percentile(dD_TT, [50, 2.5, 97.5], axis = 1)/N_TT
@@ -126,9 +124,7 @@ plt.show()
 
 # prob of death by age bin, TN
 # epi_src = ext/f"{experiment_tag}_tev_{num_sims}_{simulation_start.strftime('%b%d')}"
-dDj_TN = np.array(0.0)
-for _ in epi_dst.glob("TN*novax.npz"):
-    dDj_TN = dDj_TN + np.diff(np.load(_)['Dj'], axis = 0)
+dDj_TN = cube.read("dDj", "*", "novax", "TN")
 percap_death_j_TN = 100 * np.percentile(dDj_TN, [50, 2.5, 97.5], axis = 1)/\
     district_age_pop.loc["Tamil Nadu"][[f"N_{i}" for i in range(7)]].sum().values
 
@@ -0,0 +1,53 @@
+from typing import Optional
+
+import numpy as np
+
+""" numerical kernels shared by the policy evaluation and figure scripts """
+
+def discounted_reverse_cumsum(daily: np.array, beta: float, out: Optional[np.array] = None, carry: Optional[np.array] = None) -> np.array:
+    """ out[t] = sum_{s >= t} beta^(s - t) * daily[s] along the leading (time) axis, in one backward pass
+
+    carry is the value at the period after the last one in daily, so a long horizon can be processed in blocks, last block first
+    """
+    daily = np.asarray(daily, dtype = float)
+    if out is None:
+        out = np.empty_like(daily)
+    # length-one slices rather than out[t], which is a scalar rather than a view when daily is 1-d
+    if carry is None:
+        out[-1:] = daily[-1:]
+    else:
+        np.multiply(carry, beta, out = out[-1:])
+        out[-1:] += daily[-1:]
+    for t in range(len(daily) - 2, -1, -1):
+        np.multiply(out[t + 1:t + 2], beta, out = out[t:t + 1])
+        out[t:t + 1] += daily[t:t + 1]
+    return out
+
+def discounted_sum(daily: np.array, beta: float) -> np.array:
+    """ sum_s beta^s * daily[s] along the leading (time) axis """
+    daily = np.asarray(daily, dtype = float)
+    return np.tensordot(np.power(beta, np.arange(len(daily))), daily, axes = 1)
+
+def ranked_cohorts(all_tev):
+    """ (t, cohort) arrays of cumulative population vaccinated (num_vax) and per capita TEV (USD), cohorts in ranked order, from an all_tev table """
+    steps = len(np.unique(all_tev.index.values))
+    return (all_tev["num_vax"].values.reshape(steps, -1), all_tev["pc_tev_usd"].values.reshape(steps, -1))
+
+def allocation_curve(cohorts, daily_doses, N, horizon: Optional[int] = None):
+    """ percentage of the population vaccinated, TEV (USD) of the cohort vaccinated and t, as step-plot coordinates, when 
+    daily_doses go each day to the highest-TEV cohort (at that day's ranking) not yet reached in the ranking, over the
+    first horizon days (default: every day in cohorts)
+
+    num_vax is nondecreasing within a day, so the first cohort past the doses distributed so far is a binary search,
+    and the ranking never moves backwards, so the cohort on each day is the running maximum of those """
+    (num_vax, pc_tev_usd) = cohorts
+    steps = len(num_vax) if horizon is None else min(horizon, len(num_vax))
+    distributed = np.concatenate([[0], np.cumsum(np.full(steps - 1, daily_doses))])
+    ranking = np.maximum.accumulate([np.searchsorted(num_vax[t], distributed[t], side = "right") for t in range(steps)])
+    steps = np.count_nonzero(ranking < num_vax.shape[1])
+    (t, ranking, distributed) = (np.arange(steps), ranking[:steps], distributed[:steps])
+    return (
+        (100 * np.stack([distributed, distributed + daily_doses], axis = 1)/N).ravel(),
+        np.repeat(pc_tev_usd[t, ranking], 2),
+        np.stack([t, t + 1], axis = 1).ravel()
+    )
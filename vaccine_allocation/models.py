@@ -0,0 +1,241 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+from epimargin.utils import fillna
+from scipy.special import ndtri, pdtr, pdtrc
+
+""" batched variants of epimargin models used in the vaccine allocation sweep """
+
+def poisson_ppf(u: np.array, lam: np.array, exact_below: float = 30) -> np.array:
+    """ exact Poisson quantile function (smallest k with P(X <= k) >= u): sequential search over the pmf below exact_below;
+    above, a third-order Cornish-Fisher guess (off by one count in < 1% of draws) corrected against the Poisson cdf. draws
+    in the far upper tail, where the running sum of the pmf rounds to 1 before reaching u, take the second route at any rate """
+    u, lam = np.broadcast_arrays(u, lam)
+    out   = np.zeros(lam.shape)
+    large = (lam >= exact_below) | (u > 1 - 1e-12)
+    z, l, v = ndtri(u[large]), lam[large], u[large]
+    r = np.sqrt(np.maximum(l, 1)) # keeps the guess finite for tail draws at small rates; the correction below does the rest
+    k = np.floor(l + r * z + (z * z - 1)/6 + (z - z * z * z)/(72 * r) + 0.5).clip(0)
+    # P(X <= k) < v, compared as P(X > k) > 1 - v in the upper tail, where the cdf rounds to 1 before the quantile is reached
+    upper, lower = np.flatnonzero(v > 0.5), np.flatnonzero(v <= 0.5)
+    def short(k):
+        below = np.empty(k.shape, dtype = bool)
+        below[upper] = pdtrc(k[upper], l[upper]) > 1 - v[upper]
+        below[lower] = pdtr(k[lower], l[lower]) < v[lower]
+        return below
+    while (low := short(k)).any():
+        k[low] += 1
+    while (high := (k > 0) & ~short(k - 1)).any():
+        k[high] -= 1
+    out[large] = k
+
+    # exact inversion by sequential search over the pmf, dropping draws from the working set as they resolve
+    small = ~large
+    k = np.zeros(small.sum())
+    u, lam = u[small], lam[small]
+    idx = np.flatnonzero(u > np.exp(-lam))
+    u, lam = u[idx], lam[idx]
+    p = np.exp(-lam)
+    c = p.copy()
+    j = 0
+    while len(idx) and j < 4 * exact_below + 50:
+        j += 1
+        p *= lam/j
+        c += p
+        k[idx] = j
+        unresolved = u > c
+        idx, u, lam, p, c = idx[unresolved], u[unresolved], lam[unresolved], p[unresolved], c[unresolved]
+    out[small] = k
+    return out
+
+class BatchedAge_SIRVD():
+    """ age-structured SIRVD model advancing several vaccination policies in lockstep
+
+    mirrors epimargin.models.Age_SIRVD.parallel_forward_epi_step, but every state array has shape
+    (num_policies, num_sims, num_age_bins) so all policy arms of a district advance in one step;
+    only the current state and the trajectories persisted by save_metrics are kept
+
+    with variance_reduction, every Poisson draw is made by inversion from uniforms that are shared
+    across policy arms (common random numbers, aligned day by day and draw by draw), and the second
+    half of the simulations reuses the first half's uniforms as 1 - u (antithetic pairs: sim i and
+    sim i + num_sims/2); CIs must then be computed over pair means (see summaries.difference_ci)
+    """
+    history = ("dT_total", "dD_total", "pi", "q0", "q1", "D", "O", "O_vn")
+    state   = ("S", "S_vm", "S_vn", "I", "I_vn", "R", "R_vm", "R_vn", "D_vn", "N", "N0", "D0", "D_vn0", "dT", "b")
+
+    def __init__(self,
+        name:              str,             # name of unit
+        population:        int,             # unit population
+        dT0:               np.array,        # last change in cases, (num_sims,)
+        Rt0:               float,           # initial reproductive rate
+        S0:                np.array,        # initial susceptibles, (num_sims, num_age_bins)
+        I0:                np.array,        # initial infected,     (num_sims, num_age_bins)
+        R0:                np.array,        # initial recovered,    (num_sims, num_age_bins)
+        D0:                np.array,        # initial dead,         (num_sims, num_age_bins)
+        num_policies:      int   = 4,       # number of policy arms advanced together
+        infectious_period: int   = 5,       # how long disease is communicable in days
+        mortality:         float = 0.02,    # I -> D transition probability (scalar or per age bin)
+        ve:                float = 0.7,     # vaccine effectiveness
+        random_seed:       int   = 0,       # random seed
+        retain_history:    bool  = True,    # keep full trajectories; if False, only the latest values are kept
+        variance_reduction: bool = False    # antithetic draws + common random numbers across policy arms
+    ):
+        self.name  = name
+        self.pop0  = population
+        self.gamma = 1.0/infectious_period
+        self.m     = mortality
+        self.Rt0   = Rt0
+        self.ve    = ve
+        self.num_policies = num_policies
+        self.retain_history = retain_history
+        self.variance_reduction = variance_reduction
+
+        batch = lambda _: np.repeat(np.asarray(_, dtype = float)[None], num_policies, axis = 0)
+        S0, I0, R0, D0 = map(batch, (S0, I0, R0, D0))
+        self.S, self.I, self.R = S0, I0, R0
+        self.shape = (_, sims, bins) = S0.shape
+        if variance_reduction and sims % 2:
+            raise ValueError(f"variance reduction pairs antithetic simulations, so num_sims must be even (got {sims})")
+
+        self.S_vm, self.S_vn, self.I_vn, self.R_vm, self.R_vn, self.D_vn = (np.zeros(self.shape) for _ in range(6))
+        self.N  = self.S + self.I + self.R
+        self.N0 = self.N.copy()
+        self.D0, self.D_vn0 = D0, self.D_vn.copy()
+
+        self.dT = batch(dT0)
+        self.b  = np.exp(self.gamma * (Rt0 - 1.0))
+
+        self.dT_total = [np.zeros((num_policies, sims))]
+        self.dD_total = [np.zeros((num_policies, sims))]
+        self.pi       = [np.zeros(self.shape)]
+        self.q0       = [np.zeros(self.shape)]
+        self.q1       = [np.zeros(self.shape)]
+        self.D        = [D0]
+        self.O        = [np.zeros(self.shape)]
+        self.O_vn     = [np.zeros(self.shape)]
+
+        self.rng = np.random.default_rng(random_seed)
+
+    def poisson(self, lam: np.array) -> np.array:
+        """ Poisson draws of shape (num_policies, num_sims, ...), independent or variance-reduced """
+        if not self.variance_reduction:
+            return self.rng.poisson(lam)
+        u = self.rng.random((lam.shape[1]//2,) + lam.shape[2:])
+        u = np.concatenate([u, 1 - u]).clip(np.finfo(float).tiny, 1 - np.finfo(float).epsneg)
+        return poisson_ppf(u[None], lam)
+
+    @np.errstate(divide = "ignore", invalid = "ignore")
+    def parallel_forward_epi_step(self, dV: np.array):
+        """ dV is a (num_policies, num_sims, num_age_bins)-sized array of vaccination doses (administered) """
+        S, S_vm, S_vn, I, I_vn, R, R_vm, R_vn, D, D_vn, N = (
+            self.S, self.S_vm, self.S_vn, self.I, self.I_vn, self.R, self.R_vm, self.R_vn, self.D[-1], self.D_vn, self.N)
+
+        # vaccination occurs here
+        dS_vm = fillna(S/N) * (    self.ve) * dV
+        dS_vn = fillna(S/N) * (1 - self.ve) * dV
+        dI_vn = fillna(I/N) * dV
+        dR_vm = fillna(R/N) * dV
+
+        S_vm  = (S_vm + dS_vm).clip(0)
+        S_vn  = (S_vn + dS_vn).clip(0)
+        S     = (S - (dS_vn + dS_vm)).clip(0)
+
+        I_vn  = (I_vn + dI_vn).clip(0)
+        I     = (I    - dI_vn).clip(0)
+
+        R_vm  = (R_vm + dR_vm).clip(0)
+        R     = (R    - dR_vm).clip(0)
+
+        S_ratios = fillna((S + S_vn)/(S + S_vn).sum(axis = -1, keepdims = True))
+
+        # core epi update with additional bins (infection, death, recovery)
+        Rt = self.Rt0 * (S + S_vn).sum(axis = -1)/(N + S_vn + S_vm + I_vn + R_vn + R_vm).sum(axis = -1)
+        b  = np.exp(self.gamma * (Rt - 1))
+
+        dT = np.clip(self.poisson(self.b * self.dT), 0, np.sum(S, axis = -1))
+
+        dS    = fillna(S   /(S + S_vn)) * (S_ratios * dT[..., None])
+        dS_vn = fillna(S_vn/(S + S_vn)) * (S_ratios * dT[..., None])
+
+        S    = (S    - dS).clip(0)
+        S_vn = (S_vn - dS_vn).clip(0)
+
+        dD    = self.poisson(   self.m  * self.gamma * I   )
+        dD_vn = self.poisson(   self.m  * self.gamma * I_vn)
+        dR    = self.poisson((1-self.m) * self.gamma * I   )
+        dR_vn = self.poisson((1-self.m) * self.gamma * I_vn)
+
+        dI    = (dS    - (dD    + dR))
+        dI_vn = (dS_vn - (dD_vn + dR_vn))
+
+        D    = (D    + dD).clip(0)
+        D_vn = (D_vn + dD_vn).clip(0)
+
+        R    = (R    + dR).clip(0)
+        R_vn = (R_vn + dR_vn).clip(0)
+
+        I    = (I    + dI).clip(0)
+        I_vn = (I_vn + dI_vn).clip(0)
+
+        N = S + I + R
+
+        # calculate vax policy evaluation metrics
+        N_v  = np.clip((S_vm + S_vn + I_vn + D_vn + R_vn + R_vm), a_min = 0, a_max = self.N0)
+        N_nv = self.N0 - N_v
+        pi   = N_v/self.N0
+
+        q1 = np.nan_to_num(1 - (D_vn - self.D_vn0)/N_v , nan = 0, neginf = 1).clip(0, 1)
+        q0 = np.nan_to_num(1 - (D    - self.D0   )/N_nv, nan = 0, neginf = 1).clip(0, 1)
+
+        # update state
+        self.S, self.S_vm, self.S_vn, self.I, self.I_vn, self.R, self.R_vm, self.R_vn, self.D_vn, self.N = (
+            S, S_vm, S_vn, I, I_vn, R, R_vm, R_vn, D_vn, N)
+        self.b, self.dT = b, dT
+
+        self.D.append(D)
+        self.dT_total.append(dT)
+        self.dD_total.append((dD + dD_vn).sum(axis = -1))
+        self.pi.append(pi)
+        self.q1.append(q1)
+        self.q0.append(q0)
+        # outflows from I and I_vn: Poisson(gamma * I) whatever the mortality split, which is what makes post-hoc IFR reweighting possible
+        self.O.append(dD + dR)
+        self.O_vn.append(dD_vn + dR_vn)
+        if not self.retain_history:
+            for attr in self.history:
+                del getattr(self, attr)[:-1]
+
+    def snapshot(self, t: int) -> dict:
+        """ full model state after t steps (compartments, latest trajectory values, random generator), as arrays for np.savez """
+        params = {"name": self.name, "population": self.pop0, "gamma": self.gamma, "mortality": np.asarray(self.m).tolist(), 
+            "Rt0": self.Rt0, "ve": self.ve, "num_policies": self.num_policies, "variance_reduction": self.variance_reduction}
+        return dict(
+            {attr: np.asarray(getattr(self, attr)) for attr in self.state},
+            **{f"last_{attr}": getattr(self, attr)[-1] for attr in self.history},
+            t      = np.array(t),
+            params = np.array(json.dumps(params)),
+            rng    = np.array(json.dumps(self.rng.bit_generator.state))
+        )
+
+    @classmethod
+    def restore(cls, snapshot, retain_history: bool = True):
+        """ rebuild a model from snapshot() output; trajectories restart from the snapshotted day, so the first entry of each history repeats it """
+        params = json.loads(str(snapshot["params"]))
+        model  = cls.__new__(cls)
+        model.name, model.pop0, model.gamma, model.Rt0, model.ve = (params[_] for _ in ("name", "population", "gamma", "Rt0", "ve"))
+        model.m = np.asarray(params["mortality"])
+        model.num_policies, model.variance_reduction = params["num_policies"], params["variance_reduction"]
+        model.retain_history = retain_history
+        for attr in cls.state:
+            setattr(model, attr, np.array(snapshot[attr]))
+        for attr in cls.history:
+            setattr(model, attr, [np.array(snapshot[f"last_{attr}"])])
+        model.shape = model.S.shape
+        model.rng = np.random.default_rng()
+        model.rng.bit_generator.state = json.loads(str(snapshot["rng"]))
+        return model
+
+    def __getitem__(self, policy: int):
+        """ trajectories for a single policy arm, laid out like an Age_SIRVD instance for save_metrics """
+        return SimpleNamespace(**{attr: np.stack([_[policy] for _ in getattr(self, attr)]) for attr in self.history})
@@ -1,14 +1,23 @@
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import chain, islice, product
 
 import epimargin.plots as plt
-import geopandas as gpd
 import mapclassify
 from epimargin.etl.covid19india import state_name_lookup
+from studies.shared.geometry import load_layer
+from studies.vaccine_allocation.aggregation import parallel_reduce
 from studies.vaccine_allocation.commons import *
 from studies.vaccine_allocation.epi_simulations import *
+from studies.vaccine_allocation.kernels import allocation_curve, ranked_cohorts
+from studies.vaccine_allocation.precision import load_npz, savez
+from studies.vaccine_allocation.rollup import rollup_cube
+from studies.vaccine_allocation.summaries import resample_sims
 from tqdm import tqdm
 
+aggregation_workers = None # threads reading district outputs in the aggregate_* functions and all_tev_columns; None uses the executor default
+
 # data loading
 N_jk_dicts = districts_to_run.filter(like = "N_", axis = 1).to_dict()
 
@@ -16,43 +25,85 @@ def parse_tag(tag):
     return tuple(int(_) if _.isnumeric() else _ for _ in tag.split("_", 1))
 
 def load_metrics(filename):
-    npz = np.load(filename)
+    npz = load_npz(filename)
     return {parse_tag(tag): npz[tag] for tag in npz.files}
 
 def map_pop_dict(agebin, state, district):
     return N_jk_dicts[f"N_{agebin_labels.index(agebin)}"][state, district]
 
+def coalesced_districts(india, coalesce_states):
+    """ district geometries indexed by (state, district), with the districts of coalesce_states dissolved into one unit per state """
+    return india\
+        .drop(columns = ["id", "dt_code", "st_code", "year"])\
+        .rename(columns = {"st_nm": "state"})\
+        .set_index(["state", "district"])\
+        .rename(index = lambda s: s.replace(" and ", " And "))\
+        .assign(
+            dissolve_state    = lambda _:_.index.get_level_values(0), 
+            dissolve_district = lambda _:np.where(
+                _.index.isin(coalesce_states, level = 0),
+                _.index.get_level_values(0), 
+                _.index.get_level_values(1)))\
+        .dissolve(["dissolve_state", "dissolve_district"])\
+        .pipe(lambda _:_.reindex(_.index.set_names(["state", "district"])))\
+        .sort_index()
+
 # calculations
-def get_all_tev(phi = 50, policy = "random", states = "*"):
-    if states == "*":
-        districts = districts_to_run.index
-    else:
-        districts = districts_to_run[districts_to_run.index.isin(states, level = 0)].index
-    district_tev = { 
-        (state, district): np.load(fig_src / f"per_capita_TEV_{state_name_lookup[state]}_{district}_phi{phi}_{policy}.npz")['arr_0']
-        for (state, district) in tqdm(districts)
+def all_tev_columns(phi = 50, policy = "random", states = "*", workers = aggregation_workers):
+    """ columns of the all_tev long table: median per capita TEV by (t, district, age bin), with population, sorted by t 
+    and then by TEV (highest first), and cumulative population vaccinated in that order; state, district and age bin
+    are codes into the states, districts and agebins label arrays 
+    
+    medians are assembled as one (t, district, age) block and population is joined by aligned arrays, so the
+    table is never built row by row """
+    districts = districts_to_run if states == "*" else districts_to_run[districts_to_run.index.isin(states, level = 0)]
+    median_tev = lambda state, district: np.median(read_metric("per_capita_TEV", state_name_lookup[state], district, phi, policy, src = fig_src), axis = 1)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        medians = np.stack(list(tqdm(pool.map(lambda _: median_tev(*_), districts.index), total = len(districts))), axis = 1)
+    (T, D, A) = medians.shape
+    t      = np.repeat(np.arange(T), D * A)
+    pc_tev = medians.ravel()
+    # stable, so ties keep (district, age bin) order within each t
+    order  = np.lexsort((-(pc_tev * USD), t))
+    pop    = np.broadcast_to(districts.filter(regex = "N_[0-6]", axis = 1).values, medians.shape).ravel()[order]
+    return {
+        "t":         t[order],
+        "district":  np.tile(np.repeat(np.arange(D), A), T)[order],
+        "agebin":    np.tile(np.arange(A), T * D)[order],
+        "pc_tev":    pc_tev[order],
+        "pop":       pop,
+        "num_vax":   pop.reshape(T, D * A).cumsum(axis = 1).ravel(),
+        "states":    np.asarray(districts.index.get_level_values(0), dtype = str),
+        "districts": np.asarray(districts.index.get_level_values(1), dtype = str),
+        "agebins":   np.array(agebin_labels)
     }
-    all_tev = pd.concat([
-        pd.DataFrame(np.median(v, axis = 1))\
-            .assign(state = state, district = district)\
-            .reset_index()\
-            .rename(columns = {"index": "t"})\
-            .rename(columns = dict(enumerate(agebin_labels)))\
-            .set_index(["t", "state", "district"])
-        for ((state, district), v) in tqdm(district_tev.items())
-    ], axis = 0)\
-        .stack()\
-        .reset_index()\
-        .rename(columns = {"level_3": "agebin", 0: "pc_tev"})
-    all_tev["_t"]  = -all_tev["t"]
-    all_tev["pop"] = [map_pop_dict(b, s, d) for (b, s, d) in all_tev[["agebin", "state", "district"]].itertuples(index = False)]
-    all_tev["pc_tev_usd"] = all_tev["pc_tev"] * USD 
-    all_tev.sort_values(["_t", "pc_tev_usd"], ascending = False, inplace = True)
-    all_tev.drop(columns = ["_t"], inplace = True) 
-    all_tev.set_index("t", inplace = True)
-    all_tev["num_vax"] = all_tev["pop"].groupby(level = 0).cumsum()
 
-    return all_tev 
+def all_tev_frame(columns):
+    """ all_tev long table (indexed by t) from all_tev_columns """
+    return pd.DataFrame({
+        "t":          columns["t"],
+        "state":      columns["states"]   [columns["district"]],
+        "district":   columns["districts"][columns["district"]],
+        "agebin":     columns["agebins"]  [columns["agebin"]],
+        "pc_tev":     columns["pc_tev"],
+        "pop":        columns["pop"],
+        "pc_tev_usd": columns["pc_tev"] * USD,
+        "num_vax":    columns["num_vax"]
+    }).set_index("t")
+
+def get_all_tev(phi = 50, policy = "random", states = "*"):
+    return all_tev_frame(all_tev_columns(phi, policy, states))
+
+def all_tev_cache(phi, policy):
+    return data/f"all_tev_{phi}_{policy}.npz"
+
+def save_all_tev(phi, policy, states = "*"):
+    """ columnar cache of all_tev_columns, written uncompressed so it loads without parsing """
+    savez(all_tev_cache(phi, policy), "full", compresslevel = 0, **all_tev_columns(phi, policy, states))
+
+def load_all_tev(phi, policy):
+    with load_npz(all_tev_cache(phi, policy)) as npz:
+        return all_tev_frame({key: npz[key] for key in npz.files})
 
 def get_within_state_wtp_ranking(state, district_WTP, phi, vax_policy = "random"):
     all_wtp = pd.concat([
@@ -81,25 +132,26 @@ def get_within_state_wtp_ranking(state, district_WTP, phi, vax_policy = "random"
 
     return all_wtp
 
-def aggregate_static_percentiles(src, pattern, sum_axis = 0, pct_axis = 0, lim = None, drop = None):
-    predicate = (lambda _: True) if not drop else (lambda _: all(d not in str(_) for d in drop))
-    total = np.array(0)
-    for npz in tqdm(islice(filter(predicate, src.glob(pattern)), lim)):
-        total = total + np.load(npz)['arr_0']
+def matching_outputs(src, pattern, lim = None, drop = None):
+    predicate = (lambda _: True) if not drop else (lambda _: all(d not in _[0] for d in drop))
+    return list(islice(filter(predicate, glob_metrics(src, pattern)), lim))
+
+def aggregate_static_percentiles(src, pattern, sum_axis = 0, pct_axis = 0, lim = None, drop = None, workers = aggregation_workers):
+    outputs = matching_outputs(src, pattern, lim, drop)
+    total = parallel_reduce(outputs, lambda _, path, key: resample_sims(load_metric(path, key), num_sims, axis = pct_axis), 
+        workers = workers, progress = partial(tqdm, total = len(outputs)))
     return np.percentile(total, [50, 5, 95], axis = pct_axis)
 
-def aggregate_dynamic_percentiles(src, pattern, sum_axis = 1, pct_axis = 0, t = 0, lim = None, drop = None):
-    predicate = (lambda _: True) if not drop else (lambda _: all(d not in str(_) for d in drop))
-    total = np.array(0)
-    for npz in tqdm(islice(filter(predicate, src.glob(pattern)), lim)):
-        total = total + np.load(npz)['arr_0'][t].sum(axis = sum_axis)
+def aggregate_dynamic_percentiles(src, pattern, sum_axis = 1, pct_axis = 0, t = 0, lim = None, drop = None, workers = aggregation_workers):
+    outputs = matching_outputs(src, pattern, lim, drop)
+    total = parallel_reduce(outputs, lambda _, path, key: resample_sims(load_metric(path, key, t = t).sum(axis = sum_axis), num_sims, axis = pct_axis), 
+        workers = workers, progress = partial(tqdm, total = len(outputs)))
     return np.percentile(total, [50, 5, 95], axis = pct_axis)
 
-def aggregate_dynamic_percentiles_by_age(src, pattern, sum_axis = 1, pct_axis = 0, t = 0, lim = None, drop = None):
-    predicate = (lambda _: True) if not drop else (lambda _: all(d not in str(_) for d in drop))
-    total = np.array(0)
-    for npz in tqdm(islice(filter(predicate, src.glob(pattern)), lim)):
-        total = total + np.load(npz)['arr_0'][t]
+def aggregate_dynamic_percentiles_by_age(src, pattern, sum_axis = 1, pct_axis = 0, t = 0, lim = None, drop = None, workers = aggregation_workers):
+    outputs = matching_outputs(src, pattern, lim, drop)
+    total = parallel_reduce(outputs, lambda _, path, key: resample_sims(load_metric(path, key, t = t), num_sims, axis = pct_axis), 
+        workers = workers, progress = partial(tqdm, total = len(outputs)))
     return np.percentile(total, [50, 5, 95], axis = pct_axis)
 
 # plotting functions
@@ -199,6 +251,7 @@ if __name__ == "__main__":
     figs_to_run = set(sys.argv[1:])
     run_all = len(figs_to_run) == 0 # if none specified, run all
     src = fig_src
+    cube = rollup_cube(src) # national, state and district sums (see rollup.py)
     phis = [int(_ * 365 * 100) for _ in phi_points]
     params = list(chain([(phis[0], "novax",)], product(phis, ["contact", "random", "mortality"])))
     recalculate = False
@@ -206,7 +259,7 @@ if __name__ == "__main__":
     # 2A: deaths
     if "2A" in figs_to_run or "deaths" in figs_to_run or run_all:
         death_percentiles = {
-            p: aggregate_static_percentiles(src, f"deaths*phi{'_'.join(map(str, p))}.npz")
+            p: cube.percentiles("deaths", *p)
             for p in params 
         }
         outcomes_per_policy(death_percentiles, "deaths", "o", 
@@ -221,7 +274,7 @@ if __name__ == "__main__":
     ## 2B: VSLY
     if "2B" in figs_to_run or "VSLY" in figs_to_run or run_all:
         VSLY_percentiles = {
-            p: aggregate_dynamic_percentiles(src, f"total_VSLY_*phi{'_'.join(map(str, p))}.npz", drop = ["_SK_", "_NL_"])
+            p: cube.percentiles("total_VSLY", *p, t = 0)
             for p in tqdm(params)
         }
 
@@ -238,7 +291,7 @@ if __name__ == "__main__":
     ## 2C: TEV
     if "2C" in figs_to_run or "TEV" in figs_to_run or "WTP" in figs_to_run or run_all:
         TEV_percentiles = {
-            p: aggregate_dynamic_percentiles(src, f"total_TEV*phi{'_'.join(map(str, p))}.npz", drop = ["_SK_", "_NL_"])
+            p: cube.percentiles("total_TEV", *p, t = 0)
             for p in tqdm(params)
         }
 
@@ -254,17 +307,8 @@ if __name__ == "__main__":
 
     ## 2D: state x age 
     if "2D" in figs_to_run or "TEV_state_age" in figs_to_run or run_all:
-        # focus_state_TEV = { 
-        #     state: aggregate_dynamic_percentiles_by_age(src, f"total_TEV_{state}*phi50_random.npz", sum_axis = 0, pct_axis = 0)
-        #     for state in tqdm([state_name_lookup[_] for _ in  focus_states])
-        # }
-        focus_state_TEV = {state: np.array(0) for state in focus_states}
-        focus_state_agepop = districts_to_run.loc[focus_states].filter(regex = "N_[0-6]", axis = 1).sum(level = 0)
-        for (state, district) in districts_to_run.loc[focus_states].index:
-            state_code = state_name_lookup[state]
-            state_age_weight = districts_to_run.loc[state, district].filter(regex = "N_[0-6]", axis = 0)/focus_state_agepop.loc[state]
-            median_tev = np.load(fig_src / f"per_capita_TEV_{state_code}_{district}_phi50_random.npz")['arr_0'][0]
-            focus_state_TEV[state] = focus_state_TEV[state] + state_age_weight.values * median_tev
+        # per capita TEV by age, weighted by each district's share of the state's population in the age bin
+        focus_state_TEV = {state: cube.read("per_capita_TEV", 50, "random", state_name_lookup[state], t = 0) for state in focus_states}
 
         plot_state_age_distribution({k: v * USD for k, v in focus_state_TEV.items()}, "per capita TEV (USD)", "D", ymin = 0, ymax = 1000)
         plt.show()
@@ -272,7 +316,7 @@ if __name__ == "__main__":
     # appendix: YLL
     if "YLL" in figs_to_run or run_all:
         YLL_percentiles = {
-            p: aggregate_static_percentiles(src, f"YLL_*phi{'_'.join(map(str, p))}.npz")
+            p: cube.percentiles("YLL", *p)
             for p in tqdm(params)
         }
         outcomes_per_policy({k: v/1e6 for (k, v) in YLL_percentiles.items()}, "YLL (millions)", "o", 
@@ -286,7 +330,7 @@ if __name__ == "__main__":
 
     if "VSL" in figs_to_run or run_all:
         VSL_percentiles = {
-            p: aggregate_static_percentiles(src, f"VSL_*phi{'_'.join(map(str, p))}.npz")
+            p: cube.percentiles("VSL", *p)
             for p in tqdm(list(product([25, 50, 100, 200], ["contact", "random", "mortality"])))
         }
         VSL_percentiles[25, "novax"] = np.array([0, 0, 0])
@@ -301,36 +345,23 @@ if __name__ == "__main__":
 
     # 3A: health/consumption
     if "3A" in figs_to_run or run_all:
-        summed_TEV_hlth = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob("dTEV_health*"), total = len(districts_to_run))], axis = 0), axis = 0)
-        summed_TEV_cons = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob("dTEV_cons*"),   total = len(districts_to_run))], axis = 0), axis = 0)
+        summed_TEV_hlth = np.median(cube.read("dTEV_health", 50, "random"), axis = 0)
+        summed_TEV_cons = np.median(cube.read("dTEV_cons", 50, "random"), axis = 0)
         plot_component_breakdowns(summed_TEV_hlth, summed_TEV_cons, "health", "consumption", semilogy = True, ylabel = "age-weighted TEV (USD)")
         plt.show()
 
-        summed_TEV_priv = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob("dTEV_priv*"), total = len(districts_to_run))], axis = 0), axis = 0)
-        summed_TEV_extn = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob("dTEV_extn*"), total = len(districts_to_run))], axis = 0), axis = 0)
+        summed_TEV_priv = np.median(cube.read("dTEV_priv", 50, "random"), axis = 0)
+        summed_TEV_extn = np.median(cube.read("dTEV_extn", 50, "random"), axis = 0)
         plot_component_breakdowns(summed_TEV_priv, summed_TEV_extn, "private", "external", semilogy = False, ylabel = "age-weighted TEV (USD)")
         plt.show()
 
     if "3B" in figs_to_run or run_all:
         vax_policy = "mortality"
         if recalculate:
-            print(25)
-            all_tev_25  = get_all_tev(phi = 25, policy = vax_policy)
-            all_tev_25.to_csv(data / f"all_tev_25_{vax_policy}.csv")
-            print(50)
-            all_tev_50  = get_all_tev(phi = 50, policy = vax_policy)
-            all_tev_50.to_csv(data / f"all_tev_50_{vax_policy}.csv")
-            print(100)
-            all_tev_100 = get_all_tev(phi = 100, policy = vax_policy)
-            all_tev_100.to_csv(data / f"all_tev_100_{vax_policy}.csv")
-            print(200)
-            all_tev_200 = get_all_tev(phi = 200, policy = vax_policy)
-            all_tev_200.to_csv(data / f"all_tev_200_{vax_policy}.csv")
-        else:
-            all_tev_25  = pd.read_csv(data / f"all_tev_25_{vax_policy}.csv").set_index("t")
-            all_tev_50  = pd.read_csv(data / f"all_tev_50_{vax_policy}.csv").set_index("t")
-            all_tev_100 = pd.read_csv(data / f"all_tev_100_{vax_policy}.csv").set_index("t")
-            all_tev_200 = pd.read_csv(data / f"all_tev_200_{vax_policy}.csv").set_index("t")
+            for phi in [25, 50, 100, 200]:
+                print(phi)
+                save_all_tev(phi, vax_policy)
+        (all_tev_25, all_tev_50, all_tev_100, all_tev_200) = [load_all_tev(phi, vax_policy) for phi in [25, 50, 100, 200]]
 
         # plot static benchmark
         N_natl = districts_to_run.N_tot.sum()
@@ -350,21 +381,7 @@ if __name__ == "__main__":
         # plot dynamic curve 
         phis = [25, 50, 100, 200]
         for (phi, all_tev) in zip(phis, [all_tev_25, all_tev_50, all_tev_100, all_tev_200]):
-            daily_doses = phi * percent * annually * N_natl
-            distributed_doses = 0
-            x_pop = []
-            y_tev = []
-            t_vax = []
-            ranking = 0
-            for t in range(simulation_range):
-                tev = all_tev.loc[t].reset_index()
-                ranking = tev[(tev.index >= ranking) & (tev.num_vax > distributed_doses)].index.min()
-                if np.isnan(ranking):
-                    break
-                x_pop += [100 * (distributed_doses)/N_natl, 100 * (distributed_doses + daily_doses)/N_natl]
-                t_vax += [t, t+1]
-                y_tev += [tev.iloc[ranking].pc_tev_usd]*2
-                distributed_doses += daily_doses
+            x_pop, y_tev, t_vax = allocation_curve(ranked_cohorts(all_tev), phi * percent * annually * N_natl, N_natl, horizon = simulation_range)
             # lines += [plt.plot(x_pop, y_tev, label = f"dynamic, {vax_policy}, $\phi = ${phi}%", figure = figure)[0]]
             lines += [plt.plot(x_pop, y_tev, label = f"dynamic, {vax_policy}, $phi = ${phi}%", figure = figure)[0]]
         plt.legend(
@@ -381,26 +398,14 @@ if __name__ == "__main__":
 
     # 3C: YLL per million choropleth
     if "3C" in figs_to_run or run_all:
-        india = gpd.read_file(data/"india.geojson")\
-            .drop(columns = ["id", "dt_code", "st_code", "year"])\
-            .rename(columns = {"st_nm": "state"})\
-            .set_index(["state", "district"])\
-            .rename(index = lambda s: s.replace(" and ", " And "))\
-            .assign(
-                dissolve_state    = lambda _:_.index.get_level_values(0), 
-                dissolve_district = lambda _:np.where(
-                    _.index.isin(coalesce_states, level = 0),
-                    _.index.get_level_values(0), 
-                    _.index.get_level_values(1)))\
-            .dissolve(["dissolve_state", "dissolve_district"])\
-            .pipe(lambda _:_.reindex(_.index.set_names(["state", "district"])))\
-            .sort_index()
-        def load_median_YLL(state_district, phi = 50, vax_policy = "random", src = src):
+        # district boundaries with coalesced states dissolved, prepared once and cached (see geometry.py); simplified for plotting
+        india = load_layer(data/"india.geojson", coalesced_districts, rules = {"coalesce_states": coalesce_states}, level = "fine")
+        def load_median_YLL(state_district, phi = 50, vax_policy = "random"):
             state, district = state_district
             state = state_name_lookup[state]
             try:
-                return np.median(np.load(src/f"YLL_{state}_{district}_phi{phi}_{vax_policy}.npz")['arr_0'])
-            except FileNotFoundError:
+                return np.median(cube.read("YLL", phi, vax_policy, state, district))
+            except KeyError:
                 # return np.nan
                 return 0
 
@@ -448,9 +453,9 @@ if __name__ == "__main__":
 
     # consumption graph
     if "consumption" in figs_to_run:
-        c_p0v0_200_mortality = np.mean(sum(np.load(_)['arr_0'] for _ in src.glob("age_weight_c_p0v0*phi200_mortality*")), axis = 1)
-        c_p1v0_200_mortality = np.mean(sum(np.load(_)['arr_0'] for _ in src.glob("age_weight_c_p1v0*phi200_mortality*")), axis = 1)
-        c_p1v1_200_mortality = np.mean(sum(np.load(_)['arr_0'] for _ in src.glob("age_weight_c_p1v1*phi200_mortality*")), axis = 1)
+        c_p0v0_200_mortality = np.mean(sum(load_npz(_)['arr_0'] for _ in src.glob("age_weight_c_p0v0*phi200_mortality*")), axis = 1)
+        c_p1v0_200_mortality = np.mean(sum(load_npz(_)['arr_0'] for _ in src.glob("age_weight_c_p1v0*phi200_mortality*")), axis = 1)
+        c_p1v1_200_mortality = np.mean(sum(load_npz(_)['arr_0'] for _ in src.glob("age_weight_c_p1v1*phi200_mortality*")), axis = 1)
 
         fig = plt.figure()
         for (i, (color, label)) in enumerate(zip(agebin_colors, agebin_labels)):
@@ -474,10 +479,7 @@ if __name__ == "__main__":
     # per state supplements:
     if "focus-states" in figs_to_run:
         vax_policy = "mortality"
-        all_tev_25  = pd.read_csv(data / f"all_tev_25_{vax_policy}.csv").set_index("t")
-        all_tev_50  = pd.read_csv(data / f"all_tev_50_{vax_policy}.csv").set_index("t")
-        all_tev_100 = pd.read_csv(data / f"all_tev_100_{vax_policy}.csv").set_index("t")
-        all_tev_200 = pd.read_csv(data / f"all_tev_200_{vax_policy}.csv").set_index("t")
+        (all_tev_25, all_tev_50, all_tev_100, all_tev_200) = [load_all_tev(phi, vax_policy) for phi in [25, 50, 100, 200]]
 
         for state in focus_states:
             print(state)
@@ -487,7 +489,7 @@ if __name__ == "__main__":
             # focus_state_agepop = districts_to_run.loc[state].filter(regex = "N_[0-6]", axis = 1).sum(axis = 0)
             # for district in districts_to_run.loc[state].index:
             #     district_age_weight = districts_to_run.loc[state, district].filter(regex = "N_[0-6]")/focus_state_agepop
-            #     median_tev = np.load(fig_src / f"per_capita_TEV_{state_code}_{district}_phi50_random.npz")['arr_0'][0]
+            #     median_tev = load_npz(fig_src / f"per_capita_TEV_{state_code}_{district}_phi50_random.npz")['arr_0'][0]
             #     district_TEV[district] = district_TEV[district] + state_age_weight.values * median_tev
 
             # print()
@@ -514,21 +516,7 @@ if __name__ == "__main__":
             phis = [25, 50, 100, 200]
             for (phi, _all_tev) in zip(phis, [all_tev_25, all_tev_50, all_tev_100, all_tev_200]):
                 all_tev = _all_tev.query("state == @state")
-                daily_doses = phi * percent * annually * N_state
-                distributed_doses = 0
-                x_pop = []
-                y_tev = []
-                t_vax = []
-                ranking = 0
-                for t in range(simulation_range):
-                    tev = all_tev.loc[t].reset_index()
-                    ranking = tev[(tev.index >= ranking) & (tev.num_vax > distributed_doses)].index.min()
-                    if np.isnan(ranking):
-                        break
-                    x_pop += [100 * (distributed_doses)/N_state, 100 * (distributed_doses + daily_doses)/N_state]
-                    t_vax += [t, t+1]
-                    y_tev += [tev.iloc[ranking].pc_tev_usd]*2
-                    distributed_doses += daily_doses
+                x_pop, y_tev, t_vax = allocation_curve(ranked_cohorts(all_tev), phi * percent * annually * N_state, N_state, horizon = simulation_range)
                 # lines += [plt.plot(x_pop, y_tev, label = f"dynamic, {vax_policy}, $\phi = ${phi}%", figure = figure)[0]]
                 lines += [plt.plot(x_pop, y_tev, label = f"dynamic, {vax_policy}, $phi = ${phi}%", figure = figure)[0]]
             plt.legend(
@@ -543,7 +531,7 @@ if __name__ == "__main__":
             plt.xlim(left = 0, right = 100)
             plt.show()
 
-            summed_TEV_hlth = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob(f"dTEV_health*{state_code}*"))], axis = 0), axis = 0)
-            summed_TEV_cons = np.median(np.nansum([np.load(s)['arr_0'] for s in tqdm(src.glob(f"dTEV_cons*{state_code}*"))],   axis = 0), axis = 0)
+            summed_TEV_hlth = np.median(cube.read("dTEV_health", 50, "random", state_code), axis = 0)
+            summed_TEV_cons = np.median(cube.read("dTEV_cons", 50, "random", state_code), axis = 0)
             plot_component_breakdowns(summed_TEV_hlth, summed_TEV_cons, "health", "consumption", semilogy = True, ylabel = "national age-weighted TEV (USD)")
             plt.show()
\ No newline at end of file
@@ -1,9 +1,16 @@
+from functools import lru_cache
 from itertools import product
 
 # import dask.distributed
 import pandas as pd
 from studies.vaccine_allocation.commons import *
 from studies.vaccine_allocation.epi_simulations import *
+from studies.vaccine_allocation.kernels import (discounted_reverse_cumsum,
+                                                discounted_sum)
+from studies.vaccine_allocation.precision import encoding_for, load_npz, savez
+from studies.vaccine_allocation.registry import Registry
+from studies.vaccine_allocation.reweighting import reweight
+from studies.vaccine_allocation.summaries import difference_ci
 from tqdm import tqdm
 
 src = tev_src
@@ -67,19 +74,78 @@ def rc_hat(state, district, dI_pc, dD_pc):
         D_coeff * dD_pc
     )
 
-def NPV(daily, n = simulation_range + 1, beta = 1/((1.0425)**(1/365))):
-    """ calculate net present value over n periods at discount factor beta """
-    s = np.arange(n)
-    return [ 
-        np.sum(np.power(beta, s[t:] - t)[:, None, None] * daily[t:, :], axis = 0)
-        for t in range(n)
-    ]
+class ConsumptionModel:
+    """ rc_hat and consumption for all districts of a state in one operation; the district fixed effects and 2019 
+    consumption levels are aligned to a district axis once, so calls do no dict or .loc lookups """
+    def __init__(self, state, districts):
+        self.state     = state
+        self.districts = list(districts)
+        self.rows      = {district: i for (i, district) in enumerate(self.districts)}
+        self.FE        = np.array([district_FE.get((state, district), 0) for district in self.districts]) + constant
+        self.c_2019    = consumption_2019.loc[state].loc[self.districts].values.astype(float)
 
-def counterfactual_metrics(q_p0v0, c_p0v0):
+    def select(self, districts = None):
+        return slice(None) if districts is None else [self.rows[_] for _ in districts]
+
+    def rc_hat(self, dI_pc, dD_pc, districts = None, out = None):
+        """ consumption decline, (district, t, sims), given per capita infections and deaths of shape (district, t, sims) """
+        out  = np.multiply(I_coeff, dI_pc, out = out)
+        out += D_coeff * dD_pc
+        out += self.FE[self.select(districts), None, None]
+        out += month_FE[None, :, None]
+        return out
+
+    def __call__(self, dI_pc, dD_pc, districts = None, out = None):
+        """ consumption, (district, t, sims, age), written into out if given """
+        rc  = self.rc_hat(dI_pc, dD_pc, districts)
+        rc += 1
+        return np.multiply(rc[..., None], self.c_2019[self.select(districts), None, None, :], out = out)
+
+@lru_cache(maxsize = None)
+def consumption_model(state):
+    return ConsumptionModel(state, consumption_2019.loc[state].index)
+
+def NPV(daily, n = simulation_range + 1, beta = 1/((1.0425)**(1/365)), t0_only = False):
+    """ calculate net present value over n periods at discount factor beta, as of every period t (or only t = 0) """
+    daily = np.asarray(daily)[:n]
+    if t0_only:
+        return discounted_sum(daily, beta)
+    return discounted_reverse_cumsum(daily, beta)
+
+# memory-budget mode: MB of temporaries per evaluation step; daily flows are then built and discounted one time block 
+# at a time into reused buffers (and evaluate_district takes policy arms in groups). None evaluates whole horizons at once
+memory_budget = None
+
+def time_blocks(width, temporaries = 1, n = simulation_range + 1):
+    """ slices of the horizon, last first, such that `temporaries` (block x width) float arrays fit in memory_budget """
+    step = n if memory_budget is None else int(np.clip(memory_budget * 2**20 // (8 * temporaries * width), 1, n))
+    return [slice(t, min(t + step, n)) for t in range(0, n, step)][::-1]
+
+def streamed_NPV(flows, shape, temporaries = 1, n = simulation_range + 1, beta = 1/((1.0425)**(1/365)), t0_only = False):
+    """ NPV of daily flows built one time block at a time: flows(block, out) writes the flows for periods block into out, 
+    a reused (len(block), *shape) buffer; temporaries counts that buffer plus any flows() allocates itself """
+    blocks = time_blocks(np.prod(shape), temporaries, n)
+    buffer = np.empty((blocks[-1].stop, *shape))
+    if t0_only:
+        total = np.zeros(shape)
+        for block in blocks:
+            total += beta**block.start * discounted_sum(flows(block, buffer[:block.stop - block.start]), beta)
+        return total
+    out = np.empty((n, *shape))
+    for block in blocks:
+        discounted_reverse_cumsum(flows(block, buffer[:block.stop - block.start]), beta, out = out[block], carry = out[block.stop] if block.stop < n else None)
+    return out
+
+def sims_mean(x):
+    """ mean over the simulation axis, kept for broadcasting against (t, sims, age) """
+    return np.mean(x, axis = 1)[:, None, :]
+
+def counterfactual_metrics(q_p0v0, c_p0v0, c_p0v0_mean = None):
     """ evaluate health and econ metrics for the non-vaccination policy scenario """
-    TEV_daily  = q_p0v0 * c_p0v0
-    VSLY_daily = q_p0v0 * np.mean(c_p0v0, axis = 1)[:, None, :]
-    return NPV(TEV_daily), NPV(VSLY_daily)
+    c_bar = sims_mean(c_p0v0) if c_p0v0_mean is None else c_p0v0_mean
+    TEV  = streamed_NPV(lambda block, out: np.multiply(q_p0v0[block], c_p0v0[block], out = out), q_p0v0.shape[1:])
+    VSLY = streamed_NPV(lambda block, out: np.multiply(q_p0v0[block], c_bar [block], out = out), q_p0v0.shape[1:])
+    return TEV, VSLY
 
 # def policy_TEV(pi, q_p1v1, q_p1v0, q_p0v0, c_p1v1, c_p1v0, c_p0v0):
 #     """ evaluate health and econ metrics for the vaccination policy scenario """
@@ -103,46 +169,96 @@ def counterfactual_metrics(q_p0v0, c_p0v0):
 #         NPV(dTEV_priv)[0]
 #     )
 
-def policy_TEV(pi, q_p1v0, q_p0v0, c_p1v1, c_p1v0, c_p0v0):
-    """ evaluate health and econ metrics for the vaccination policy scenario """
-    # overall economic value
-    TEV_daily = (1 - pi) * q_p1v0 * c_p1v0 + pi * c_p1v1 
-    # health contribution to economic value
-    dTEV_hlth = \
-        (1 - pi) * (q_p1v0 - q_p0v0.mean(axis = 1)[:, None, :]) * c_p1v0 +\
-             pi  * (np.array(1) - q_p0v0.mean(axis = 1)[:, None, :]) * c_p1v1
-    # consumption contribution to economic value
-    dTEV_cons = \
-        (1 - pi) * q_p0v0.mean(axis = 1)[:, None, :] * (c_p1v0 - c_p0v0.mean(axis = 1)[:, None, :]) +\
-             pi                                      * (c_p1v1 - c_p0v0.mean(axis = 1)[:, None, :])
-    # private contribution to economic value
-    dTEV_priv = c_p1v1 - q_p1v0 * c_p1v0
+def policy_TEV_daily(pi, q_p1v0, c_p1v0, c_p1v1):
+    """ flows of overall economic value, (1 - pi) * q_p1v0 * c_p1v0 + pi * c_p1v1, for streamed_NPV """
+    def TEV_daily(block, out):
+        np.subtract(1, pi[block], out = out)
+        out *= q_p1v0[block]
+        out *= c_p1v0[block]
+        out += pi[block] * c_p1v1[block]
+        return out
+    return TEV_daily
+
+def policy_TEV(pi, q_p1v0, q_p0v0, c_p1v1, c_p1v0, c_p0v0, q_p0v0_mean = None, c_p0v0_mean = None):
+    """ evaluate health and econ metrics for the vaccination policy scenario; counterfactual means over sims are computed once (or passed in) """
+    q_bar = sims_mean(q_p0v0) if q_p0v0_mean is None else q_p0v0_mean
+    c_bar = sims_mean(c_p0v0) if c_p0v0_mean is None else c_p0v0_mean
+    shape = pi.shape[1:]
+    TEV_daily = policy_TEV_daily(pi, q_p1v0, c_p1v0, c_p1v1)
+    # health contribution to economic value: (1 - pi) * (q_p1v0 - q_bar) * c_p1v0 + pi * (1 - q_bar) * c_p1v1
+    def dTEV_hlth(block, out):
+        np.subtract(q_p1v0[block], q_bar[block], out = out)
+        out *= 1 - pi[block]
+        out *= c_p1v0[block]
+        out += pi[block] * ((1 - q_bar[block]) * c_p1v1[block])
+        return out
+    # consumption contribution to economic value: (1 - pi) * q_bar * (c_p1v0 - c_bar) + pi * (c_p1v1 - c_bar)
+    def dTEV_cons(block, out):
+        np.subtract(c_p1v0[block], c_bar[block], out = out)
+        out *= q_bar[block]
+        out *= 1 - pi[block]
+        out += pi[block] * (c_p1v1[block] - c_bar[block])
+        return out
+    # private contribution to economic value: c_p1v1 - q_p1v0 * c_p1v0
+    def dTEV_priv(block, out):
+        np.multiply(q_p1v0[block], c_p1v0[block], out = out)
+        return np.subtract(c_p1v1[block], out, out = out)
 
     return (
-        NPV(TEV_daily),
-        NPV(dTEV_hlth)[0],
-        NPV(dTEV_cons)[0],
-        NPV(dTEV_priv)[0]
+        streamed_NPV(TEV_daily, shape, temporaries = 2),
+        streamed_NPV(dTEV_hlth, shape, temporaries = 2, t0_only = True),
+        streamed_NPV(dTEV_cons, shape, temporaries = 2, t0_only = True),
+        streamed_NPV(dTEV_priv, shape, temporaries = 1, t0_only = True)
     )
 
 def policy_VSLY(pi, q_p1v1, q_p1v0, c_p0v0):
     # value of statistical life year
     return NPV((((1 - pi) * q_p1v0) + (pi * q_p1v1)) * np.mean(c_p0v0, axis = 1)[:, None, :])
 
-def new_VSLY(pi, q_p1v0, c_p0v0):
-    return NPV(((1 - pi) * q_p1v0 + pi) * np.mean(c_p0v0, axis = 1)[:, None, :])
+def new_VSLY(pi, q_p1v0, c_p0v0, c_p0v0_mean = None):
+    c_bar = sims_mean(c_p0v0) if c_p0v0_mean is None else c_p0v0_mean
+    def VSLY_daily(block, out):
+        np.subtract(1, pi[block], out = out)
+        out *= q_p1v0[block]
+        out += pi[block]
+        out *= c_bar[block]
+        return out
+    return streamed_NPV(VSLY_daily, pi.shape[1:], temporaries = 1)
 
 def weighted_q(pi, q_p1v1, q_p1v0):
     return (1 - pi) * q_p1v0 + pi * q_p1v1
 
 def policy_VSL(LS, age_weight, c_p0v0):
-    return (LS.sum(axis = 1) * (age_weight * NPV(c_p0v0)[0]).sum(axis = 1))
+    return (LS.sum(axis = 1) * (age_weight * NPV(c_p0v0, t0_only = True)).sum(axis = 1))
+
+def save_metrics(name, metrics, dst = tev_dst, precision = output_precision, register = True):
+    """ write one metric file; returns its catalog entry, registered right away unless register is False (to batch a district's entries) """
+    savez(dst/f"{name}.npz", precision, name = name, arr_0 = metrics)
+    entry = (f"{name}.npz", dst/f"{name}.npz", None)
+    if register:
+        output_catalog(dst).add([entry])
+    return entry
+
+def reweighted_outputs(state, district, phi, vax_policy, mortality, fields = ("dT", "dD", "pi", "q0", "q1", "Dj"), t = slice(None), method = "binomial", seed = 0, src = src):
+    """ epi outputs for one arm with dD, Dj, q0 and q1 recomputed for the IFR vector mortality, without re-simulating (see reweighting.py) """
+    district_data = next(simulation_initial_conditions.loc[[(state, district)]].itertuples())
+    state_code = district_data[1]
+    outputs = load_epi_outputs(state_code, district, phi, vax_policy, fields = ("dT", "dD", "pi", "q0", "q1", "Dj", "Oj", "Oj_vn"), src = src)
+    outputs.update(reweight(outputs, mortality, initial_population(district_data), method, seed))
+    return {field: outputs[field][t] for field in fields}
 
-def save_metrics(name, metrics, dst = tev_dst):
-    np.savez_compressed(dst/f"{name}.npz", metrics)
+def expected_metrics(district_data, dst = tev_dst):
+    """ files written by process for a district """
+    (state, district), state_code, *_ = district_data
+    phis = [int(_ * 365 * 100) for _ in phi_points]
+    cf_tag = f"{state_code}_{district}_phi{phis[0]}_novax"
+    p1_tags = [f"{state_code}_{district}_phi{phi}_{vax_policy}" for (phi, vax_policy) in product(phis, ["random", "contact", "mortality"])]
+    cf_metrics = ["deaths_", "YLL_", "per_capita_TEV_", "per_capita_VSLY_", "total_TEV_", "total_VSLY_"]
+    return [dst/f"{metric}{tag}.npz" for tag in [cf_tag] + p1_tags for metric in cf_metrics] +\
+        [dst/f"VSL_{tag}.npz" for tag in p1_tags]
 
-def process(district_data, level = "national"):
-    """ run and save policy evaluation metrics """
+def process(district_data, level = "national", mortality = None, dst = dst):
+    """ run and save policy evaluation metrics; mortality (an IFR vector by age bin) reweights simulated deaths post hoc """
     (state, district), state_code, N_district, N_0, N_1, N_2, N_3, N_4, N_5, N_6, T_ratio = district_data
     N_jk = np.array([N_0, N_1, N_2, N_3, N_4, N_5, N_6])
     if level == "district":
@@ -151,77 +267,322 @@ def process(district_data, level = "national"):
         age_weight = N_jk/N_j_state.loc[state].values
     else:
         age_weight = N_jk/N_j_natl
-    rc_hat_p1v1 = rc_hat(state, district, np.zeros((simulation_range + 1, 1)), np.zeros((simulation_range + 1, 1)))
-    c_p1v1 = np.transpose(
-        (1 + rc_hat_p1v1)[:, None] * consumption_2019.loc[state, district].values[:, None],
-            [0, 2, 1]
-    )
+    written = []
+    save = lambda name, metrics: written.append(save_metrics(name, metrics, dst = dst, register = False))
+    def load(phi, vax_policy, fields, t = slice(None)):
+        if mortality is None:
+            return load_epi_outputs(state_code, district, phi, vax_policy, fields = fields, t = t, src = src)
+        return reweighted_outputs(state, district, phi, vax_policy, mortality, fields = fields, t = t, src = src)
+
+    consumption = partial(consumption_model(state), districts = [district])
+    c_p1v1 = consumption(np.zeros((1, simulation_range + 1, 1)), np.zeros((1, simulation_range + 1, 1)))[0]
 
     state_years_life_remaining = years_life_remaining.get(state, default = years_life_remaining.mean(axis = 0))
     phi_p0 = int(phi_points[0] * 365 * 100)
     cf_tag = f"{state_code}_{district}_phi{phi_p0}_novax"
-    with np.load(src/(cf_tag + ".npz")) as counterfactual:
-        dI_pc_p0 = counterfactual['dT']/(N_district * T_ratio)
-        dD_pc_p0 = counterfactual['dD']/N_district
-        q_p0v0   = counterfactual["q0"]
-        D_p0     = counterfactual["Dj"]
-
-    rc_hat_p0v0 = rc_hat(state, district, dI_pc_p0, dD_pc_p0)
-    c_p0v0 = np.transpose(
-        (1 + rc_hat_p0v0) * consumption_2019.loc[state, district].values[:, None, None],
-        [1, 2, 0]
-    )
+    counterfactual = load(phi_p0, "novax", fields = ("dT", "dD", "q0"))
+    dI_pc_p0 = counterfactual['dT']/(N_district * T_ratio)
+    dD_pc_p0 = counterfactual['dD']/N_district
+    q_p0v0   = counterfactual["q0"]
+    D_p0     = load(phi_p0, "novax", fields = ("Dj",), t = [0, -1])["Dj"]
+
+    c_p0v0 = consumption(dI_pc_p0[None], dD_pc_p0[None])[0]
     
     TEV_p0, VSLY_p0 = counterfactual_metrics(q_p0v0, c_p0v0)
-    save_metrics("deaths_" + cf_tag, (D_p0[-1] - D_p0[0]).sum(axis = 1))
-    save_metrics("YLL_"    + cf_tag, (D_p0[-1] - D_p0[0]) @ state_years_life_remaining)
-    save_metrics("per_capita_TEV_"  + cf_tag,  TEV_p0)
-    save_metrics("per_capita_VSLY_" + cf_tag, VSLY_p0)
-    save_metrics("total_TEV_"  + cf_tag, N_jk *  TEV_p0)
-    save_metrics("total_VSLY_" + cf_tag, N_jk * VSLY_p0)
+    deaths_p0 = (D_p0[-1] - D_p0[0]).sum(axis = 1)
+    cis = []
+    save("deaths_" + cf_tag, deaths_p0)
+    save("YLL_"    + cf_tag, (D_p0[-1] - D_p0[0]) @ state_years_life_remaining)
+    save("per_capita_TEV_"  + cf_tag,  TEV_p0)
+    save("per_capita_VSLY_" + cf_tag, VSLY_p0)
+    save("total_TEV_"  + cf_tag, N_jk *  TEV_p0)
+    save("total_VSLY_" + cf_tag, N_jk * VSLY_p0)
     
     for (phi, vax_policy) in product(
         [int(_*365*100) for _ in phi_points], 
         ["random", "contact", "mortality"]
     ):
         p1_tag = f"{state_code}_{district}_phi{phi}_{vax_policy}"
-        with np.load(src/(p1_tag + ".npz")) as policy:
-            dI_pc_p1 = policy['dT']/(N_district * T_ratio)
-            dD_pc_p1 = policy['dD']/N_district
-            pi       = policy['pi'] 
-            q_p1v0   = policy['q0']
-            D_p1     = policy["Dj"]
-        rc_hat_p1v0 = rc_hat(state, district, dI_pc_p1, dD_pc_p1)
-        c_p1v0 = np.transpose(
-            (1 + rc_hat_p1v0) * consumption_2019.loc[state, district].values[:, None, None], 
-            [1, 2, 0]
-        )
+        policy   = load(phi, vax_policy, fields = ("dT", "dD", "pi", "q0"))
+        dI_pc_p1 = policy['dT']/(N_district * T_ratio)
+        dD_pc_p1 = policy['dD']/N_district
+        pi       = policy['pi'] 
+        q_p1v0   = policy['q0']
+        D_p1     = load(phi, vax_policy, fields = ("Dj",), t = [0, -1])["Dj"]
+        c_p1v0 = consumption(dI_pc_p1[None], dD_pc_p1[None])[0]
 
         LS = ((D_p0[-1] - D_p0[0])) - (D_p1[-1] - D_p1[0])
         VSL = policy_VSL(LS, age_weight, c_p0v0)
         TEV_p1, dTEV_health, dTEV_cons, dTEV_priv = policy_TEV(pi, q_p1v0, q_p0v0, c_p1v1, c_p1v0, c_p0v0)
         VSLY_p1 = policy_VSLY(pi, np.array(1), q_p1v0,  c_p0v0)
 
-        save_metrics("deaths_"            + p1_tag, (D_p1[-1] - D_p1[0]).sum(axis = 1))
-        save_metrics("YLL_"               + p1_tag, (D_p1[-1] - D_p1[0]) @ state_years_life_remaining)
-        save_metrics("per_capita_TEV_"    + p1_tag, TEV_p1)
-        save_metrics("per_capita_VSLY_"   + p1_tag, VSLY_p1)
-        save_metrics("total_TEV_"         + p1_tag, TEV_p1  * N_jk)
-        save_metrics("total_VSLY_"        + p1_tag, VSLY_p1 * N_jk)
-        save_metrics("VSL_"               + p1_tag, VSL)
+        save("deaths_"            + p1_tag, (D_p1[-1] - D_p1[0]).sum(axis = 1))
+        save("YLL_"               + p1_tag, (D_p1[-1] - D_p1[0]) @ state_years_life_remaining)
+        save("per_capita_TEV_"    + p1_tag, TEV_p1)
+        save("per_capita_VSLY_"   + p1_tag, VSLY_p1)
+        save("total_TEV_"         + p1_tag, TEV_p1  * N_jk)
+        save("total_VSLY_"        + p1_tag, VSLY_p1 * N_jk)
+        save("VSL_"               + p1_tag, VSL)
+
+        # CIs of policy-vs-novax differences, paired sim by sim
+        cis.append((phi, vax_policy, "deaths_averted", len(deaths_p0), variance_reduction, 
+            *difference_ci(deaths_p0, (D_p1[-1] - D_p1[0]).sum(axis = 1), antithetic = variance_reduction)))
+        cis.append((phi, vax_policy, "total_TEV_gain", len(deaths_p0), variance_reduction, 
+            *difference_ci((N_jk * TEV_p1[0]).sum(axis = 1), (N_jk * TEV_p0[0]).sum(axis = 1), antithetic = variance_reduction)))
 
         if phi == 50 and vax_policy == "random":
-            save_metrics("dTEV_health_" + p1_tag, age_weight * dTEV_health)
-            save_metrics("dTEV_cons_"   + p1_tag, age_weight * dTEV_cons)
-            save_metrics("dTEV_priv_"   + p1_tag, age_weight * dTEV_priv)
+            save("dTEV_health_" + p1_tag, age_weight * dTEV_health)
+            save("dTEV_cons_"   + p1_tag, age_weight * dTEV_cons)
+            save("dTEV_priv_"   + p1_tag, age_weight * dTEV_priv)
             dTEV_extn = (TEV_p1[0] - TEV_p0[0]) - dTEV_priv
-            save_metrics("dTEV_extn_"   + p1_tag, age_weight * dTEV_extn)
+            save("dTEV_extn_"   + p1_tag, age_weight * dTEV_extn)
+
+    output_catalog(dst).add(written)
+    save_ci(f"{state_code}_{district}", cis, dst = dst)
+
+# metrics of the fused evaluation and the intermediates they need; leaves are supplied by evaluate_district
+evaluation = Registry()
+district_metrics = ["deaths", "YLL", "TEV", "VSLY", "VSL", "dTEV_health", "dTEV_cons", "dTEV_priv", "dTEV_extn"]
+metric_cis = {"deaths": "deaths_averted_ci", "TEV": "total_TEV_gain_ci"}
+arms_order = list(product([int(_*365*100) for _ in phi_points], ["random", "contact", "mortality"]))
+# nodes that do not depend on the policy arms; in memory-budget mode they are evaluated once for all arm groups
+counterfactual_nodes = ["counterfactual", "D_p0", "c_p1v1", "c_p0v0", "q_p0v0_mean", "c_p0v0_mean", "TEV_p0", "VSLY_p0"]
+
+def tagged(prefix, cf_tag, arm_tags, p0, p1, axis = 0):
+    """ outputs keyed by file name: counterfactual values and the arm-stacked policy values split per arm """
+    outputs = {} if p0 is None else {prefix + cf_tag: p0}
+    outputs.update({prefix + tag: values for (tag, values) in zip(arm_tags, np.split(p1, len(arm_tags), axis = axis))})
+    return outputs
+
+@evaluation.register("counterfactual", "load", "phi_p0")
+def load_counterfactual(load, phi_p0):
+    return load(phi_p0, "novax", fields = ("dT", "dD", "q0"))
+
+@evaluation.register("policy", "load", "arms")
+def load_policy(load, arms):
+    """ policy arms stacked along the simulation axis """
+    loads = [load(phi, vax_policy, fields = ("dT", "dD", "pi", "q0")) for (phi, vax_policy) in arms]
+    return {field: np.concatenate([_[field] for _ in loads], axis = 1) for field in ("dT", "dD", "pi", "q0")}
+
+@evaluation.register("policy_dTEV", "load", "arms")
+def load_policy_dTEV(load, arms):
+    """ the one arm the dTEV decomposition is kept for (phi = 50, random allocation), or None if it is not among arms """
+    return load(50, "random", fields = ("dT", "dD", "pi", "q0")) if (50, "random") in arms else None
+
+@evaluation.register("D_p0", "load", "phi_p0")
+def deaths_by_age_p0(load, phi_p0):
+    return np.diff(load(phi_p0, "novax", fields = ("Dj",), t = [0, -1])["Dj"], axis = 0)[0]
+
+@evaluation.register("D_p1", "load", "arms")
+def deaths_by_age_p1(load, arms):
+    return np.concatenate([np.diff(load(phi, vax_policy, fields = ("Dj",), t = [0, -1])["Dj"], axis = 0)[0] for (phi, vax_policy) in arms])
+
+@evaluation.register("c_p1v1", "consumption")
+def consumption_p1v1(consumption):
+    return consumption(np.zeros((simulation_range + 1, 1)), np.zeros((simulation_range + 1, 1)))
+
+@evaluation.register("c_p0v0", "counterfactual", "consumption", "N_district", "T_ratio")
+def consumption_p0v0(counterfactual, consumption, N_district, T_ratio):
+    return consumption(counterfactual["dT"]/(N_district * T_ratio), counterfactual["dD"]/N_district, out = np.empty(counterfactual["q0"].shape))
+
+@evaluation.register("c_p1v0", "policy", "consumption", "N_district", "T_ratio")
+def consumption_p1v0(policy, consumption, N_district, T_ratio):
+    return consumption(policy["dT"]/(N_district * T_ratio), policy["dD"]/N_district, out = np.empty(policy["q0"].shape))
+
+@evaluation.register("c_p1v0_dTEV", "policy_dTEV", "consumption", "N_district", "T_ratio")
+def consumption_p1v0_dTEV(policy_dTEV, consumption, N_district, T_ratio):
+    return None if policy_dTEV is None else consumption_p1v0(policy_dTEV, consumption, N_district, T_ratio)
+
+@evaluation.register("q_p0v0_mean", "counterfactual")
+def q_p0v0_mean(counterfactual):
+    return sims_mean(counterfactual["q0"])
+
+@evaluation.register("c_p0v0_mean", "c_p0v0")
+def c_p0v0_mean(c_p0v0):
+    return sims_mean(c_p0v0)
+
+@evaluation.register("TEV_p0", "counterfactual", "c_p0v0")
+def TEV_p0(counterfactual, c_p0v0):
+    q_p0v0 = counterfactual["q0"]
+    return streamed_NPV(lambda block, out: np.multiply(q_p0v0[block], c_p0v0[block], out = out), q_p0v0.shape[1:])
+
+@evaluation.register("VSLY_p0", "counterfactual", "c_p0v0_mean")
+def VSLY_p0(counterfactual, c_p0v0_mean):
+    q_p0v0 = counterfactual["q0"]
+    return streamed_NPV(lambda block, out: np.multiply(q_p0v0[block], c_p0v0_mean[block], out = out), q_p0v0.shape[1:])
+
+@evaluation.register("TEV_p1", "policy", "c_p1v0", "c_p1v1")
+def TEV_p1(policy, c_p1v0, c_p1v1):
+    """ TEV as in policy_TEV, without the dTEV decomposition """
+    return streamed_NPV(policy_TEV_daily(policy["pi"], policy["q0"], c_p1v0, c_p1v1), policy["q0"].shape[1:], temporaries = 2)
+
+@evaluation.register("VSLY_p1", "policy", "c_p0v0", "c_p0v0_mean")
+def VSLY_p1(policy, c_p0v0, c_p0v0_mean):
+    return new_VSLY(policy["pi"], policy["q0"], c_p0v0, c_p0v0_mean)
+
+@evaluation.register("deaths", "cf_tag", "arm_tags", "D_p0", "D_p1")
+def deaths_metric(cf_tag, arm_tags, D_p0, D_p1):
+    return tagged("deaths_", cf_tag, arm_tags, D_p0.sum(axis = 1), D_p1.sum(axis = 1))
+
+@evaluation.register("YLL", "cf_tag", "arm_tags", "D_p0", "D_p1", "state_years_life_remaining")
+def YLL_metric(cf_tag, arm_tags, D_p0, D_p1, state_years_life_remaining):
+    return tagged("YLL_", cf_tag, arm_tags, D_p0 @ state_years_life_remaining, D_p1 @ state_years_life_remaining)
+
+@evaluation.register("TEV", "cf_tag", "arm_tags", "TEV_p0", "TEV_p1")
+def TEV_metric(cf_tag, arm_tags, TEV_p0, TEV_p1):
+    return tagged("per_capita_TEV_", cf_tag, arm_tags, TEV_p0, TEV_p1, axis = 1)
+
+@evaluation.register("VSLY", "cf_tag", "arm_tags", "VSLY_p0", "VSLY_p1")
+def VSLY_metric(cf_tag, arm_tags, VSLY_p0, VSLY_p1):
+    return tagged("per_capita_VSLY_", cf_tag, arm_tags, VSLY_p0, VSLY_p1, axis = 1)
+
+@evaluation.register("VSL", "cf_tag", "arm_tags", "D_p0", "D_p1", "c_p0v0", "age_weight")
+def VSL_metric(cf_tag, arm_tags, D_p0, D_p1, c_p0v0, age_weight):
+    """ policy_VSL for all arms, with the counterfactual NPV taken once """
+    LS = np.tile(D_p0, (len(arm_tags), 1)) - D_p1
+    return tagged("VSL_", cf_tag, arm_tags, None, LS.sum(axis = 1) * np.tile((age_weight * NPV(c_p0v0, t0_only = True)).sum(axis = 1), len(arm_tags)))
+
+@evaluation.register("dTEV", "arms", "arm_tags", "policy_dTEV", "counterfactual", "c_p1v1", "c_p1v0_dTEV", "c_p0v0", "q_p0v0_mean", "c_p0v0_mean", "TEV_p0", "age_weight")
+def dTEV_decomposition(arms, arm_tags, policy_dTEV, counterfactual, c_p1v1, c_p1v0_dTEV, c_p0v0, q_p0v0_mean, c_p0v0_mean, TEV_p0, age_weight):
+    """ dTEV components, kept for the phi = 50, random allocation arm only; that arm is loaded on its own (policy_dTEV), 
+    so requesting only dTEV components never loads or computes consumption for the other arms """
+    if policy_dTEV is None:
+        return {}
+    tag = arm_tags[arms.index((50, "random"))]
+    TEV_arm, dTEV_health, dTEV_cons, dTEV_priv = policy_TEV(policy_dTEV["pi"], policy_dTEV["q0"], counterfactual["q0"], c_p1v1, c_p1v0_dTEV, c_p0v0, 
+        q_p0v0_mean = q_p0v0_mean, c_p0v0_mean = c_p0v0_mean)
+    return {
+        "dTEV_health_" + tag: age_weight * dTEV_health,
+        "dTEV_cons_"   + tag: age_weight * dTEV_cons,
+        "dTEV_priv_"   + tag: age_weight * dTEV_priv,
+        "dTEV_extn_"   + tag: age_weight * ((TEV_arm[0] - TEV_p0[0]) - dTEV_priv),
+    }
+
+for component in ("health", "cons", "priv", "extn"):
+    evaluation.register(f"dTEV_{component}", "dTEV")(
+        (lambda prefix: lambda dTEV: {key: value for (key, value) in dTEV.items() if key.startswith(prefix)})(f"dTEV_{component}_"))
+
+# CIs of policy-vs-novax differences, paired sim by sim
+@evaluation.register("deaths_averted_ci", "arms", "D_p0", "D_p1")
+def deaths_averted_ci(arms, D_p0, D_p1):
+    deaths_p0 = D_p0.sum(axis = 1)
+    return [(phi, vax_policy, "deaths_averted", len(deaths_p0), variance_reduction, *difference_ci(deaths_p0, deaths_p1, antithetic = variance_reduction))
+        for ((phi, vax_policy), deaths_p1) in zip(arms, np.split(D_p1.sum(axis = 1), len(arms)))]
+
+@evaluation.register("total_TEV_gain_ci", "arms", "TEV_p0", "TEV_p1", "N_jk")
+def total_TEV_gain_ci(arms, TEV_p0, TEV_p1, N_jk):
+    total_p0 = (N_jk * TEV_p0[0]).sum(axis = 1)
+    return [(phi, vax_policy, "total_TEV_gain", len(total_p0), variance_reduction, *difference_ci((N_jk * TEV_p1_arm).sum(axis = 1), total_p0, antithetic = variance_reduction))
+        for ((phi, vax_policy), TEV_p1_arm) in zip(arms, np.split(TEV_p1[0], len(arms)))]
+
+fused_compresslevel = 1 # float trajectories barely compress (~0.85 at the default level), so favour write speed; 0 stores them uncompressed, ~1.7x larger but memory-mappable for slice reads (see commons.load_metric)
+
+def expected_district_metrics(district_data, dst = tev_dst, store = None):
+    """ files (or store keys, if writing to per-metric stores) written by evaluate_district for a district """
+    (state, district), state_code, *_ = district_data
+    if store is not None:
+        cf, dTEV_arm = (int(phi_points[0] * 365 * 100), "novax"), (50, "random")
+        arms = {"deaths": [cf] + arms_order, "YLL": [cf] + arms_order, "per_capita_TEV": [cf] + arms_order, "per_capita_VSLY": [cf] + arms_order, "VSL": arms_order, 
+            **{f"dTEV_{component}": [dTEV_arm] for component in ("health", "cons", "priv", "extn")}}
+        return [(metric, state_code, district, phi, vax_policy) for (metric, metric_arms) in arms.items() for (phi, vax_policy) in metric_arms]
+    return [dst/fused_metrics_dir/metric/f"{state_code}_{district}.npz" for metric in district_metrics]
+
+def evaluate_district(district_data, level = "national", mortality = None, dst = dst, metrics = None, store = None):
+    """ fused version of process: the consumption baseline and counterfactual metrics are computed once, all 
+    (phi, policy) arms are evaluated in one tensor (arms stacked along the simulation axis), and every metric 
+    for the district is written to one .npz per metric under dst/fused_metrics_dir, keyed by the per-metric file names 
+    (read them back with commons.glob_metrics / read_metric) 
+
+    metrics (a subset of district_metrics) limits the run to those metrics and their inputs, e.g. ["deaths"] 
+    never computes consumption; only their files (and CI rows) are replaced 
+
+    with store (a store.MetricStores, e.g. under tev_dst/metric_stores_dir), outputs are written to one array store 
+    per metric, keyed by (state_code, district, phi, policy), instead of .npz files; either way, outputs are registered 
+    in the output catalog under dst (commons.output_catalog) as they are written """
+    (state, district), state_code, N_district, N_0, N_1, N_2, N_3, N_4, N_5, N_6, T_ratio = district_data
+    N_jk = np.array([N_0, N_1, N_2, N_3, N_4, N_5, N_6])
+    if level == "district":
+        age_weight = N_jk/(N_jk.sum())
+    elif level == "state":
+        age_weight = N_jk/N_j_state.loc[state].values
+    else:
+        age_weight = N_jk/N_j_natl
+    def load(phi, vax_policy, fields, t = slice(None)):
+        if mortality is None:
+            return load_epi_outputs(state_code, district, phi, vax_policy, fields = fields, t = t, src = src)
+        return reweighted_outputs(state, district, phi, vax_policy, mortality, fields = fields, t = t, src = src)
+    model = consumption_model(state)
+    def consumption(dI_pc, dD_pc, out = None):
+        """ (t, sims, age) consumption given per capita infections and deaths of shape (t, sims) """
+        return model(dI_pc[None], dD_pc[None], districts = [district], out = None if out is None else out[None])[0]
+
+    requested = district_metrics if metrics is None else list(metrics)
+    cis = [metric_cis[_] for _ in requested if _ in metric_cis]
+    phi_p0 = int(phi_points[0] * 365 * 100)
+    leaves = dict(load = load, consumption = consumption, phi_p0 = phi_p0, N_district = N_district, T_ratio = T_ratio, N_jk = N_jk, 
+        age_weight = age_weight, state_years_life_remaining = years_life_remaining.get(state, default = years_life_remaining.mean(axis = 0)),
+        cf_tag = f"{state_code}_{district}_phi{phi_p0}_novax")
+    if memory_budget is None:
+        groups = [arms_order]
+    else: 
+        # counterfactual inputs once, then policy arms in groups that keep ~6 stacked (t x sims x age) arrays per arm within budget
+        needed = set(evaluation.order(requested + cis, list(leaves) + ["arms", "arm_tags"])) | {"D_p0"}
+        leaves.update(evaluation.evaluate([_ for _ in counterfactual_nodes if _ in needed], **leaves))
+        size   = int(np.clip(memory_budget * 2**20 // (6 * 8 * (simulation_range + 1) * leaves["D_p0"].size), 1, len(arms_order)))
+        groups = [arms_order[i:i + size] for i in range(0, len(arms_order), size)]
+
+    outputs, ci_rows = {metric: {} for metric in requested}, []
+    for arms in groups:
+        values = evaluation.evaluate(requested + cis, arms = arms, arm_tags = [f"{state_code}_{district}_phi{phi}_{vax_policy}" for (phi, vax_policy) in arms], **leaves)
+        for metric in requested:
+            outputs[metric].update(values[metric])
+        for ci in cis:
+            ci_rows += values[ci]
+        del values
+
+    keys = {f"{state_code}_{district}_phi{phi}_{vax_policy}": (phi, vax_policy) for (phi, vax_policy) in [(phi_p0, "novax")] + arms_order}
+    written = []
+    for metric in requested:
+        # total_* metrics are N_jk * per_capita_*, derived on read (see commons.load_metric)
+        if store is None:
+            path = mkdir(mkdir(dst/fused_metrics_dir)/metric)/f"{state_code}_{district}.npz"
+            savez(path, output_precision, compresslevel = fused_compresslevel, **outputs[metric], **({"N_jk": N_jk} if metric in ("TEV", "VSLY") else {}))
+            written += [(key + ".npz", path, key) for key in fused_keys(path, path.stat().st_mtime)]
+            continue
+        field  = "per_capita_" + metric if metric in ("TEV", "VSLY") else metric
+        arrays = {(*keys[name[len(field) + 1:]], field): array for (name, array) in outputs[metric].items()}
+        if metric in ("TEV", "VSLY"):
+            arrays[("*", "*", "N_jk")] = N_jk
+        store[field].write_many(state_code, district, arrays, {key: encoding_for(key[2], output_precision) for key in arrays})
+        written += list(stored_keys(store, metric = field, state = state_code, district = district))
+    output_catalog(dst).add(written)
+
+    if metrics is not None and (dst/f"{state_code}_{district}_ci.csv").exists():
+        recomputed = {row[2] for row in ci_rows}
+        ci_rows += [tuple(_) for _ in pd.read_csv(dst/f"{state_code}_{district}_ci.csv").itertuples(index = False) if _.metric not in recomputed]
+    save_ci(f"{state_code}_{district}", ci_rows, dst = dst)
 
 if __name__ == "__main__":
     population_columns = ["state_code", "N_tot", 'N_0', 'N_1', 'N_2', 'N_3', 'N_4', 'N_5', 'N_6', 'T_ratio']
     distribute = False
+    run_locally = True
+    alternative_ifr = None # e.g. TN_IFRs: evaluate under another IFR by reweighting simulated deaths, written to its own directory
+    fused = True # one batched evaluation and one output file per district (see evaluate_district)
+    store = None # e.g. MetricStores(tev_dst/metric_stores_dir): with fused, write one array store per metric instead of .npz files
     rerun = ['Andaman And Nicobar Islands', 'Dadra And Nagar Haveli And Daman And Diu', 'Delhi', 'Manipur', 'Mizoram']
-    if distribute:
+    if run_locally:
+        (evaluate, expected) = (evaluate_district, expected_district_metrics) if fused else (process, expected_metrics)
+        if alternative_ifr is None:
+            if fused and store is not None:
+                run_local(evaluate, districts_to_run, partial(expected, store = store), ledger = tev_dst/"failures_policy_evaluation.csv", columns = population_columns, 
+                    usage = tev_dst/"usage_policy_evaluation.csv", valid = store.exists, store = store)
+            else:
+                run_local(evaluate, districts_to_run, expected, ledger = tev_dst/"failures_policy_evaluation.csv", columns = population_columns, usage = tev_dst/"usage_policy_evaluation.csv")
+        else:
+            ifr_dst = mkdir(tev_dst/"reweighted_ifr")
+            run_local(evaluate, districts_to_run, partial(expected, dst = ifr_dst), ledger = ifr_dst/"failures_policy_evaluation.csv", columns = population_columns, 
+                usage = ifr_dst/"usage_policy_evaluation.csv", mortality = np.array(list(alternative_ifr.values())), dst = ifr_dst)
+    elif distribute:
         with dask.config.set({"scheduler.allowed-failures": 5}):
             client = dask.distributed.Client()#(n_workers = 1, processes = False)
             print(client.dashboard_link)
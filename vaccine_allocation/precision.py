@@ -0,0 +1,167 @@
+import json
+import struct
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+""" storage precision policies for persisted trajectories and metrics
+
+an encoding is a small dict describing how a float64 array was stored:
+    dtype:     storage dtype
+    scale:     stored = rint(value * scale) for integer dtypes
+    transform: "complement" stores 1 - value, which keeps relative precision for survival
+               probabilities (q0, q1) that sit within 1e-5 of 1
+encodings are persisted next to the data, and loaders upcast back to float64
+"""
+
+counts        = {"dtype": "uint32",  "scale": 1}
+probabilities = {"dtype": "float32"}
+survival      = {"dtype": "float32", "transform": "complement"}
+values        = {"dtype": "float32"}
+
+# precision policies: field or metric name -> encoding (None or missing -> stored as is)
+policies = {
+    "full": {},
+    "compact": {
+        # epi_simulations trajectories
+        "dT": counts, "dD": counts, "Dj": counts, "Oj": counts, "Oj_vn": counts,
+        "pi": probabilities, "q0": survival, "q1": survival,
+        # policy_evaluation metrics
+        "deaths": counts, "YLL": values, "VSL": values,
+        "per_capita_TEV": values, "per_capita_VSLY": values, "total_TEV": values, "total_VSLY": values,
+        "dTEV_health": values, "dTEV_cons": values, "dTEV_priv": values, "dTEV_extn": values
+    }
+}
+
+def encode(array, encoding: Optional[dict]):
+    """ convert a float64 array to its storage representation """
+    if not encoding:
+        return np.asarray(array)
+    array = np.asarray(array, dtype = float)
+    if encoding.get("transform") == "complement":
+        array = 1 - array
+    dtype = np.dtype(encoding["dtype"])
+    if dtype.kind in "ui":
+        info = np.iinfo(dtype)
+        return np.rint(array * encoding.get("scale", 1)).clip(info.min, info.max).astype(dtype)
+    return array.astype(dtype)
+
+def decode(array, encoding: Optional[dict]):
+    """ upcast a stored array back to float64 """
+    if not encoding:
+        return array
+    array = np.asarray(array, dtype = float)
+    if np.dtype(encoding["dtype"]).kind in "ui":
+        array = array / encoding.get("scale", 1)
+    if encoding.get("transform") == "complement":
+        array = 1 - array
+    return array
+
+def encoding_for(name: str, policy: str) -> Optional[dict]:
+    """ encoding for a field ("q0") or metric file name ("total_TEV_TN_Chennai_phi50_random") under a precision policy """
+    encodings = policies[policy]
+    if name in encodings:
+        return encodings[name]
+    # metric file names are "{metric}_{state_code}_{district}_phi{phi}_{policy}"; match the longest metric prefix
+    prefixes = [metric for metric in encodings if name.startswith(metric + "_")]
+    return encodings[max(prefixes, key = len)] if prefixes else None
+
+def savez(path: Path, policy: str = "compact", name: Optional[str] = None, compresslevel: Optional[int] = None, **arrays):
+    """ np.savez_compressed with per-array encodings; name selects the encoding for positional-style (arr_0) metric files
+
+    compresslevel (0-9, 0 = stored) trades size for write time; the default is np.savez_compressed's
+    """
+    out = {}
+    for (key, array) in arrays.items():
+        encoding = encoding_for(name if name is not None else key, policy)
+        out[key] = encode(array, encoding)
+        if encoding:
+            out[key + "__encoding"] = np.array(json.dumps(encoding))
+    if compresslevel is None:
+        np.savez_compressed(path, **out)
+        return
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED if compresslevel else zipfile.ZIP_STORED, compresslevel = compresslevel or None, allowZip64 = True) as archive:
+        for (key, array) in out.items():
+            with archive.open(key + ".npy", "w", force_zip64 = True) as f:
+                np.lib.format.write_array(f, np.asanyarray(array))
+
+def npz_memmap(path: Path, member: str, info: Optional[zipfile.ZipInfo] = None) -> Optional[np.memmap]:
+    """ memory-map an .npz member written without compression (savez with compresslevel = 0); None if it is compressed 
+    
+    info is the member's ZipInfo, if the archive is already open """
+    if info is None:
+        with zipfile.ZipFile(path) as archive:
+            info = archive.getinfo(member + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, "rb") as f:
+        f.seek(info.header_offset + 26)
+        (name_length, extra_length) = struct.unpack("<HH", f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        (shape, fortran_order, dtype) = (np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0)(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        return None
+    return np.memmap(path, dtype = dtype, mode = "r", shape = shape, order = "F" if fortran_order else "C", offset = offset)
+
+def npz_rows(archive: zipfile.ZipFile, member: str, index) -> Optional[np.array]:
+    """ member[index] of an open .npz archive for an index along the leading axis (an int, slice or integer array), 
+    decompressing only up to the last row selected and never materializing the rest; None if index does not select
+    along the leading axis """
+    with archive.open(member + ".npy") as f:
+        version = np.lib.format.read_magic(f)
+        (shape, fortran_order, dtype) = (np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0)(f)
+        if fortran_order or dtype.hasobject or len(shape) == 0:
+            return None
+        try:
+            rows = np.arange(shape[0])[index]
+        except (IndexError, TypeError):
+            return None
+        if rows.ndim > 1:
+            return None
+        (start, stop) = (int(rows.min()), int(rows.max()) + 1) if rows.size else (0, 0)
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+        f.seek(f.tell() + start * row_bytes)
+        block = bytearray((stop - start) * row_bytes)
+        f.readinto(block)
+    return np.frombuffer(block, dtype = dtype).reshape((stop - start,) + tuple(shape[1:]))[rows - start]
+
+class DecodingNpz():
+    """ wrapper around np.load that transparently upcasts arrays written by savez """
+    def __init__(self, path: Path):
+        self.path  = path
+        self.npz   = np.load(path)
+        self.files = [_ for _ in self.npz.files if not _.endswith("__encoding")]
+
+    def __getitem__(self, key: str):
+        return self.read(key)
+
+    def read(self, key: str, index = slice(None)):
+        """ array[index]; members stored uncompressed are memory-mapped, so only the selection is read from disk, and
+        compressed members are only decompressed up to the last leading-axis row selected """
+        info   = self.npz.zip.getinfo(key + ".npy")
+        mapped = npz_memmap(self.path, key, info) if info.compress_type == zipfile.ZIP_STORED else None
+        if mapped is not None:
+            array = np.array(mapped[index])
+        else:
+            rows  = None if isinstance(index, slice) and index == slice(None) else npz_rows(self.npz.zip, key, index)
+            array = self.npz[key][index] if rows is None else rows
+        if key + "__encoding" in self.npz.files:
+            return decode(array, json.loads(str(self.npz[key + "__encoding"])))
+        return array
+
+    def close(self):
+        self.npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def load_npz(path: Path) -> DecodingNpz:
+    """ drop-in for np.load on .npz outputs, whether or not they were written with a compact precision policy """
+    return DecodingNpz(path)
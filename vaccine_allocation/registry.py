@@ -0,0 +1,52 @@
+""" dependency-aware lazy evaluation: each named node declares its inputs and is computed at most once per run """
+
+class Registry():
+    """ named computations and their inputs
+
+    evaluate() resolves only the requested nodes and what they depend on; intermediate values are
+    cached for the run and released as soon as every node that consumes them has been computed
+    """
+    def __init__(self):
+        self.nodes = {}
+
+    def register(self, name, *inputs):
+        """ decorator: the function is called with the values of inputs (nodes or leaves passed to evaluate) """
+        def decorator(fn):
+            self.nodes[name] = (fn, inputs)
+            return fn
+        return decorator
+
+    def order(self, names, leaves = ()):
+        """ names and their dependencies, each after everything it consumes """
+        order, seen = [], set(leaves)
+        def visit(name, path):
+            if name in seen:
+                return
+            if name in path:
+                raise ValueError(f"dependency cycle: {' -> '.join(path + (name,))}")
+            if name not in self.nodes:
+                raise KeyError(f"unknown node or missing input {name}")
+            for dependency in self.nodes[name][1]:
+                visit(dependency, path + (name,))
+            seen.add(name)
+            order.append(name)
+        for name in names:
+            visit(name, ())
+        return order
+
+    def evaluate(self, names, **leaves):
+        """ values of the requested nodes, given leaf inputs by name """
+        order = self.order(names, leaves)
+        consumers = {}
+        for name in order:
+            for dependency in self.nodes[name][1]:
+                consumers[dependency] = consumers.get(dependency, 0) + 1
+        values = dict(leaves)
+        for name in order:
+            (fn, inputs) = self.nodes[name]
+            values[name] = fn(*[values[_] for _ in inputs])
+            for dependency in inputs:
+                consumers[dependency] -= 1
+                if consumers[dependency] == 0 and dependency not in names and dependency not in leaves:
+                    del values[dependency]
+        return {name: values[name] for name in names}
@@ -0,0 +1,54 @@
+import numpy as np
+
+""" post-hoc reweighting of simulated deaths to an alternative infection fatality rate (IFR) vector
+
+in BatchedAge_SIRVD, each day's deaths and recoveries out of I (and I_vn) are independent Poisson
+draws with means m * gamma * I and (1 - m) * gamma * I, so the total outflow O = dD + dR is
+Poisson(gamma * I) regardless of m, and conditional on O, dD ~ Binomial(O, m). given the persisted
+per-age outflows (Oj, Oj_vn), deaths under another IFR vector m' are therefore:
+
+    binomial: dD' ~ Binomial(O, m'), exact in distribution conditional on the simulated infections
+    expected: dD' = m' * O, the conditional mean (no added noise; use for point estimates)
+
+the one approximation is feedback on the dynamics: infections depend on m only through the living
+population N = S + I + R, which loses the extra deaths from R. N enters the vaccine split and the
+Rt denominator, so the relative error in infections is first order in |D' - D|/N. reweight()
+reports that quantity as rel_N_shift (its maximum over time, per sim); it is typically ~1e-4 for
+plausible IFRs, well inside Monte Carlo error, but large IFR changes in small districts should be re-simulated
+"""
+
+def reweight(outputs: dict, mortality: np.array, N0: np.array, method: str = "binomial", seed: int = 0) -> dict:
+    """ recompute dD, Dj, q0, q1 for IFR vector mortality (by age bin) from trajectories with fields dD, pi, q1, Dj, Oj, Oj_vn
+
+    N0 is the initial living population by age bin (epi_simulations.initial_population)
+    """
+    mortality = np.asarray(mortality, dtype = float)
+    O, O_vn = outputs["Oj"], outputs["Oj_vn"]
+    if method == "binomial":
+        rng = np.random.default_rng(seed)
+        dD, dD_vn = rng.binomial(np.rint(O).astype(np.int64), mortality), rng.binomial(np.rint(O_vn).astype(np.int64), mortality)
+    elif method == "expected":
+        dD, dD_vn = O * mortality, O_vn * mortality
+    else:
+        raise ValueError(f"unknown reweighting method {method}; use 'binomial' or 'expected'")
+
+    Dj   = outputs["Dj"][0] + np.cumsum(dD, axis = 0)
+    D_vn = np.cumsum(dD_vn, axis = 0)
+
+    # vaccinated population is unaffected by the mortality split (D_vn + R_vn is fixed by the outflows)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        N_v  = outputs["pi"] * N0
+        N_nv = N0 - N_v
+        q0 = np.nan_to_num(1 - (Dj - Dj[0])/N_nv, nan = 0, neginf = 1).clip(0, 1)
+        q1 = np.nan_to_num(1 - D_vn/N_v,          nan = 0, neginf = 1).clip(0, 1)
+    q0[0], q1[0] = 0, 0 # initial entries are placeholders, as in the model
+
+    dD_total = (dD + dD_vn).sum(axis = -1)
+    dD_total[0] = outputs["dD"][0]
+
+    # first-order feedback: change in cumulative deaths (unvaccinated + vaccinated) relative to the living population
+    D_vn_original = (1 - outputs["q1"]) * N_v
+    D_vn_original[0] = 0
+    shift = (Dj - outputs["Dj"]).sum(axis = -1) + (D_vn - D_vn_original).sum(axis = -1)
+    rel_N_shift = np.abs(shift).max(axis = 0)/np.sum(N0)
+    return {"dD": dD_total, "Dj": Dj, "q0": q0, "q1": q1, "D_vn": D_vn, "rel_N_shift": rel_N_shift}
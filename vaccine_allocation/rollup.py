@@ -0,0 +1,142 @@
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from studies.vaccine_allocation.aggregation import pairwise_sum
+from studies.vaccine_allocation.catalog import describe, parse_name
+from studies.vaccine_allocation.commons import *
+from studies.vaccine_allocation.precision import encoding_for
+from studies.vaccine_allocation.store import ArrayStore
+from studies.vaccine_allocation.summaries import resample_sims
+
+""" materialized rollup cube of policy evaluation outputs
+
+district outputs are resampled to num_sims and summed sim by sim once, into one ArrayStore keyed by
+(state_code, district, phi, policy, field): district rows, state rows (district = "*") and the national row
+(state_code = district = "*"). per capita metrics are rolled up as totals next to population by age (N_jk, under
+phi = policy = "*"), so population-weighted per capita values by age at any level are total/N_jk; dynamic metrics
+keep the time steps in rollup_t. no-vaccination deaths by age from the epi simulations are rolled up to states and
+the nation over the whole horizon. figure scripts read sums and percentiles from the cube (build it with python
+rollup.py after policy evaluation) instead of re-reading every district output
+"""
+
+static_metrics    = ["deaths", "YLL", "VSL"]                                 # (sims,)
+dynamic_metrics   = ["total_TEV", "total_VSLY"]                              # (t, sims, age)
+component_metrics = ["dTEV_health", "dTEV_cons", "dTEV_priv", "dTEV_extn"]   # age-weighted (sims, age), NaNs summed as zero
+rollup_t = [0] # time steps of dynamic metrics kept in the cube; slice(None) keeps the whole horizon (~56MB per row and arm at full precision)
+national_exclusions = ["SK", "NL"] # states left out of national dynamic metric (and population) sums
+novax_deaths_field = "dDj" # daily no-vaccination deaths by age, (t, sims, age), stored under phi = "*", policy = "novax"
+
+epi_name = re.compile(r"^([^_]+)_(.+)_phi(\d+)_novax\.npz$")
+
+def rollup(cube: ArrayStore, outputs: Dict[tuple, tuple], load: Callable, phi, policy, field: str, exclude = (), districts: bool = True,
+    encoding: Optional[dict] = None, workers: Optional[int] = None):
+    """ write state and national (and district) rows of load(*output) summed over outputs, a (state_code, district) -> output mapping """
+    by_state = {}
+    for ((state_code, district), output) in outputs.items():
+        by_state.setdefault(state_code, {})[district] = output
+    state_totals = {}
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        for (state_code, state_outputs) in by_state.items():
+            values = list(pool.map(lambda output: load(*output), state_outputs.values()))
+            if districts:
+                for (district, value) in zip(state_outputs, values):
+                    cube.write((state_code, district, phi, policy, field), value, encoding)
+            state_totals[state_code] = pairwise_sum(values)
+            cube.write((state_code, "*", phi, policy, field), state_totals[state_code], encoding)
+    cube.write(("*", "*", phi, policy, field), pairwise_sum([v for (s, v) in state_totals.items() if s not in exclude]), encoding)
+
+def metric_outputs(src, field: str) -> Dict[tuple, dict]:
+    """ (phi, policy) -> {(state_code, district): (path, key)} for the outputs of a metric, located as glob_metrics yields them """
+    arms = {}
+    for (name, path, key) in glob_metrics(src, f"{field}_*.npz"):
+        parsed = parse_name(name)
+        if parsed is not None and parsed[0] == field:
+            (_, state_code, district, phi, policy) = parsed
+            arms.setdefault((phi, policy), {})[state_code, district] = (path, key)
+    return arms
+
+def novax_deaths_outputs(src = epi_dst, store = epi_store) -> Dict[tuple, tuple]:
+    """ (state_code, district) -> (state_code, district, phi) for the no-vaccination epi outputs, from the chunked store if populated, else per-tag .npz files """
+    keys = list(store.keys(policy = "novax", field = "Dj")) if store is not None else []
+    if keys:
+        return {(state_code, district): (state_code, district, phi) for (state_code, district, phi, *_) in keys}
+    matches = (epi_name.match(path.name) for path in src.glob("*_novax.npz"))
+    return {(state_code, district): (state_code, district, int(phi)) for (state_code, district, phi) in (_.groups() for _ in matches if _)}
+
+def build_rollup(districts, src = tev_dst, metrics = static_metrics + dynamic_metrics + component_metrics, t = rollup_t, novax_deaths = True,
+    sims = num_sims, precision = output_precision, workers = None):
+    """ (re)build the rollup cube under src from policy evaluation outputs; districts is a frame indexed by (state, district) with
+    state_code and population by age (N_0 ... N_6) columns, e.g. epi_simulations.districts_to_run """
+    root = src/rollup_dir
+    if root.exists():
+        shutil.rmtree(root)
+    cube = ArrayStore(root)
+
+    population = dict(zip(zip(districts.state_code, districts.index.get_level_values(1)), districts.filter(regex = "N_[0-6]", axis = 1).values))
+    rollup(cube, {_: (_,) for _ in population}, lambda key: population[key], "*", "*", "N_jk", exclude = national_exclusions, workers = workers)
+
+    for field in tqdm(metrics):
+        for ((phi, policy), outputs) in metric_outputs(src, field).items():
+            if field in dynamic_metrics:
+                if not cube.exists(("*", "*", "*", "*", "t")):
+                    (path, key) = next(iter(outputs.values()))
+                    cube.write(("*", "*", "*", "*", "t"), np.arange(describe(path, key)[0][0])[t])
+                load, exclude = (lambda path, key: resample_sims(load_metric(path, key, t = t), sims, axis = 1)), national_exclusions
+            elif field in component_metrics:
+                load, exclude = (lambda path, key: resample_sims(np.where(np.isnan(v := load_metric(path, key)), 0, v), sims, axis = 0)), ()
+            else:
+                load, exclude = (lambda path, key: resample_sims(load_metric(path, key), sims, axis = 0)), ()
+            rollup(cube, outputs, load, phi, policy, field, exclude = exclude, encoding = encoding_for(field, precision), workers = workers)
+
+    if novax_deaths:
+        load = lambda state_code, district, phi: resample_sims(np.diff(load_epi_outputs(state_code, district, phi, "novax", fields = ("Dj",))["Dj"], axis = 0), sims, axis = 1)
+        rollup(cube, novax_deaths_outputs(), load, "*", "novax", novax_deaths_field, districts = False, encoding = encoding_for("Dj", precision), workers = workers)
+    return Rollup(root)
+
+class Rollup():
+    """ reader for the rollup cube at root; rows are (state_code, district) for districts, (state_code, "*") for states and ("*", "*") for the nation """
+    def __init__(self, root):
+        self.store = ArrayStore(root)
+
+    def exists(self) -> bool:
+        return self.store.exists(("*", "*", "*", "*", "N_jk"))
+
+    def steps(self) -> np.array:
+        """ time steps kept for dynamic metrics """
+        return self.store.read(("*", "*", "*", "*", "t"))
+
+    def population(self, state_code = "*", district = "*") -> np.array:
+        return self.store.read((state_code, district, "*", "*", "N_jk"))
+
+    def read(self, metric, phi, policy, state_code = "*", district = "*", t = None) -> np.array:
+        """ summed metric for a row; t selects a kept time step of a dynamic metric, and per_capita_* metrics are population-weighted by age (total_*/N_jk) """
+        if metric.startswith("per_capita_"):
+            return self.read("total_" + metric[len("per_capita_"):], phi, policy, state_code, district, t)/self.population(state_code, district)
+        if t is None:
+            index = slice(None)
+        else:
+            index = int(np.flatnonzero(self.steps() == t)[0]) if metric in dynamic_metrics else t # dDj keeps every step
+        return self.store.read((state_code, district, phi, policy, metric), t = index)
+
+    def percentiles(self, metric, phi, policy, state_code = "*", district = "*", t = None, by_age = False, q = [50, 5, 95]) -> np.array:
+        """ percentiles over simulations of a row, summed over age bins unless by_age """
+        values = self.read(metric, phi, policy, state_code, district, t)
+        timed  = metric.replace("per_capita_", "total_") in dynamic_metrics or metric == novax_deaths_field
+        axis   = 1 if timed and t is None else 0
+        if not by_age and values.ndim > axis + 1:
+            values = values.sum(axis = -1)
+        return np.percentile(values, q, axis = axis)
+
+def rollup_cube(src = tev_dst) -> Rollup:
+    """ the rollup cube for src; raises if it has not been built """
+    cube = Rollup(src/rollup_dir)
+    if not cube.exists():
+        raise FileNotFoundError(f"no rollup cube under {src}; build it with python rollup.py")
+    return cube
+
+if __name__ == "__main__":
+    from studies.vaccine_allocation.epi_simulations import districts_to_run
+    build_rollup(districts_to_run, src = tev_dst)
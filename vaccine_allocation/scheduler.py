@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import pandas as pd
+from tqdm import tqdm
+
+""" resumable local scheduler for per-district simulation and evaluation runs """
+
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+def limit_blas_threads(n: int = 1):
+    """ pin BLAS/OpenMP pools to n threads; env vars cover freshly spawned interpreters, threadpoolctl (if installed) covers loaded libraries """
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = str(n)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n)
+    except ImportError:
+        pass
+
+def is_valid_npz(path: Path) -> bool:
+    """ check that an output archive exists and that every member passes its CRC check """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return archive.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+def reset_peak_rss():
+    """ reset this process's peak resident set size (Linux only; elsewhere the peak covers the worker's lifetime so far) """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def peak_rss() -> float:
+    """ peak resident set size of this process in MB """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(2**20 if sys.platform == "darwin" else 1024)
+
+def run_chunk(process: Callable, chunk: Sequence[tuple], kwargs: dict):
+    """ run a chunk of districts in a worker, collecting (index, error, traceback) for any that fail and (index, seconds, peak RSS in MB) for each """
+    failures, usage = [], []
+    for district_data in chunk:
+        reset_peak_rss()
+        start = time.time()
+        try:
+            process(district_data, **kwargs)
+        except Exception as e:
+            failures.append((district_data[0], repr(e), traceback.format_exc()))
+        usage.append((district_data[0], time.time() - start, peak_rss()))
+    return failures, usage
+
+def run_local(
+    process:     Callable,                  # per-district function, called as process(district_data, **kwargs)
+    tasks:       pd.DataFrame,              # one row per district, indexed by (state, district)
+    outputs:     Callable,                  # district_data -> list of outputs (paths, store keys) written by process
+    ledger:      Path,                      # where to write failures at the end of the run
+    valid:       Callable = is_valid_npz,   # output -> whether it was completely written
+    columns:     Optional[Sequence[str]] = None, # columns of tasks passed to process
+    num_workers: Optional[int] = None,      # defaults to all cores
+    chunksize:   int = 4,                   # districts per submitted chunk
+    population:  str = "N_tot",             # column used to order districts, largest first
+    usage:       Optional[Path] = None,     # where to write per-district wall time and peak RSS, if given
+    **kwargs
+) -> pd.DataFrame:
+    """ run process over all districts on a local process pool, skipping districts with complete outputs """
+    ordered = tasks.sort_values(population, ascending = False)
+    rows = [tuple(_) for _ in (ordered if columns is None else ordered[columns]).itertuples()]
+    pending = [row for row in rows if not all(valid(_) for _ in outputs(row))]
+    print(f"{len(rows) - len(pending)} of {len(rows)} districts already complete; running {len(pending)}")
+
+    limit_blas_threads(1)
+    chunks = [pending[i:i + chunksize] for i in range(0, len(pending), chunksize)]
+    failures, usages = [], []
+    with ProcessPoolExecutor(
+        max_workers = num_workers,
+        mp_context  = multiprocessing.get_context("spawn"),
+        initializer = limit_blas_threads
+    ) as pool:
+        futures = [pool.submit(run_chunk, process, chunk, kwargs) for chunk in chunks]
+        for future in tqdm(as_completed(futures), total = len(futures)):
+            try:
+                (chunk_failures, chunk_usage) = future.result()
+                failures += chunk_failures
+                usages   += chunk_usage
+            except Exception as e: # worker died (e.g. out of memory) and took the whole chunk with it
+                chunk = chunks[futures.index(future)]
+                failures += [(district_data[0], repr(e), traceback.format_exc()) for district_data in chunk]
+
+    failed = pd.DataFrame(
+        [(state, district, error, tb) for ((state, district), error, tb) in failures],
+        columns = ["state", "district", "error", "traceback"]
+    )
+    failed.to_csv(ledger, index = False)
+    print(f"{len(failed)} failures written to {ledger}")
+    if usage is not None and usages:
+        profile = pd.DataFrame(
+            [(state, district, seconds, rss) for ((state, district), seconds, rss) in usages],
+            columns = ["state", "district", "seconds", "peak_rss_mb"]
+        )
+        profile.to_csv(usage, index = False)
+        print(f"peak RSS per district: median {profile.peak_rss_mb.median():.0f} MB, max {profile.peak_rss_mb.max():.0f} MB; written to {usage}")
+    return failed
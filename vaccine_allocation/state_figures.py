@@ -4,10 +4,12 @@ import epimargin.plots as plt
 from studies.vaccine_allocation.commons import *
 from studies.vaccine_allocation.epi_simulations import *
 
-from studies.vaccine_allocation.natl_figures import aggregate_static_percentiles, outcomes_per_policy, aggregate_dynamic_percentiles
+from studies.vaccine_allocation.natl_figures import outcomes_per_policy
+from studies.vaccine_allocation.rollup import rollup_cube
 
 if __name__ == "__main__":
     src = fig_src
+    cube = rollup_cube(src)
     dst = (data/f"../figs/_apr15/state_debug/{experiment_tag}")
     dst.mkdir(exist_ok = True)
     phis = [int(_ * 365 * 100) for _ in phi_points]
@@ -20,7 +22,7 @@ if __name__ == "__main__":
 
         # deaths
         death_percentiles = {
-            p: aggregate_static_percentiles(src, f"deaths_{state_code}_*phi{'_'.join(map(str, p))}.npz")
+            p: cube.percentiles("deaths", *p, state_code)
             for p in params 
         }
         outcomes_per_policy(death_percentiles, "deaths", "o", 
@@ -37,7 +39,7 @@ if __name__ == "__main__":
 
         # vsly 
         VSLY_percentiles = {
-            p: aggregate_dynamic_percentiles(src, f"total_VSLY_{state_code}_*phi{'_'.join(map(str, p))}.npz")
+            p: cube.percentiles("total_VSLY", *p, state_code, t = 0)
             for p in tqdm(params)
         }
 
@@ -57,7 +59,7 @@ if __name__ == "__main__":
 
         # tev 
         TEV_percentiles = {
-            p: aggregate_dynamic_percentiles(src, f"total_TEV_{state_code}_*phi{'_'.join(map(str, p))}.npz", drop = ["_SK_", "_NL_"])
+            p: cube.percentiles("total_TEV", *p, state_code, t = 0)
             for p in tqdm(params)
         }
 
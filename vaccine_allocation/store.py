@@ -0,0 +1,276 @@
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from studies.vaccine_allocation.precision import decode, encode
+
+""" chunked on-disk array store for simulation outputs
+
+arrays are keyed by (state, district, phi, policy, field) and split into chunks along their first two
+axes (time and simulation); each district gets one append-only chunk file and a JSON index of chunk
+offsets, so readers decompress only the chunks overlapping the requested slice. rewriting an array (or
+extending its horizon) appends it again and leaves the old chunks behind as dead bytes; compact copies
+a district's live chunks into a fresh chunk file that its index entries then point to
+"""
+
+# codecs: name -> (compress, decompress); optional fast codecs are registered when installed
+codecs = {
+    "none": (bytes, bytes),
+    "zlib": (lambda b: zlib.compress(b, 1), zlib.decompress),
+}
+try:
+    import lz4.frame
+    codecs["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+try:
+    import zstandard
+    codecs["zstd"] = (zstandard.ZstdCompressor(level = 3).compress, zstandard.ZstdDecompressor().decompress)
+except ImportError:
+    pass
+
+default_codec = "lz4" if "lz4" in codecs else "zlib"
+
+def register_codec(name: str, compress, decompress):
+    """ add a codec mapping bytes -> bytes; readers must register the same codec under the same name """
+    codecs[name] = (compress, decompress)
+
+class ArrayStore():
+    """ chunked array store rooted at a directory, keyed by (state, district, phi, policy, field) """
+    def __init__(self, root: Path, codec: str = default_codec, chunks: Tuple[int, int] = (32, 250)):
+        self.root   = Path(root)
+        self.codec  = codec
+        self.chunks = chunks
+
+    # layout
+    def files(self, state: str, district: str) -> Tuple[Path, Path]:
+        """ chunk file and index file for a district """
+        folder = self.root/str(state)
+        return (folder/f"{district}.chunks", folder/f"{district}.index.json")
+
+    def index(self, state: str, district: str) -> Dict[str, dict]:
+        _, index = self.files(state, district)
+        if not index.exists():
+            return {}
+        with open(index) as f:
+            return json.load(f)
+
+    @staticmethod
+    def entry(phi, policy, field) -> str:
+        return f"{phi}/{policy}/{field}"
+
+    def chunk_file(self, state: str, district: str, meta: dict) -> Path:
+        """ chunk file holding an entry: the district's append file, or the compacted file named in the entry """
+        data, _ = self.files(state, district)
+        return data.with_name(meta["file"]) if "file" in meta else data
+
+    # writing
+    def write(self, key: tuple, array: np.array, encoding: Optional[dict] = None):
+        (state, district, phi, policy, field) = key
+        self.write_many(state, district, {(phi, policy, field): array}, {(phi, policy, field): encoding})
+
+    def write_many(self, state: str, district: str, arrays: Dict[tuple, np.array], encodings: Optional[Dict[tuple, dict]] = None):
+        """ append several arrays for one district, then publish them with a single index update
+
+        encodings (see precision.py) optionally map entries to a compact storage representation; reads upcast transparently
+        """
+        data, index_path = self.files(state, district)
+        data.parent.mkdir(parents = True, exist_ok = True)
+        compress, _ = codecs[self.codec]
+        index = self.index(state, district)
+        with open(data, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for ((phi, policy, field), array) in arrays.items():
+                encoding = (encodings or {}).get((phi, policy, field))
+                array = encode(array, encoding)
+                array = np.ascontiguousarray(array).reshape(np.shape(array)) # ascontiguousarray promotes scalars to 1-d
+                ct, cs = self.chunk_shape(array.shape)
+                offsets = {}
+                for i in range(0, max(1, array.shape[0] if array.ndim else 1), ct):
+                    for j in range(0, max(1, array.shape[1] if array.ndim > 1 else 1), cs):
+                        block = compress(np.ascontiguousarray(array[i:i + ct, j:j + cs] if array.ndim > 1 else array[i:i + ct] if array.ndim else array).tobytes())
+                        f.write(block)
+                        offsets[f"{i//ct}.{j//cs}"] = (offset, len(block))
+                        offset += len(block)
+                index[self.entry(phi, policy, field)] = {
+                    "shape":   array.shape,
+                    "dtype":   array.dtype.str,
+                    "chunks":  (ct, cs),
+                    "codec":   self.codec,
+                    "encoding": encoding,
+                    "offsets": offsets
+                }
+            f.flush()
+            os.fsync(f.fileno())
+        self.publish(index, index_path)
+
+    @staticmethod
+    def publish(index: Dict[str, dict], index_path: Path):
+        # index is replaced atomically, so a crash mid-write leaves previously published arrays readable
+        staging = index_path.with_name(index_path.name + ".tmp")
+        with open(staging, "w") as f:
+            json.dump(index, f)
+        os.replace(staging, index_path)
+
+    # maintenance
+    def dead_bytes(self, state: str, district: str) -> int:
+        """ bytes in a district's chunk files not referenced by its index (left behind by rewrites) """
+        index = self.index(state, district)
+        files = {self.chunk_file(state, district, meta) for meta in index.values()} | {self.files(state, district)[0]}
+        live  = sum(length for meta in index.values() for (_, length) in meta["offsets"].values())
+        return sum(path.stat().st_size for path in files if path.exists()) - live
+
+    def compact(self, state: Optional[str] = None, district: Optional[str] = None, min_dead_fraction: float = 0.0) -> int:
+        """ copy live chunks of each district (or one) with more than min_dead_fraction dead bytes into a new chunk file,
+        point its index there, then delete the old files; returns bytes reclaimed. the index switch is the atomic step,
+        so a crash leaves either layout readable. not safe to run while the same district is being written """
+        reclaimed = 0
+        for (state, district) in sorted({key[:2] for key in self.keys(state, district)}):
+            data, index_path = self.files(state, district)
+            index = self.index(state, district)
+            old   = {self.chunk_file(state, district, meta) for meta in index.values()} | {data}
+            size  = sum(path.stat().st_size for path in old if path.exists())
+            dead  = self.dead_bytes(state, district)
+            if dead == 0 or dead <= min_dead_fraction * size:
+                continue
+            target = next(data.with_name(f"{district}.compact{i}.chunks") for i in range(len(old) + 1) if data.with_name(f"{district}.compact{i}.chunks") not in old)
+            handles = {}
+            with open(target, "wb") as out:
+                for meta in index.values():
+                    source = self.chunk_file(state, district, meta)
+                    if source not in handles:
+                        handles[source] = open(source, "rb")
+                    offsets = {}
+                    for (chunk, (offset, length)) in meta["offsets"].items():
+                        handles[source].seek(offset)
+                        offsets[chunk] = (out.tell(), length)
+                        out.write(handles[source].read(length))
+                    meta["offsets"], meta["file"] = offsets, target.name
+                out.flush()
+                os.fsync(out.fileno())
+            for handle in handles.values():
+                handle.close()
+            self.publish(index, index_path)
+            for path in old:
+                if path.exists():
+                    path.unlink()
+            reclaimed += dead
+        return reclaimed
+
+    def chunk_shape(self, shape: tuple) -> Tuple[int, int]:
+        ct, cs = self.chunks
+        return (max(1, min(ct, shape[0])) if len(shape) > 0 else 1, max(1, min(cs, shape[1])) if len(shape) > 1 else 1)
+
+    # reading
+    def exists(self, key: tuple) -> bool:
+        (state, district, phi, policy, field) = key
+        return self.entry(phi, policy, field) in self.index(state, district)
+
+    def read(self, key: tuple, t = slice(None), sims = slice(None)) -> np.array:
+        """ read array[t, sims], decompressing only the chunks that overlap the selection """
+        (state, district, phi, policy, field) = key
+        return self.read_entries(state, district, [(phi, policy, field)], t, sims)[0]
+
+    def read_entries(self, state: str, district: str, entries, t = slice(None), sims = slice(None)):
+        """ read several arrays for one district with a single index lookup """
+        index = self.index(state, district)
+        handles, out = {}, []
+        try:
+            for (phi, policy, field) in entries:
+                meta = index[self.entry(phi, policy, field)]
+                path = self.chunk_file(state, district, meta)
+                if path not in handles:
+                    handles[path] = open(path, "rb")
+                out.append(decode(self.read_chunks(handles[path], meta, t, sims), meta.get("encoding")))
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return out
+
+    @staticmethod
+    def read_chunks(f, meta: dict, t, sims) -> np.array:
+        shape, dtype, (ct, cs) = tuple(meta["shape"]), np.dtype(meta["dtype"]), meta["chunks"]
+        _, decompress = codecs[meta["codec"]]
+        if len(shape) == 0:
+            (offset, length), = meta["offsets"].values()
+            f.seek(offset)
+            return np.frombuffer(decompress(f.read(length)), dtype = dtype).reshape(shape).copy()
+
+        ts = np.arange(shape[0])[t]
+        ss = np.arange(shape[1])[sims] if len(shape) > 1 else np.zeros(1, dtype = int)
+        squeeze_t, squeeze_s = np.ndim(ts) == 0, np.ndim(ss) == 0
+        ts, ss = np.atleast_1d(ts), np.atleast_1d(ss)
+
+        out = np.empty((len(ts), len(ss)) + shape[2:] if len(shape) > 1 else (len(ts),), dtype = dtype)
+        for i in np.unique(ts // ct):
+            rows = np.flatnonzero(ts // ct == i)
+            for j in np.unique(ss // cs):
+                cols = np.flatnonzero(ss // cs == j)
+                offset, length = meta["offsets"][f"{i}.{j}"]
+                f.seek(offset)
+                chunk = np.frombuffer(decompress(f.read(length)), dtype = dtype)
+                if len(shape) > 1:
+                    chunk = chunk.reshape((min(ct, shape[0] - i * ct), min(cs, shape[1] - j * cs)) + shape[2:])
+                    out[np.ix_(rows, cols)] = chunk[np.ix_(ts[rows] - i * ct, ss[cols] - j * cs)]
+                else:
+                    out[rows] = chunk[ts[rows] - i * ct]
+
+        if len(shape) > 1 and squeeze_s:
+            out = out[:, 0]
+        return out[0] if squeeze_t else out
+
+    def keys(self, state: Optional[str] = None, district: Optional[str] = None, phi = None, policy: Optional[str] = None, field: Optional[str] = None) -> Iterator[tuple]:
+        """ iterate over stored keys, optionally filtered on any key component """
+        states = [self.root/str(state)] if state is not None else sorted(p for p in self.root.glob("*") if p.is_dir())
+        for folder in states:
+            for index_path in sorted(folder.glob("*.index.json")):
+                _district = index_path.name[:-len(".index.json")]
+                if district is not None and _district != district:
+                    continue
+                with open(index_path) as f:
+                    entries = json.load(f)
+                for entry in entries:
+                    _phi, _policy, _field = entry.split("/")
+                    _phi = int(_phi) if _phi.isnumeric() else _phi
+                    if all(want is None or want == got for (want, got) in ((phi, _phi), (policy, _policy), (field, _field))):
+                        yield (folder.name, _district, _phi, _policy, _field)
+
+class MetricStores():
+    """ one ArrayStore per output metric under root (root/<metric>), keyed by (metric, state, district, phi, policy)
+
+    within a metric's store the metric is the field; per-district chunk files mean parallel workers never share a
+    file, and district-level constants (e.g. population by age) can sit alongside under phi = policy = "*"
+    """
+    def __init__(self, root: Path, **kwargs):
+        self.root   = Path(root)
+        self.kwargs = kwargs
+        self.stores = {}
+
+    def __getitem__(self, metric: str) -> ArrayStore:
+        if metric not in self.stores:
+            self.stores[metric] = ArrayStore(self.root/metric, **self.kwargs)
+        return self.stores[metric]
+
+    def metrics(self) -> Iterator[str]:
+        return (p.name for p in sorted(self.root.glob("*")) if p.is_dir())
+
+    def exists(self, key: tuple) -> bool:
+        (metric, state, district, phi, policy) = key
+        return self[metric].exists((state, district, phi, policy, metric))
+
+    def compact(self, min_dead_fraction: float = 0.0) -> int:
+        """ compact every metric's store (see ArrayStore.compact); returns bytes reclaimed """
+        return sum(self[metric].compact(min_dead_fraction = min_dead_fraction) for metric in self.metrics())
+
+    def read(self, key: tuple, t = slice(None), sims = slice(None)) -> np.array:
+        (metric, state, district, phi, policy) = key
+        return self[metric].read((state, district, phi, policy, metric), t, sims)
+
+    def keys(self, metric: Optional[str] = None, **filters) -> Iterator[tuple]:
+        """ iterate over stored (metric, state, district, phi, policy) keys, optionally filtered on state, district, phi or policy """
+        for _metric in ([metric] if metric is not None else self.metrics()):
+            for (state, district, phi, policy, _) in self[_metric].keys(field = _metric, **filters):
+                yield (_metric, state, district, phi, policy)
@@ -0,0 +1,70 @@
+import numpy as np
+
+""" summaries of simulated trajectories accumulated while a batched model runs """
+
+# percentiles kept by default: median, 90% and 95% simulation ranges
+percentiles = [50, 5, 95, 2.5, 97.5]
+
+class TrajectorySummary():
+    """ exact per-timestep percentiles (and means) over simulations for each policy arm
+
+    update() is called after every model step and reduces the newest values of each tracked field
+    over the simulation axis, so full (t x sims x age) trajectories never need to be kept; per-sim
+    cumulative deaths by age over the whole run are kept as well, since deaths and YLL are summed
+    across districts sim-by-sim before percentiles are taken
+    """
+    fields = {"dT": "dT_total", "dD": "dD_total", "pi": "pi", "q0": "q0", "q1": "q1", "Dj": "D"}
+
+    def __init__(self, percentiles = percentiles):
+        self.percentiles = percentiles
+        self.quantiles   = {field: [] for field in self.fields}
+        self.means       = {field: [] for field in self.fields}
+        self.D0 = None
+
+    def update(self, model):
+        if self.D0 is None:
+            self.D0 = model.D[-1].copy()
+        for (field, attr) in self.fields.items():
+            latest = getattr(model, attr)[-1]
+            self.quantiles[field].append(np.percentile(latest, self.percentiles, axis = 1))
+            self.means    [field].append(np.mean(latest, axis = 1))
+        self.D_last = model.D[-1]
+
+    def __getitem__(self, policy: int) -> dict:
+        """ arrays to persist for a single policy arm: {field}_pct is (t, percentile[, age]), {field}_mean is (t[, age]) """
+        summary = {"percentiles": np.array(self.percentiles), "deaths": self.D_last[policy] - self.D0[policy]}
+        for field in self.fields:
+            summary[f"{field}_pct"]  = np.stack([_[:, policy] for _ in self.quantiles[field]])
+            summary[f"{field}_mean"] = np.stack([_[policy]    for _ in self.means    [field]])
+        return summary
+
+def mean_ci(samples: np.array, antithetic: bool = False, z: float = 1.96):
+    """ mean and CI half-width over the leading (simulation) axis; antithetic runs pair sim i with sim i + n/2 """
+    samples = np.asarray(samples, dtype = float)
+    if antithetic:
+        half = len(samples)//2
+        samples = (samples[:half] + samples[half:2*half])/2
+    return (samples.mean(axis = 0), z * samples.std(axis = 0, ddof = 1)/np.sqrt(len(samples)))
+
+def difference_ci(baseline: np.array, policy: np.array, antithetic: bool = False, z: float = 1.96):
+    """ mean and CI half-width of baseline - policy, paired sim by sim (common random numbers make this much tighter than the marginal CIs) """
+    return mean_ci(np.asarray(baseline) - np.asarray(policy), antithetic, z)
+
+def relative_halfwidth(estimates, atol: float = 0) -> float:
+    """ largest CI half-width relative to its mean over (mean, half-width) estimates; half-widths within atol count as 0,
+    so an estimate whose mean is near zero (e.g. deaths averted by an arm that barely differs from novax) can still converge """
+    return max((0 if hw <= atol else hw/abs(mean) if mean else np.inf) for (mean, hw) in estimates)
+
+def stack_sims(blocks, antithetic: bool = False, axis: int = 1) -> np.array:
+    """ concatenate independently simulated blocks along the simulation axis, keeping antithetic partners n/2 apart """
+    if not antithetic:
+        return np.concatenate(blocks, axis = axis)
+    halves = [np.split(block, 2, axis = axis) for block in blocks]
+    return np.concatenate([first for (first, _) in halves] + [second for (_, second) in halves], axis = axis)
+
+def resample_sims(samples: np.array, num_sims: int, axis: int = 0, seed: int = 0) -> np.array:
+    """ bootstrap samples up to num_sims along the simulation axis, so districts run with different simulation counts can be summed sim by sim """
+    samples = np.asarray(samples)
+    if samples.ndim == 0 or samples.shape[axis] == num_sims:
+        return samples
+    return np.take(samples, np.random.default_rng(seed).integers(0, samples.shape[axis], num_sims), axis = axis)
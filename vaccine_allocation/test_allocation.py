@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from studies.vaccine_allocation.allocation import Allocator, prioritize
+
+""" Allocator and prioritize against the original single-policy prioritize """
+
+def reference_prioritize(num_doses, S, prioritization):
+    Sp = S[:, prioritization]
+    dV = np.where(Sp.cumsum(axis = 1) <= num_doses, Sp, 0)
+    dV[np.arange(len(dV)), (Sp.cumsum(axis = 1) > dV.cumsum(axis = 1)).argmax(axis = 1)] = num_doses - dV.sum(axis = 1)
+    return dV[:, sorted(range(len(prioritization)), key = prioritization.__getitem__)].clip(0, S)
+
+def populations(rng, num_sims, num_age_bins = 7):
+    """ eligible populations with some exhausted bins, as in late stages of a run """
+    S = rng.integers(0, 5000, size = (num_sims, num_age_bins)).astype(float)
+    S[rng.random(S.shape) < 0.2] = 0
+    return S
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prioritize_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    S = populations(rng, 50)
+    order = list(rng.permutation(7))
+    for num_doses in (0, 1, 1000, 7500, S.sum(axis = 1).max() + 1):
+        assert np.allclose(prioritize(num_doses, S, order), reference_prioritize(num_doses, S, order))
+
+@pytest.mark.parametrize("seed", range(10))
+def test_allocator_policy_arms(seed):
+    rng = np.random.default_rng(seed)
+    orders = [list(rng.permutation(7)) for _ in range(3)]
+    allocate = Allocator(orders + [None], num_sims = 40)
+    S = np.stack([populations(rng, 40) for _ in range(4)])
+    num_doses = rng.integers(0, 20000, size = 4).astype(float)
+    dV = allocate(num_doses, S)
+    for (p, order) in enumerate(orders):
+        assert np.allclose(dV[p], reference_prioritize(num_doses[p], S[p], order))
+
+    # pro rata arm: doses proportional to the eligible population, nothing to empty sims
+    total = S[-1].sum(axis = -1, keepdims = True)
+    expected = np.divide(num_doses[-1] * S[-1], total, out = np.zeros_like(S[-1]), where = total > 0)
+    assert np.allclose(dV[-1], expected)
+
+def test_allocator_reuses_buffers():
+    rng = np.random.default_rng(0)
+    allocate = Allocator([list(range(7))], num_sims = 10)
+    S1, S2 = populations(rng, 10)[None], populations(rng, 10)[None]
+    first = allocate(3000, S1).copy()
+    allocate(3000, S2)
+    assert np.array_equal(allocate(3000, S1), first)
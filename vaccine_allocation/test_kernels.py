@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from studies.vaccine_allocation.kernels import allocation_curve, discounted_reverse_cumsum, discounted_sum, ranked_cohorts
+
+""" numerical kernels against the quadratic loops they replaced """
+
+beta = 1/((1.0425)**(1/365))
+
+def reference_NPV(daily, n, beta = beta):
+    s = np.arange(n)
+    return [np.sum(np.power(beta, s[t:] - t)[:, None, None] * daily[t:, :], axis = 0) for t in range(n)]
+
+@pytest.fixture
+def daily():
+    return np.random.default_rng(0).gamma(2.0, 100.0, size = (120, 30, 7))
+
+def test_reverse_cumsum_matches_NPV(daily):
+    assert np.allclose(discounted_reverse_cumsum(daily, beta), reference_NPV(daily, len(daily)), rtol = 1e-12)
+
+@pytest.mark.parametrize("block", [1, 7, 40, 120])
+def test_reverse_cumsum_blocks(daily, block):
+    """ processing the horizon last block first, carrying the value at each block's start into the one before it """
+    out, carry = np.empty_like(daily), None
+    for start in reversed(range(0, len(daily), block)):
+        discounted_reverse_cumsum(daily[start:start + block], beta, out = out[start:start + block], carry = carry)
+        carry = out[start]
+    assert np.allclose(out, discounted_reverse_cumsum(daily, beta), rtol = 1e-12)
+
+def test_discounted_sum(daily):
+    assert np.allclose(discounted_sum(daily, beta), reference_NPV(daily, len(daily))[0], rtol = 1e-12)
+    assert np.allclose(discounted_sum(daily[:, 0, 0], beta), discounted_reverse_cumsum(daily[:, 0, 0], beta)[0], rtol = 1e-12)
+
+def reference_allocation_curve(all_tev, daily_doses, N, horizon):
+    distributed_doses = 0
+    x_pop, y_tev, t_vax = [], [], []
+    ranking = 0
+    for t in range(horizon):
+        tev = all_tev.loc[t].reset_index()
+        ranking = tev[(tev.index >= ranking) & (tev.num_vax > distributed_doses)].index.min()
+        if np.isnan(ranking):
+            break
+        x_pop += [100 * (distributed_doses)/N, 100 * (distributed_doses + daily_doses)/N]
+        t_vax += [t, t+1]
+        y_tev += [tev.iloc[ranking].pc_tev_usd]*2
+        distributed_doses += daily_doses
+    return (x_pop, y_tev, t_vax)
+
+def synthetic_all_tev(rng, steps = 60, cohorts = 40):
+    """ all_tev layout: one block of cohorts per day, ranked by TEV, with cumulative population in num_vax """
+    pc_tev_usd = -np.sort(-rng.gamma(2.0, 50.0, size = (steps, cohorts)), axis = 1)
+    num_vax = np.cumsum(rng.integers(1000, 100000, size = (steps, cohorts)), axis = 1).astype(float)
+    return pd.DataFrame({
+        "district": np.tile([f"d{_}" for _ in range(cohorts)], steps),
+        "num_vax": num_vax.ravel(),
+        "pc_tev_usd": pc_tev_usd.ravel()
+    }, index = pd.Index(np.repeat(np.arange(steps), cohorts), name = "t"))
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("daily_doses", [1e3, 2e4, 1e5, 1e6])
+def test_allocation_curve_matches_loop(seed, daily_doses):
+    all_tev = synthetic_all_tev(np.random.default_rng(seed))
+    N = all_tev.num_vax.max()
+    for horizon in (30, 60):
+        expected = reference_allocation_curve(all_tev, daily_doses, N, horizon)
+        curve = allocation_curve(ranked_cohorts(all_tev), daily_doses, N, horizon = horizon)
+        for (got, want) in zip(curve, expected):
+            assert np.array_equal(got, want)
+    assert all(np.array_equal(a, b) for (a, b) in zip(allocation_curve(ranked_cohorts(all_tev), daily_doses, N), reference_allocation_curve(all_tev, daily_doses, N, 60)))
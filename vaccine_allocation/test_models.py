@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from scipy.special import pdtr, pdtrc
+from scipy.stats import poisson
+from studies.vaccine_allocation.models import BatchedAge_SIRVD, poisson_ppf
+
+""" batched model: exact Poisson inversion for variance reduction, and continuing runs from snapshots """
+
+def is_quantile(k, u, lam):
+    """ k is the smallest count with P(X <= k) >= u, compared in the upper tail as P(X > k) <= 1 - u where the cdf loses precision """
+    upper = u > 0.5
+    covers = lambda k: np.where(upper, pdtrc(k, lam) <= 1 - u, pdtr(k, lam) >= u)
+    return covers(k) & ((k == 0) | ~covers(k - 1))
+
+def uniforms(n, seed = 0):
+    u = np.random.default_rng(seed).random(n)
+    return np.concatenate([u, 1 - u, [np.finfo(float).tiny, 1 - np.finfo(float).epsneg]]).clip(np.finfo(float).tiny, 1 - np.finfo(float).epsneg)
+
+@pytest.mark.parametrize("scale", [1e-3, 0.1, 5, 29.9, 30, 200, 1e4, 1e5, 1e7])
+def test_poisson_ppf_is_quantile(scale):
+    u   = uniforms(25000)
+    lam = scale * np.random.default_rng(1).uniform(0.5, 1.5, size = u.shape)
+    assert is_quantile(poisson_ppf(u, lam), u, lam).all()
+
+@pytest.mark.parametrize("scale", [0.1, 5, 29.9, 30, 200, 1e4])
+def test_poisson_ppf_matches_scipy(scale):
+    """ away from the extreme tails (where scipy.stats.poisson.ppf itself can be off by a count or more) the two agree exactly """
+    u   = np.random.default_rng(0).random(50000)
+    lam = scale * np.random.default_rng(1).uniform(0.5, 1.5, size = u.shape)
+    assert np.array_equal(poisson_ppf(u, lam), poisson.ppf(u, lam))
+
+def test_variance_reduction_pairs():
+    """ draws are shared across policy arms and antithetic between the two halves of the simulations """
+    model = BatchedAge_SIRVD("test", 1e6, dT0 = np.full(8, 100.0), Rt0 = 1.2, S0 = np.full((8, 2), 4e5), I0 = np.full((8, 2), 1e3),
+        R0 = np.full((8, 2), 1e5), D0 = np.zeros((8, 2)), num_policies = 3, variance_reduction = True)
+    lam = np.full((3, 8, 2), 50.0)
+    draws = model.poisson(lam)
+    assert (draws == draws[0]).all()
+    rng = np.random.default_rng(0)
+    u = rng.random((4, 2))
+    assert np.array_equal(draws[0], poisson.ppf(np.concatenate([u, 1 - u]), 50.0))
+    with pytest.raises(ValueError):
+        BatchedAge_SIRVD("test", 1e6, dT0 = np.full(7, 100.0), Rt0 = 1.2, S0 = np.full((7, 2), 4e5), I0 = np.full((7, 2), 1e3),
+            R0 = np.full((7, 2), 1e5), D0 = np.zeros((7, 2)), variance_reduction = True)
+
+def model(variance_reduction = False, num_sims = 20):
+    N0 = np.array([2.0e5, 1.8e5, 1.6e5, 1.3e5, 1.0e5, 0.6e5, 0.3e5])
+    I0 = N0 * 0.002
+    return BatchedAge_SIRVD("test", N0.sum(), dT0 = np.full(num_sims, 400.0), Rt0 = 1.3, S0 = np.tile(N0 * 0.8 - I0, (num_sims, 1)),
+        I0 = np.tile(I0, (num_sims, 1)), R0 = np.tile(N0 * 0.2, (num_sims, 1)), D0 = np.zeros((num_sims, 7)),
+        num_policies = 2, mortality = np.linspace(1e-4, 5e-2, 7), random_seed = 3, variance_reduction = variance_reduction)
+
+def run(model, steps):
+    for _ in range(steps):
+        model.parallel_forward_epi_step(np.stack([np.full(model.shape[1:], 500.0), np.zeros(model.shape[1:])]))
+    return model
+
+@pytest.mark.parametrize("variance_reduction", [False, True])
+def test_snapshot_restore(tmp_path, variance_reduction):
+    """ running 30 days straight matches running 12, snapshotting through an .npz as epi_simulations does, and continuing 18 """
+    straight = run(model(variance_reduction), 30)
+    np.savez_compressed(tmp_path/"snapshot.npz", **run(model(variance_reduction), 12).snapshot(12))
+    with np.load(tmp_path/"snapshot.npz") as npz:
+        assert int(npz["t"]) == 12
+        restored = run(BatchedAge_SIRVD.restore(npz), 18)
+    for attr in BatchedAge_SIRVD.state:
+        assert np.array_equal(getattr(restored, attr), getattr(straight, attr)), attr
+    for attr in BatchedAge_SIRVD.history:
+        assert np.array_equal(np.stack(getattr(restored, attr)), np.stack(getattr(straight, attr)[12:])), attr
+    for policy in range(2):
+        assert np.array_equal(restored[policy].D, straight[policy].D[12:])
+
+def test_restore_without_history():
+    snapshot = run(model(), 5).snapshot(5)
+    restored = run(BatchedAge_SIRVD.restore(snapshot, retain_history = False), 5)
+    assert all(len(getattr(restored, attr)) == 1 for attr in BatchedAge_SIRVD.history)
+    assert np.array_equal(restored.D[-1], run(model(), 10).D[-1])
@@ -0,0 +1,64 @@
+import zipfile
+
+import numpy as np
+import pytest
+from studies.vaccine_allocation.precision import decode, encode, encoding_for, load_npz, npz_memmap, npz_rows, policies, savez
+
+""" precision policies: exact round trips under "full", bounded error under "compact", and partial reads of saved archives """
+
+@pytest.fixture
+def trajectories():
+    rng = np.random.default_rng(0)
+    return {
+        "dT": rng.poisson(1000, size = (60, 20)).astype(float),
+        "Dj": np.cumsum(rng.poisson(3, size = (60, 20, 7)), axis = 0).astype(float),
+        "pi": rng.random((60, 20, 7)),
+        "q0": 1 - rng.random((60, 20, 7)) * 1e-5,
+    }
+
+def test_full_is_exact(trajectories):
+    for (field, array) in trajectories.items():
+        encoding = encoding_for(field, "full")
+        assert np.array_equal(decode(encode(array, encoding), encoding), array)
+
+def test_compact_tolerances(trajectories):
+    for field in ("dT", "Dj"):
+        encoding = encoding_for(field, "compact")
+        assert encode(trajectories[field], encoding).dtype == np.uint32
+        assert np.array_equal(decode(encode(trajectories[field], encoding), encoding), trajectories[field])
+    encoding = encoding_for("pi", "compact")
+    assert np.allclose(decode(encode(trajectories["pi"], encoding), encoding), trajectories["pi"], rtol = 1e-7, atol = 0)
+
+    # survival probabilities keep relative precision in 1 - q, which a plain float32 cast would lose
+    q0 = trajectories["q0"]
+    encoding = encoding_for("q0", "compact")
+    assert np.allclose(1 - decode(encode(q0, encoding), encoding), 1 - q0, rtol = 1e-6, atol = 0)
+    assert not np.allclose(1 - q0.astype(np.float32).astype(float), 1 - q0, rtol = 1e-6, atol = 0)
+
+def test_encoding_for_metric_files():
+    assert encoding_for("total_TEV_TN_Chennai_phi50_random", "compact") == policies["compact"]["total_TEV"]
+    assert encoding_for("per_capita_TEV_TN_Chennai_phi50_random", "compact") == policies["compact"]["per_capita_TEV"]
+    assert encoding_for("unlisted_TN_Chennai_phi50_random", "compact") is None
+    assert encoding_for("total_TEV_TN_Chennai_phi50_random", "full") is None
+
+@pytest.mark.parametrize("compresslevel", [None, 0, 1])
+def test_savez_round_trip(tmp_path, trajectories, compresslevel):
+    path = tmp_path/"trajectories.npz"
+    savez(path, "compact", compresslevel = compresslevel, **trajectories)
+    with load_npz(path) as npz:
+        assert sorted(npz.files) == sorted(trajectories)
+        assert np.array_equal(npz["dT"], trajectories["dT"])
+        for index in (0, 59, slice(10, 20), slice(None, None, 3), np.array([5, 1, 40])):
+            assert np.array_equal(npz.read("Dj", index), trajectories["Dj"][index])
+            assert np.allclose(npz.read("pi", index), trajectories["pi"][index], rtol = 1e-7, atol = 0)
+
+def test_partial_reads(tmp_path, trajectories):
+    stored, deflated = tmp_path/"stored.npz", tmp_path/"deflated.npz"
+    savez(stored,   "full", compresslevel = 0, **trajectories)
+    savez(deflated, "full", compresslevel = 1, **trajectories)
+    assert np.array_equal(npz_memmap(stored, "pi"), trajectories["pi"])
+    assert npz_memmap(deflated, "pi") is None
+    with zipfile.ZipFile(deflated) as archive:
+        assert np.array_equal(npz_rows(archive, "pi", slice(7, 9)), trajectories["pi"][7:9])
+        assert np.array_equal(npz_rows(archive, "pi", np.array([30, 2])), trajectories["pi"][[30, 2]])
+        assert npz_rows(archive, "pi", (slice(None), 3)) is None
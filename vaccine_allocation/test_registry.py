@@ -0,0 +1,83 @@
+import ast
+from pathlib import Path
+
+import pytest
+from studies.vaccine_allocation.registry import Registry
+
+""" Registry resolution order, error cases, evaluate computing each node once, and what policy_evaluation requests resolve to """
+
+@pytest.fixture
+def registry():
+    calls = []
+    registry = Registry()
+    registry.calls = calls
+
+    @registry.register("a", "x")
+    def a(x):
+        calls.append("a")
+        return x + 1
+
+    @registry.register("b", "a")
+    def b(a):
+        calls.append("b")
+        return 2 * a
+
+    @registry.register("c", "a", "b", "y")
+    def c(a, b, y):
+        calls.append("c")
+        return a + b + y
+
+    @registry.register("d", "b")
+    def d(b):
+        calls.append("d")
+        return -b
+
+    return registry
+
+def test_order(registry):
+    order = registry.order(["c", "d"], leaves = ["x", "y"])
+    assert sorted(order) == ["a", "b", "c", "d"]
+    for (name, (_, inputs)) in registry.nodes.items():
+        assert all(order.index(dependency) < order.index(name) for dependency in inputs if dependency in order)
+    assert registry.order(["b"], leaves = ["x"]) == ["a", "b"]
+
+def test_leaves_short_circuit(registry):
+    assert registry.order(["c"], leaves = ["a", "b", "y"]) == ["c"]
+
+def test_errors(registry):
+    with pytest.raises(KeyError):
+        registry.order(["c"], leaves = ["x"])
+    registry.register("e", "f")(lambda f: f)
+    registry.register("f", "e")(lambda e: e)
+    with pytest.raises(ValueError, match = "cycle"):
+        registry.order(["e"])
+
+def test_evaluate(registry):
+    assert registry.evaluate(["c", "d"], x = 1, y = 10) == {"c": 2 + 4 + 10, "d": -4}
+    assert sorted(registry.calls) == ["a", "b", "c", "d"]
+    registry.calls.clear()
+    assert registry.evaluate(["d"], x = 1) == {"d": -4}
+    assert registry.calls == ["a", "b", "d"]
+
+def policy_evaluation_graph():
+    """ the evaluation registry of policy_evaluation, rebuilt from its source: importing the module loads its data files,
+    but registering nodes only evaluates the decorator arguments, so the definitions can run on their own """
+    source = (Path(__file__).parent/"policy_evaluation.py").read_text()
+    module = ast.parse(source)
+    registers = lambda node: any(isinstance(_, ast.Call) and ast.unparse(_.func) == "evaluation.register" for _ in getattr(node, "decorator_list", []))
+    statements = [node for node in module.body if registers(node)
+        or (isinstance(node, ast.Assign) and ast.unparse(node) == "evaluation = Registry()")
+        or (isinstance(node, ast.For) and "evaluation.register" in ast.unparse(node))]
+    namespace = {"Registry": Registry}
+    exec(compile(ast.Module(body = statements, type_ignores = []), "policy_evaluation.py", "exec"), namespace)
+    return namespace["evaluation"]
+
+evaluation_leaves = ["load", "consumption", "phi_p0", "N_district", "T_ratio", "N_jk", "age_weight", "state_years_life_remaining", "cf_tag", "arms", "arm_tags"]
+
+def test_dTEV_only_request():
+    """ a dTEV component alone loads and computes consumption for its own arm, not for every policy arm """
+    evaluation = policy_evaluation_graph()
+    assert set(evaluation.order(["dTEV_health"], evaluation_leaves)) == {
+        "counterfactual", "c_p0v0", "q_p0v0_mean", "c_p0v0_mean", "TEV_p0", "c_p1v1", "policy_dTEV", "c_p1v0_dTEV", "dTEV", "dTEV_health"}
+    assert {"policy", "c_p1v0", "TEV_p1"}.isdisjoint(evaluation.order(["dTEV_health", "dTEV_extn"], evaluation_leaves))
+    assert "consumption" not in set().union(*(evaluation.nodes[_][1] for _ in evaluation.order(["deaths", "YLL"], evaluation_leaves)))
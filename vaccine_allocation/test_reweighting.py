@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from studies.vaccine_allocation.models import BatchedAge_SIRVD
+from studies.vaccine_allocation.reweighting import reweight
+
+""" reweighting simulated deaths to another IFR vector against simulating with it directly """
+
+mortality = np.array([1e-5, 5e-5, 2e-4, 1e-3, 4e-3, 1.5e-2, 5e-2])
+N0 = np.array([2.0e5, 1.8e5, 1.6e5, 1.3e5, 1.0e5, 0.6e5, 0.3e5])
+fields = {"dD": "dD_total", "pi": "pi", "q0": "q0", "q1": "q1", "Dj": "D", "Oj": "O", "Oj_vn": "O_vn"}
+
+def simulate(mortality, num_sims = 400, steps = 60, seed = 0):
+    """ trajectories of one policy arm vaccinating 0.5% of the population a day pro rata, as epi_simulations persists them """
+    I0 = N0 * 0.002
+    model = BatchedAge_SIRVD("test", N0.sum(), dT0 = np.full(num_sims, 400.0), Rt0 = 1.3, S0 = np.tile(N0 * 0.8 - I0, (num_sims, 1)),
+        I0 = np.tile(I0, (num_sims, 1)), R0 = np.tile(N0 * 0.2, (num_sims, 1)), D0 = np.zeros((num_sims, 7)),
+        num_policies = 1, mortality = mortality, random_seed = seed)
+    for _ in range(steps):
+        S = model.S
+        model.parallel_forward_epi_step(0.005 * N0.sum() * S/S.sum(axis = -1, keepdims = True))
+    trajectories = model[0]
+    return {field: getattr(trajectories, attr) for (field, attr) in fields.items()}
+
+@pytest.fixture(scope = "module")
+def outputs():
+    return simulate(mortality)
+
+def test_expected(outputs):
+    alternative = mortality * 3
+    reweighted = reweight(outputs, alternative, N0, method = "expected")
+    assert np.allclose(reweighted["Dj"], outputs["Dj"][0] + np.cumsum(outputs["Oj"] * alternative, axis = 0))
+    assert np.allclose(reweighted["dD"][1:], ((outputs["Oj"] + outputs["Oj_vn"]) * alternative).sum(axis = -1)[1:])
+    assert np.all((0 <= reweighted["q0"]) & (reweighted["q0"] <= 1)) and np.all((0 <= reweighted["q1"]) & (reweighted["q1"] <= 1))
+
+def test_certain_death(outputs):
+    """ with an IFR of 1 every outflow is a death, whatever the draw """
+    reweighted = reweight(outputs, np.ones(7), N0, method = "binomial")
+    assert np.array_equal(reweighted["Dj"][1:] - reweighted["Dj"][:-1], outputs["Oj"][1:])
+    assert np.array_equal(reweighted["D_vn"], np.cumsum(outputs["Oj_vn"], axis = 0))
+
+def test_binomial_matches_simulation(outputs):
+    """ deaths reweighted to 3x the IFR agree in mean with a simulation at 3x the IFR, within Monte Carlo error """
+    reweighted = reweight(outputs, mortality * 3, N0, method = "binomial", seed = 1)
+    direct = simulate(mortality * 3, seed = 2)
+    (a, b) = (reweighted["dD"][1:].sum(axis = 0), direct["dD"][1:].sum(axis = 0))
+    assert abs(a.mean() - b.mean()) < 4 * np.sqrt(a.var()/len(a) + b.var()/len(b))
+    assert reweighted["rel_N_shift"].max() < 1e-3
+
+def test_unknown_method(outputs):
+    with pytest.raises(ValueError):
+        reweight(outputs, mortality, N0, method = "poisson")
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from studies.vaccine_allocation.precision import encoding_for
+from studies.vaccine_allocation.store import ArrayStore, MetricStores, codecs
+
+""" ArrayStore round trips: whole arrays, slices across chunk boundaries, scalars, encodings and compaction """
+
+@pytest.fixture
+def arrays():
+    rng = np.random.default_rng(0)
+    return {
+        (50, "random", "dT"): rng.poisson(100, size = (101, 37)).astype(float),
+        (50, "random", "pi"): rng.random((101, 37, 7)),
+        (50, "random", "t"):  np.arange(101.0),
+        ("*", "*", "N_j"):    np.array(123456.0),
+    }
+
+@pytest.mark.parametrize("codec", sorted(codecs))
+def test_round_trip(tmp_path, arrays, codec):
+    store = ArrayStore(tmp_path, codec = codec, chunks = (16, 10))
+    store.write_many("TN", "Chennai", arrays)
+    for ((phi, policy, field), array) in arrays.items():
+        key = ("TN", "Chennai", phi, policy, field)
+        assert store.exists(key)
+        assert np.array_equal(store.read(key), array)
+    assert sorted(store.keys(field = "dT")) == [("TN", "Chennai", 50, "random", "dT")]
+
+def test_slices(tmp_path, arrays):
+    store = ArrayStore(tmp_path, chunks = (16, 10))
+    store.write_many("TN", "Chennai", arrays)
+    pi = arrays[(50, "random", "pi")]
+    key = ("TN", "Chennai", 50, "random", "pi")
+    for (t, sims) in [(slice(None), slice(None)), (slice(15, 33), slice(9, 21)), (100, slice(None)), (slice(None, None, 7), 36), (np.array([3, 50, 99]), np.array([0, 10, 20])), (0, 0)]:
+        assert np.array_equal(store.read(key, t, sims), pi[t][:, sims] if np.ndim(np.arange(101)[t]) else pi[t][sims])
+    assert np.array_equal(store.read(("TN", "Chennai", 50, "random", "t"), slice(20, 40)), arrays[(50, "random", "t")][20:40])
+
+def test_encodings(tmp_path, arrays):
+    store = ArrayStore(tmp_path)
+    encodings = {key: encoding_for(key[-1], "compact") for key in arrays}
+    store.write_many("TN", "Chennai", arrays, encodings)
+    assert np.array_equal(store.read(("TN", "Chennai", 50, "random", "dT")), arrays[(50, "random", "dT")])
+    assert np.allclose(store.read(("TN", "Chennai", 50, "random", "pi")), arrays[(50, "random", "pi")], atol = 1e-7)
+
+def test_compaction(tmp_path, arrays):
+    store = ArrayStore(tmp_path, chunks = (16, 10))
+    store.write_many("TN", "Chennai", arrays)
+    store.write_many("TN", "Madurai", arrays)
+    assert store.dead_bytes("TN", "Chennai") == 0 and store.compact() == 0
+
+    # rewrites leave the old chunks behind
+    rewritten = {key: array * 2 for (key, array) in arrays.items() if key[-1] != "N_j"}
+    store.write_many("TN", "Chennai", rewritten)
+    dead = store.dead_bytes("TN", "Chennai")
+    assert dead > 0
+    assert store.compact(min_dead_fraction = 0.99) == 0
+    assert store.compact() == dead
+    assert store.dead_bytes("TN", "Chennai") == 0
+
+    for (phi, policy, field) in arrays:
+        expected = rewritten.get((phi, policy, field), arrays[(phi, policy, field)])
+        assert np.array_equal(store.read(("TN", "Chennai", phi, policy, field)), expected)
+        assert np.array_equal(store.read(("TN", "Madurai", phi, policy, field)), arrays[(phi, policy, field)])
+
+    # writes after compaction go to the append file, and a second compaction folds them in
+    store.write_many("TN", "Chennai", {(50, "random", "dT"): arrays[(50, "random", "dT")]})
+    assert store.compact() > 0
+    assert np.array_equal(store.read(("TN", "Chennai", 50, "random", "dT")), arrays[(50, "random", "dT")])
+    assert len(list((tmp_path/"TN").glob("Chennai*.chunks"))) == 1
+
+def test_metric_stores(tmp_path):
+    stores = MetricStores(tmp_path)
+    deaths = np.arange(12.0).reshape(3, 4)
+    stores["deaths"].write(("TN", "Chennai", 50, "random", "deaths"), deaths)
+    assert stores.exists(("deaths", "TN", "Chennai", 50, "random"))
+    assert list(stores.keys()) == [("deaths", "TN", "Chennai", 50, "random")]
+    assert np.array_equal(stores.read(("deaths", "TN", "Chennai", 50, "random"), t = 1), deaths[1])
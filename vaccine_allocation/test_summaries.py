@@ -0,0 +1,20 @@
+import numpy as np
+from studies.vaccine_allocation.summaries import difference_ci, mean_ci, relative_halfwidth
+
+""" confidence intervals over simulations and the convergence criterion adaptive_sims stops on """
+
+def test_relative_halfwidth():
+    assert relative_halfwidth([(100.0, 5.0), (-20.0, 2.0), (3.0, 0.0)]) == 0.1
+    assert relative_halfwidth([(0.0, 0.5)]) == np.inf
+    assert relative_halfwidth([(0.0, 0.5), (100.0, 5.0)], atol = 1.0) == 0.05
+
+def test_near_zero_deaths_averted_converge():
+    """ an arm that averts almost no deaths has a difference CI tight in deaths but arbitrarily wide relative to its mean """
+    rng = np.random.default_rng(0)
+    novax  = rng.poisson(1000, size = 2000).astype(float)
+    policy = novax - rng.binomial(1, 0.01, size = 2000)
+    estimates = [mean_ci(novax), mean_ci(policy), difference_ci(novax, policy)]
+    (mean, hw) = estimates[-1]
+    assert hw < 1 and hw/abs(mean) > 0.05
+    assert relative_halfwidth(estimates) > 0.05
+    assert relative_halfwidth(estimates, atol = 1.0) <= 0.05
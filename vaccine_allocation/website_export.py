@@ -2,29 +2,60 @@ import numpy as np
 import pandas as pd
 from studies.vaccine_allocation.commons import *
 from studies.vaccine_allocation.epi_simulations import *
+from studies.vaccine_allocation.precision import load_npz, savez
 
 num_sims = 100
 src = mkdir(ext/f"all_india_wtp_metrics{num_sims}")
 
-# today = pd.Timestamp.now()
-today = pd.Timestamp("March 28, 2021")
-idx   = 1 + (today - simulation_start).days
+def daily_medians(src, name, tag_suffix = "50_random"):
+    """ medians over sims for every day and age bin, (t, district, age), of the tagged arrays in src/district_{name}.npz; cached
+    uncompressed next to it (and rebuilt when it changes), so an export for any day reads one memory-mapped row """
+    source = src/f"district_{name}.npz"
+    cache  = src/f"district_{name}_medians_{tag_suffix}.npz"
+    if not cache.exists() or cache.stat().st_mtime < source.stat().st_mtime:
+        with load_npz(source) as npz:
+            tags = [_ for _ in npz.files if _.endswith(tag_suffix)]
+            savez(cache, "full", compresslevel = 0, tags = np.array(tags), medians = np.stack([np.median(npz[tag], axis = 1) for tag in tags], axis = 1))
+    return cache
 
-wtp  = np.load(src/'district_WTP.npz')
-yll  = np.load(src/'district_YLL.npz')
-vsly = np.load(src/'district_VSLY.npz')
+def medians_on(src, name, idx, tags = None, tag_suffix = "50_random", cached = True):
+    """ tags and medians over sims on day idx, (district, age), reading only that row: from the daily_medians cache, or
+    from each array in the source (memory-mapped if stored uncompressed, else decompressed up to that row) """
+    if cached:
+        with load_npz(daily_medians(src, name, tag_suffix)) as npz:
+            (cache_tags, medians) = (list(npz["tags"]), npz.read("medians", idx))
+        return (cache_tags, medians) if tags is None else (tags, medians[[cache_tags.index(tag) for tag in tags]])
+    with load_npz(src/f"district_{name}.npz") as npz:
+        tags = [_ for _ in npz.files if _.endswith(tag_suffix)] if tags is None else tags
+        return (tags, np.median([npz.read(tag, idx) for tag in tags], axis = 1))
 
-rows = []
-for tag in [_ for _ in wtp.files if _.endswith("50_random")]:
-    state, district, *_ = tag.split("_")
-    *age_pop, N_tot = districts_to_run.loc[state, district].filter(like = "N_", axis = 0)
-    pop_weight = np.array(age_pop)/N_tot
-    rows.append([
-        state, district, 
-        np.median(wtp [tag][idx], axis = 0) @ pop_weight, 
-        np.median(vsly[tag][idx], axis = 0) @ pop_weight, 
-        np.median(yll[tag])/(districts_to_run.loc[state, district].N_tot/(1e6))
-    ])
-    
-pd.DataFrame(rows, columns = ["state", "district", "WTP", "VSLY", "YLL_per_million"])\
-    .to_csv(data/f"IDFC_{today.strftime('%b%d')}.csv")
+def export(today, src = src, dst = data, tag_suffix = "50_random", cached = True):
+    """ per district WTP and VSLY on today (medians over sims, weighted by age bin population share) and YLL per million, for the public site
+
+    medians and population weights are computed over all districts at once; see medians_on for how little is read """
+    idx = 1 + (today - simulation_start).days
+    (tags, WTP) = medians_on(src, "WTP",  idx, tag_suffix = tag_suffix, cached = cached)
+    (_,   VSLY) = medians_on(src, "VSLY", idx, tags, tag_suffix = tag_suffix, cached = cached)
+    with load_npz(src/'district_YLL.npz') as yll:
+        YLL = np.array([np.median(yll[tag]) for tag in tags])
+
+    (states, districts) = zip(*(tag.split("_")[:2] for tag in tags))
+    population = districts_to_run.reindex(pd.MultiIndex.from_arrays([states, districts]))
+    missing    = population.index[population.N_tot.isna()]
+    if len(missing):
+        # .loc raised on these before; reindex would publish them as blank rows
+        raise KeyError(f"no population for {', '.join(map('/'.join, missing))} in districts_to_run")
+    N_tot      = population.N_tot.values
+    pop_weight = population.filter(regex = "N_[0-6]", axis = 1).values/N_tot[:, None]
+    pd.DataFrame({
+        "state":           states,
+        "district":        districts,
+        "WTP":             np.einsum("da,da->d", WTP,  pop_weight),
+        "VSLY":            np.einsum("da,da->d", VSLY, pop_weight),
+        "YLL_per_million": YLL/(N_tot/1e6)
+    }).to_csv(dst/f"IDFC_{today.strftime('%b%d')}.csv")
+
+if __name__ == "__main__":
+    # today = pd.Timestamp.now()
+    today = pd.Timestamp("March 28, 2021")
+    export(today)